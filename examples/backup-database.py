@@ -4,10 +4,11 @@
 #
 # This script backs up the named databases. Or all databases.
 
-import argparse, json, logging, re, sys, time
+import argparse, json, logging, re, sys
 from marklogic.exceptions import UnsupportedOperation
 from marklogic.connection import Connection
 from marklogic.models.database import Database
+from marklogic.models.database.backup import BackupScheduler, job_state
 from marklogic import MarkLogic
 from requests.auth import HTTPDigestAuth
 from resources import TestConnection as tc
@@ -24,6 +25,8 @@ class BackupDatabases:
         self.lag_limit       = 30
         self.incremental     = False
         self.max_parallel    = 5
+        self.max_per_host    = None
+        self.max_per_target  = None
         self.dry_run         = False
 
     # TODO: better checking of argument types
@@ -66,6 +69,14 @@ class BackupDatabases:
         self.max_parallel = max_parallel
         return self
 
+    def set_max_per_host(self, max_per_host):
+        self.max_per_host = max_per_host
+        return self
+
+    def set_max_per_target(self, max_per_target):
+        self.max_per_target = max_per_target
+        return self
+
     def set_dry_run(self, dry_run):
         self.dry_run = dry_run
         return self
@@ -91,68 +102,37 @@ class BackupDatabases:
                 raise UnsupportedOperation("Database does not exist: {0}"
                                            .format(dbname))
 
-        maxp = self.max_parallel
-        running = 0
-        done = False
-        queue = self.databases
-        status_list = {}
-        min_wait = 5
-        max_wait = 30
-        wait_incr = 5
-        wait = min_wait
-
-        while not done:
-            done = True
+        if self.dry_run:
+            for dbname in self.databases:
+                print("Backing up {0}".format(dbname))
+            return
 
-            while len(queue) > 0 and running < maxp:
-                dbname = queue.pop(0)
-                running += 1
-                done = False
+        scheduler = BackupScheduler(conn, max_per_host=self.max_per_host,
+                                    max_per_target=self.max_per_target,
+                                    max_running=self.max_parallel)
+        backups = {}
+        for dbname in self.databases:
+            print("Backing up {0}".format(dbname))
+            backup_dir = self.backup_root + dbname
+            incremental_dir = None
+            if self.incremental:
+                incremental_dir = backup_dir
+            backups[dbname] = scheduler.backup(
+                dbname, backup_dir,
+                journal_archiving=self.journal_arch,
+                lag_limit=self.lag_limit,
+                incremental=self.incremental,
+                incremental_dir=incremental_dir)
+
+        scheduler.wait()
 
-                print("Backing up {0}".format(dbname))
-                if not self.dry_run:
-                    db = self.marklogic.database(dbname)
-                    bkp = db.backup(self.backup_root + dbname, connection=conn)
-                    status_list[dbname] = bkp
-                    response = bkp.status()
-                    if response['status'] != 'in-progress':
-                        print("{0}: {1}".format(dbname, response['status']))
-
-            if self.dry_run:
-                if running > 0 or len(queue) > 0:
-                    print("{0} backups in dry-run; {1} in queue..."
-                          .format(running, len(queue)))
-                    running = 0
+        for dbname in self.databases:
+            future = backups[dbname]
+            if future.exception() is None:
+                state, progress = job_state(future.result().last_status)
+                print("{0}: {1}".format(dbname, state))
             else:
-                if len(status_list) > 0:
-                    new_list = {}
-                    for dbname in status_list:
-                        bkp = status_list[dbname]
-                        response = bkp.status()
-                        print("{0}: {1}".format(dbname, response['status']))
-                        if response['status'] == 'in-progress':
-                            done = False
-                            new_list[dbname] = bkp
-                        else:
-                            running -= 1
-                            wait = min_wait
-
-                    done = done and len(queue) == 0
-
-                    if not done:
-                        status_list = new_list
-                        if running < maxp and len(queue) != 0:
-                            print("Running: {0} backups running; {1} in queue..."
-                                  .format(running, len(queue)))
-                            wait = min_wait
-                            print("")
-                        else:
-                            print("Waiting {0}s: {1} backups running; {2} in queue..."
-                                  .format(wait, running, len(queue)))
-                            time.sleep(wait)
-                            if wait < max_wait:
-                                wait += wait_incr
-                            print("")
+                print("{0}: {1}".format(dbname, future.exception()))
 
 def main():
     parser = argparse.ArgumentParser(description="Backup databases")
@@ -174,7 +154,11 @@ def main():
                         help='Perform incremental backup')
     parser.add_argument('--max-parallel', default=5, type=int,
                         help='Maximum number of backups to run in parallel.')
-    parser.add_argument('--lag-limit',
+    parser.add_argument('--max-per-host', type=int,
+                        help='Maximum number of backups running on any host.')
+    parser.add_argument('--max-per-target', type=int,
+                        help='Maximum number of backups writing to the same backup directory.')
+    parser.add_argument('--lag-limit', default=30, type=int,
                         help='The lag limit')
     parser.add_argument('--dry-run', action='store_true',
                         help="Just print the JSON, don't actually create forests")
@@ -206,6 +190,10 @@ def main():
             backup.set_lag_limit(arg)
         elif opt == 'max_parallel':
             backup.set_max_parallel(arg)
+        elif opt == 'max_per_host':
+            backup.set_max_per_host(arg)
+        elif opt == 'max_per_target':
+            backup.set_max_per_target(arg)
         elif opt == 'database':
             backup.set_database(arg)
         elif opt == 'dry_run':
@@ -8,7 +8,6 @@ import logging
 import argparse
 from requests.auth import HTTPDigestAuth
 from marklogic import MarkLogic
-from marklogic.models.host import Host
 from marklogic.connection import Connection
 from marklogic.exceptions import *
 
@@ -106,18 +105,37 @@ class Docker:
         else:
             bootip = self.ipaddr[self.bootimage]
 
-        if self.ml_init(bootip, self.bootimage):
-            self.ml_security(bootip, self.bootimage)
-
-        conn = Connection(bootip, HTTPDigestAuth(self.adminuser, self.adminpass))
-        self.marklogic = MarkLogic(conn)
+        # All of the containers are initialized and joined concurrently
+        joining = [container for container in self.cluster_list
+                   if container != self.bootimage]
+        for container in [self.bootimage] + joining:
+            if container in self.hostname:
+                print("{0}: initialize host {1}..." \
+                          .format(self.ipaddr.get(container, bootip),
+                                  self.hostname[container]))
+
+        # Each container is recorded as soon as it has been initialized,
+        # so that it isn't reused even if the bootstrap fails
+        containers = dict([(self.ipaddr[container], container)
+                           for container in joining])
+        if not self.localimage:
+            containers[bootip] = self.bootimage
 
-        for container in self.cluster_list:
+        def initialized(ip):
+            if ip not in containers:
+                return
+            container = containers[ip]
             if container == self.bootimage:
-                continue
-            ip = self.ipaddr[container]
-            self.ml_init(ip, container)
-            self.ml_join(bootip, ip)
+                if container not in self.blacklist:
+                    self.blacklist[container] = "boot"
+            else:
+                self.blacklist[container] = "used"
+            self.save_blacklist()
+
+        self.marklogic = MarkLogic.bootstrap_cluster(
+            bootip, [self.ipaddr[container] for container in joining],
+            self.realm, self.adminuser, self.adminpass,
+            initialized=initialized)
 
         if self.name is not None:
             print("{0}: rename cluster...".format(bootip))
@@ -138,34 +156,6 @@ class Docker:
 
         print("Finished")
 
-    def ml_init(self, ip, container):
-        if container in self.hostname:
-            hostname = self.hostname[container]
-        else:
-            hostname = container
-        print("{0}: initialize host {1}...".format(ip, hostname))
-        try:
-            host = MarkLogic.instance_init(ip)
-        except UnauthorizedAPIRequest:
-            # Assume that this happened because the host is already initialized
-            host = Host(ip)
-
-        self.blacklist[container] = "used"
-        self.save_blacklist()
-        return host.just_initialized()
-
-    def ml_join(self, bootip, ip):
-        print("{0}: join cluster with {1}...".format(ip, bootip))
-        cluster = self.marklogic.cluster()
-        host = Host(ip)
-        cluster.add_host(host)
-
-    def ml_security(self, ip, container):
-        print("{0}: initialize security...".format(ip))
-        MarkLogic.instance_admin(ip, self.realm, self.adminuser, self.adminpass)
-        self.blacklist[container] = "boot"
-        self.save_blacklist()
-
     def pick_image(self, name):
         if name is None:
             for container in self.container_list:
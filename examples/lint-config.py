@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# This script reports database, group and app server settings that are
+# expensive in production. It reads the configuration from a cluster or
+# from a JSON snapshot (saved with --save, or made by get-config.py).
+#
+# For example:
+#
+# python3 lint-config.py --save /tmp/snapshot.json
+# python3 lint-config.py --json /tmp/snapshot.json --usage phrase,wildcard
+
+import argparse, json, logging, sys
+from requests.auth import HTTPDigestAuth
+from marklogic.connection import Connection
+from marklogic.models.linter import ConfigLinter, SEVERITIES, snapshot
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", action='store', default="localhost",
+                    help="Management API host")
+parser.add_argument("--username", action='store', default="admin",
+                    help="User name")
+parser.add_argument("--password", action='store', default="admin",
+                    help="Password")
+parser.add_argument("--json", action='store',
+                    help="Lint this snapshot instead of the cluster")
+parser.add_argument("--save", action='store',
+                    help="Save the cluster snapshot to this file")
+parser.add_argument("--usage", action='store',
+                    help="Comma separated query features the applications use")
+parser.add_argument("--memory", action='store', type=int,
+                    help="Host memory in megabytes")
+parser.add_argument("--severity", action='store', default="info",
+                    choices=SEVERITIES,
+                    help="Only report findings at this severity or above")
+parser.add_argument('--debug', action='store_true',
+                    help='Enable debug logging')
+args = parser.parse_args()
+
+if args.debug:
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("marklogic").setLevel(logging.DEBUG)
+
+if args.json:
+    with open(args.json) as data_file:
+        config = json.load(data_file)
+else:
+    conn = Connection(args.host, HTTPDigestAuth(args.username, args.password))
+    config = snapshot(conn)
+    if args.save:
+        with open(args.save, "w") as data_file:
+            json.dump(config, data_file)
+
+usage = None
+if args.usage is not None:
+    usage = [feature for feature in args.usage.split(",") if feature]
+
+linter = ConfigLinter(usage=usage, host_memory=args.memory,
+                      min_severity=args.severity)
+findings = linter.lint_snapshot(config)
+for finding in findings:
+    print(finding)
+    if finding.fix() is not None:
+        print("\tfix: {0}".format(finding.fix()))
+
+sys.exit(1 if [f for f in findings if f.severity != "info"] else 0)
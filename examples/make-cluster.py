@@ -8,7 +8,6 @@ import logging
 import argparse
 from requests.auth import HTTPDigestAuth
 from marklogic import MarkLogic
-from marklogic.models.host import Host
 from marklogic.connection import Connection
 from marklogic.exceptions import *
 
@@ -63,15 +62,12 @@ class App:
             self.boothost = self.host[0]
             self.host.remove(self.boothost)
 
-        if self.ml_init(self.boothost):
-            self.ml_security(self.boothost)
-
-        conn = Connection(self.boothost, HTTPDigestAuth(self.adminuser, self.adminpass))
-        self.marklogic = MarkLogic(conn)
-
-        for hostname in self.host:
-            self.ml_init(hostname)
-            self.ml_join(self.boothost, hostname)
+        # All of the hosts are initialized and joined concurrently
+        print("{0}: initialize cluster with {1}...".format(self.boothost,
+                                                           ", ".join(self.host)))
+        self.marklogic = MarkLogic.bootstrap_cluster(self.boothost, self.host,
+                                                     self.realm, self.adminuser,
+                                                     self.adminpass)
 
         if self.name is not None:
             print("{0}: rename cluster...".format(self.boothost))
@@ -92,26 +88,6 @@ class App:
 
         print("Finished")
 
-    def ml_init(self, hostname):
-        print("{0}: initialize host...".format(hostname))
-        try:
-            host = MarkLogic.instance_init(hostname)
-        except UnauthorizedAPIRequest:
-            # Assume that this happened because the host is already initialized
-            host = Host(hostname)
-
-        return host.just_initialized()
-
-    def ml_join(self, boothost, hostname):
-        print("{0}: join cluster with {1}...".format(hostname, boothost))
-        cluster = self.marklogic.cluster()
-        host = Host(hostname)
-        cluster.add_host(host)
-
-    def ml_security(self, hostname):
-        print("{0}: initialize security...".format(hostname))
-        MarkLogic.instance_admin(hostname, self.realm, self.adminuser, self.adminpass)
-
 def main():
     parser = argparse.ArgumentParser(
         description="Join MarkLogic server instances into a cluster")
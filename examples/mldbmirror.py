@@ -16,13 +16,15 @@
 from __future__ import unicode_literals, print_function, absolute_import
 
 import argparse
-import io
+import hashlib
 import json
 import logging
-import math
 import os
 import re
+import shutil
 import sys
+import threading
+import time
 import uuid
 import xml.etree.ElementTree as ET
 from datetime import datetime
@@ -32,11 +34,27 @@ from marklogic.client.clientutils import ClientUtils
 from marklogic.client.documents import Documents
 from marklogic.client.bulkloader import BulkLoader
 from marklogic.client.transactions import Transactions
-from requests_toolbelt import MultipartDecoder
+from marklogic.utilities.concurrency import imap, pipeline
+from marklogic.utilities.files import compile_patterns, file_hashes, walk_files
+from marklogic.utilities.mergejoin import merge_join
+from marklogic.utilities.metadatastore import MetadataStore
+from marklogic.utilities.manifest import SyncManifest
 
 CONFIGFILE = ".mldbmirror-config.json"
+PROGRESSFILE = ".mldbmirror-progress.json"
+MANIFESTFILE = ".mldbmirror-manifest.db"
+METADATASTORE = "metadata.db"
+PRIVATEFILES = [CONFIGFILE, PROGRESSFILE, MANIFESTFILE,
+                MANIFESTFILE + "-wal", MANIFESTFILE + "-shm"]
 BULKTHRESHOLD = 10 * 1000 * 1024      # 10Mb
 BATCHSIZE = 1000
+THREADS = 4
+DECODETHREADS = 2
+WRITETHREADS = 4
+SPOOLTHRESHOLD = 1024 * 1024          # 1Mb
+
+_PRIVATE = re.compile(".*/(" + "|".join([re.escape(name) for name in PRIVATEFILES]) \
+                          + ")$")
 
 class MarkLogicDatabaseMirror:
     def __init__(self):
@@ -45,21 +63,40 @@ class MarkLogicDatabaseMirror:
         self.config = None
         self.connection = None
         self.database = None
+        self.decode_threads = DECODETHREADS
         self.dryrun = False
         self.hostname = None
+        self.compact = False
         self.list = None
+        self.manifest = None
+        self.metadata_store = None
         self.mdir = None
         self.mirror = False
+        self.partition_size = 0
         self.path = None
         self.port = None
+        self.read_timestamp = None
         self.management_port = None
         self.regex = []
         self.root = None
+        self.streaming = False
+        self.threads = THREADS
         self.threshold = BULKTHRESHOLD
         self.ucdir = None
         self.umdir = None
+        self.use_hash = False
+        self.use_manifest = False
         self.utils = None
+        self.validate = False
         self.verbose = False
+        self.write_threads = WRITETHREADS
+        self._cregex = None
+        self._lock = threading.Lock()
+        self._manifest_removals = []
+        self._manifest_updates = []
+        self._ulcount = 0
+        self._upload_count = 0
+        self._uploaded_map = {}
         self.logger = logging.getLogger("marklogic.examples.mldbmirror")
 
     def connect(self, args):
@@ -113,18 +150,34 @@ class MarkLogicDatabaseMirror:
             logging.getLogger("marklogic").setLevel(logging.DEBUG)
 
         self.batchsize = args['batchsize']
+        self.compact = args['compact']
         self.database = args['database']
+        self.decode_threads = args['decode_threads']
         self.dryrun = args['dryrun']
         self.list = args['list']
         self.mirror = args['mirror']
+        self.partition_size = args['partition_size']
         self.regex = args['regex']
         self.root = args['root']
+        self.streaming = args['streaming']
+        self.threads = args['threads']
         self.threshold = args['threshold']
+        self.use_hash = args['hash']
+        self.use_manifest = args['manifest']
+        self.validate = args['validate']
         self.verbose = args['verbose']
+        self.write_threads = args['write_threads']
 
         if self.list and self.regex:
             raise RuntimeError("You must not specify both --regex and --list")
 
+        if self.streaming and (self.mirror or self.list or self.use_hash \
+                                   or self.use_manifest or self.partition_size \
+                                   or self.validate):
+            raise RuntimeError("--streaming can't be combined with --mirror, "
+                               + "--list, --hash, --manifest, --partition-size "
+                               + "or --validate")
+
         if self.root.endswith("/"):
             self.root = self.root[0:len(self.root)-1]
 
@@ -136,42 +189,60 @@ class MarkLogicDatabaseMirror:
 
     def upload(self):
         """Upload data"""
+        # Partitioned uploads use a transaction per partition
+        transactional = not self.dryrun and not self.partition_size
         trans = Transactions(self.connection)
-        if not self.dryrun:
+        if transactional:
             trans.set_database(self.database)
             trans.set_timeLimit(trans.max_timeLimit())
             trans.create()
-            txid = trans.txid()
 
         mirror = True
         for name in os.listdir(self.path):
-            if not name in ['content', 'metadata', 'ucontent', 'umetadata']:
+            if not name in ['content', 'metadata', 'ucontent', 'umetadata', \
+                                METADATASTORE, METADATASTORE + "-journal"] \
+              + PRIVATEFILES:
                 mirror = False
 
         if self.mirror and not mirror:
             raise RuntimeError("Path doesn't point to a mirror directory")
 
+        if self.partition_size:
+            trans = None
+
         try:
-            if mirror:
+            if self.streaming:
+                self._upload_streaming(trans)
+            elif mirror:
                 self._upload_mirror(trans)
             else:
                 self._upload_directory(trans)
         except KeyboardInterrupt:
-            if not self.dryrun:
+            if transactional:
                 trans.rollback()
         except:
-            if not self.dryrun:
+            if transactional:
                 trans.rollback()
             raise
         else:
-            if not self.dryrun:
+            if transactional:
                 trans.commit()
+            self._flush_manifest()
+            if self.validate and not self.dryrun:
+                self._validate_upload(self._uploaded_map)
+        finally:
+            self._close_manifest()
+            self._close_metadata_store()
 
     def _upload_mirror(self, trans):
         """Internal method for uploading a mirror."""
 
         upload_map = {}
 
+        if os.path.exists(self.path + "/" + METADATASTORE):
+            self._upload_compact_mirror(trans)
+            return
+
         # Before we start, make sure the mirror isn't corrupted.
         # We check that every content file has a corresponding metadata file.
         # We don't check the other way around; if you delete some content, you
@@ -208,6 +279,95 @@ class MarkLogicDatabaseMirror:
 
         self._upload_map(trans, upload_map)
 
+    def _upload_compact_mirror(self, trans):
+        """Internal method for uploading a mirror with a metadata store."""
+        self.metadata_store = MetadataStore(self.path + "/" + METADATASTORE)
+
+        print("Reading metadata store...")
+        stored = {}
+        for uri, path in self.metadata_store.paths():
+            stored[path] = uri
+
+        print("Reading files from filesystem...")
+        upload_map = {}
+        missing = []
+        for subdir in ["content", "ucontent"]:
+            cpath = "{}/{}".format(self.path, subdir)
+            if not os.path.exists(cpath):
+                continue
+            for check in self.scan(cpath, root=cpath):
+                path = "/" + subdir + check
+                if path in stored:
+                    upload_map[check] = {"content": cpath + check, \
+                                             "stored": path, \
+                                             "uri": stored[path]}
+                    if subdir == "ucontent":
+                        upload_map[check]['uuid'] = True
+                else:
+                    missing.append(path)
+
+        if missing:
+            print("No metadata for:", missing)
+            raise RuntimeError("Mirror corrupt")
+
+        self._upload_map(trans, upload_map)
+
+    def convert_mirror(self):
+        """Move the metadata files of a mirror into a metadata store.
+
+        The metadata/ and umetadata/ directories are removed once every
+        file has been copied into the store.
+        """
+        storefile = self.path + "/" + METADATASTORE
+        if os.path.exists(storefile):
+            raise RuntimeError("Mirror already has a metadata store")
+
+        count = 0
+        with MetadataStore(storefile) as store:
+            for subdir in ["metadata", "umetadata"]:
+                mpath = "{}/{}".format(self.path, subdir)
+                if not os.path.exists(mpath):
+                    continue
+                for check in self.scan(mpath, root=mpath):
+                    with open(mpath + check, "rb") as metaf:
+                        meta = metaf.read()
+                    if subdir == "umetadata":
+                        txml = ET.fromstring(meta) \
+                          .find("{http://marklogic.com/ns/mldbmirror/}uri")
+                        if txml is None:
+                            raise RuntimeError("No URI provided in metadata: {}" \
+                                                   .format(mpath + check))
+                        uri = txml.text
+                        path = "/ucontent" + check
+                    else:
+                        uri = check
+                        path = "/content" + check
+                    # Keep the file's time, so that a manifest still
+                    # sees the document as unchanged
+                    store.put(uri, path, meta, \
+                                  os.stat(mpath + check).st_mtime)
+                    count += 1
+
+        if self.dryrun:
+            os.remove(storefile)
+        else:
+            for subdir in ["metadata", "umetadata"]:
+                if os.path.exists(self.path + "/" + subdir):
+                    shutil.rmtree(self.path + "/" + subdir)
+        print("Converted metadata for {} documents.".format(count))
+
+    def _read_metadata(self, stanza):
+        """Return the root element of the metadata for a document."""
+        if 'stored' in stanza:
+            return ET.fromstring(self.metadata_store.get(stanza['uri']))
+        return ET.parse(stanza['metadata']).getroot()
+
+    def _close_metadata_store(self):
+        """Close the metadata store, if one is open."""
+        if self.metadata_store is not None:
+            self.metadata_store.close()
+            self.metadata_store = None
+
     def _upload_directory(self, trans):
         """Internal method for uploading a directory."""
 
@@ -233,49 +393,268 @@ class MarkLogicDatabaseMirror:
 
     def _upload_map(self, trans, upload_map):
         """Upload from an internally constructed map."""
+        self._open_manifest()
+        if self.manifest is not None:
+            urihash = self._manifest_changes(upload_map)
+        else:
+            urihash = self._server_changes(upload_map)
+
+        upload_count = len(upload_map)
+        print("Uploading {} files...".format(upload_count))
+
+        files = list(upload_map.keys())
+        self._ulcount = 0
+        self._upload_count = upload_count
+
+        if trans is None:
+            failed = self._upload_partitions(upload_map, files, urihash)
+        else:
+            failed = False
+            bulk = BulkLoader(self.connection)
+            bulk.set_database(self.database)
+            bulk.set_txid(trans.txid())
+            uploaded = self._upload_files(bulk, upload_map, files)
+            for doc, target in uploaded:
+                if target in urihash:
+                    del urihash[target]
+            self._record_uploads(upload_map, uploaded)
+
+        if failed:
+            raise RuntimeError("Upload incomplete, rerun to retry failed partitions")
+
+        self._uploaded_map = upload_map
+
+        docs = Documents(self.connection)
+        if trans is not None:
+            docs.set_txid(trans.txid())
+        docs.set_database(self.database)
+        delcount = 0
+        delpaths = []
+        for uri in urihash:
+            if uri.startswith(self.root):
+                if self.verbose:
+                    print("DEL {}".format(uri))
+                docs.add_uri(uri)
+                delpaths.append(urihash[uri])
+                delcount += 1
+
+        if delcount > 0:
+            if self.regex or self.list:
+                print("Limited download, not deleting {} files..." \
+                          .format(delcount))
+            else:
+                print("Deleting {} URIs...".format(delcount))
+                if not self.dryrun:
+                    docs.delete()
+                    self._record_removals(delpaths)
+
+    def _server_changes(self, upload_map):
+        """Remove files that are older than their documents from upload_map.
+
+        Returns a dictionary of the URIs on the server.
+        """
         print("Reading URIs from server...")
         uris = self.utils.uris(self.database)
         urihash = {}
         for uri in uris:
-            urihash[uri] = 1
+            urihash[uri] = None
+
+        if self.use_hash:
+            uptodate = self._unchanged_by_hash(upload_map)
+        else:
+            uptodate = self._unchanged_by_timestamp(upload_map)
+
+        if uptodate:
+            print("{} documents are up-to-date...".format(len(uptodate)))
+            for key in uptodate:
+                # remove it from urihash so we don't delete it
+                self._forget_target(upload_map, key, urihash)
+                del upload_map[key]
 
+        return urihash
+
+    def _unchanged_by_timestamp(self, upload_map):
+        """Return the files that are older than their documents."""
         print("Getting timestamps from server...")
         stamps = self.get_timestamps(list(upload_map))
         if not stamps:
             print("No timestamps, assuming all files newer.")
-        else:
-            uptodate = []
-            for key in upload_map:
-                if key in stamps:
-                    source = upload_map[key]['content']
-                    statinfo = os.stat(source)
-                    stamp = self._convert_timestamp(stamps[key])
-                    if statinfo.st_mtime < stamp.timestamp():
-                        uptodate.append(key)
-
-            if uptodate:
-                print("{} documents are up-to-date...".format(len(uptodate)))
-                for key in uptodate:
-                    del upload_map[key]
-                    del urihash[key]    # remove it from this list so we don't delete it
-
-        upload_count = len(upload_map)
-        print("Uploading {} files...".format(upload_count))
+            return []
+
+        uptodate = []
+        for key in upload_map:
+            if key in stamps:
+                source = upload_map[key]['content']
+                statinfo = os.stat(source)
+                stamp = self._convert_timestamp(stamps[key])
+                if statinfo.st_mtime < stamp.timestamp():
+                    uptodate.append(key)
+        return uptodate
+
+    def _unchanged_by_hash(self, upload_map):
+        """Return the files whose content is the same as their documents.
+
+        Only content is compared; in a mirror, a change to a metadata
+        file alone is not detected. The server only hashes binary and
+        text documents, the other files are compared by timestamp.
+        """
+        targets = {}
+        for key in upload_map:
+            targets[self._target(upload_map, key)] = key
+
+        print("Getting hashes from server...")
+        remote = self.utils.content_hashes(self.database, list(targets), \
+                                               concurrency=self.threads)
+        remote = dict([(uri, remote[uri]) for uri in remote if uri in targets])
+
+        print("Hashing {} local files...".format(len(remote)))
+        local = file_hashes([upload_map[targets[uri]]['content'] \
+                                 for uri in remote])
+
+        uptodate = []
+        for uri in remote:
+            key = targets[uri]
+            if local[upload_map[key]['content']] == remote[uri]:
+                uptodate.append(key)
+
+        unhashed = dict([(targets[uri], upload_map[targets[uri]]) \
+                             for uri in targets if uri not in remote])
+        if unhashed:
+            uptodate.extend(self._unchanged_by_timestamp(unhashed))
+        return uptodate
+
+    def _manifest_changes(self, upload_map):
+        """Remove files that are unchanged since the last run from upload_map.
+
+        The manifest records every file that has been synchronized, so
+        neither the URI lexicon nor the document timestamps need to be
+        read from the server. Returns a dictionary of the URIs of files
+        in the manifest that no longer exist locally, mapped to their
+        manifest paths.
+        """
+        print("Comparing files with manifest...")
+        uptodate = []
+        for key in upload_map:
+            mtime, size = self._local_stat(upload_map[key])
+            if self.manifest.unchanged(key, mtime, size):
+                uptodate.append(key)
+
+        if uptodate:
+            print("{} documents are unchanged...".format(len(uptodate)))
+            for key in uptodate:
+                del upload_map[key]
+        uptodate = set(uptodate)
 
-        docs = Documents(self.connection)
+        urihash = {}
+        for entry in self.manifest.entries():
+            path = entry['path']
+            if path not in upload_map and path not in uptodate:
+                urihash[entry['uri']] = path
+        return urihash
+
+    def _upload_streaming(self, trans):
+        """Upload a directory by merge-joining sorted listings.
+
+        The local files and the server URIs (with their timestamps) are
+        both read in sorted order and compared a pair at a time, so
+        memory use doesn't depend on the size of the directory or the
+        database. Batches of uploads and deletes are handed to the
+        transfer threads as soon as they fill.
+        """
+        print("Comparing files with server...")
+        self._ulcount = 0
+        self._upload_count = 0
+
+        local = ((self.root + path, path) \
+                     for path, entry in walk_files(self.path, exclude=_PRIVATE, \
+                                                       ordered=True))
+        prefix = self.root if self.root else None
+        remote = self.utils.iter_last_modified( \
+            self.database, self.utils.iter_uris(self.database, prefix=prefix), \
+            concurrency=self.threads, ordered=True)
+
+        def actions():
+            for uri, litem, ritem in merge_join(local, remote):
+                if not self._selected(uri):
+                    continue
+                if litem is None:
+                    yield ("delete", uri)
+                elif ritem is None or ritem[1] is None:
+                    yield ("upload", litem[1])
+                else:
+                    stamp = self._convert_timestamp(ritem[1])
+                    mtime = os.stat(self.path + litem[1]).st_mtime
+                    if mtime >= stamp.timestamp():
+                        yield ("upload", litem[1])
+
+        txid = None if trans is None else trans.txid()
+
+        def transfer(batch):
+            kind, items = batch
+            if kind == "upload":
+                bulk = BulkLoader(self.connection)
+                bulk.set_database(self.database)
+                bulk.set_txid(txid)
+                upload_map = {}
+                for path in items:
+                    upload_map[path] = {"content": self.path + path}
+                self._upload_files(bulk, upload_map, items)
+            else:
+                for uri in items:
+                    if self.verbose:
+                        print("DEL {}".format(uri))
+                if self.regex:
+                    print("Limited upload, not deleting {} files..." \
+                              .format(len(items)))
+                else:
+                    print("Deleting {} URIs...".format(len(items)))
+                    if not self.dryrun:
+                        docs = Documents(self.connection)
+                        docs.set_database(self.database)
+                        docs.set_txid(txid)
+                        docs.set_uris(items)
+                        docs.delete()
+            return len(items)
+
+        total = 0
+        for count in imap(transfer, self._batch_actions(actions()), \
+                              self.threads):
+            total += count
+        print("{} files changed.".format(total))
+
+    def _batch_actions(self, actions):
+        """Group a stream of (kind, item) actions into batches by kind."""
+        batches = {}
+        for kind, item in actions:
+            batch = batches.setdefault(kind, [])
+            batch.append(item)
+            if len(batch) >= self.batchsize:
+                yield (kind, batch)
+                batches[kind] = []
+        for kind in sorted(batches):
+            if batches[kind]:
+                yield (kind, batches[kind])
+
+    def _selected(self, uri):
+        """Return True if uri passes the --regex filters."""
+        if not self.regex:
+            return True
+        if self._cregex is None:
+            self._cregex = compile_patterns(self.regex)
+        for exp in self._cregex:
+            if exp.match(uri):
+                return True
+        return False
 
-        bulk = BulkLoader(self.connection)
-        bulk.set_database(self.database)
-        bulk.set_txid(trans.txid())
+    def _upload_files(self, bulk, upload_map, files):
+        """Upload files in batches with the bulk loader.
 
-        files = list(upload_map.keys())
-        done = not files
+        Returns a list of (file, URI) pairs for the documents uploaded.
+        """
+        docs = Documents(self.connection)
+        uploaded = []
         upload_size = 0
-        ulcount = 0
-        while not done:
-            doc = files.pop(0)
-            done = not files
-
+        for doc in files:
             docs.clear()
 
             source = upload_map[doc]['content']
@@ -283,10 +662,8 @@ class MarkLogicDatabaseMirror:
 
             body_content_type = "application/octet-stream"
 
-            if 'metadata' in upload_map[doc]:
-                metasource = upload_map[doc]['metadata']
-                metaxml = ET.parse(metasource)
-                root = metaxml.getroot()
+            if 'metadata' in upload_map[doc] or 'stored' in upload_map[doc]:
+                root = self._read_metadata(upload_map[doc])
 
                 txml = root \
                   .find("{http://marklogic.com/ns/mldbmirror/}content-type")
@@ -306,7 +683,6 @@ class MarkLogicDatabaseMirror:
                 text = ET.tostring(root, encoding="unicode", method="xml")
                 docs.set_metadata(text, "application/xml")
             else:
-                metasource = None
                 collections = []
                 permissions = []
 
@@ -335,10 +711,7 @@ class MarkLogicDatabaseMirror:
                     for key in perm:
                         docs.add_permission(key, perm[key])
 
-            if target in urihash:
-                del urihash[target]
-
-            ulcount += 1
+            uploaded.append((doc, target))
             statinfo = os.stat(source)
             upload_size += statinfo.st_size
 
@@ -354,67 +727,350 @@ class MarkLogicDatabaseMirror:
                 print("-> {}".format(target))
 
             if upload_size > self.threshold:
-                perc = (float(ulcount) / upload_count) * 100.0
-                print("{0:.0f}% ... {1} files, {2} bytes" \
-                          .format(perc, bulk.size(), upload_size))
-                if self.dryrun:
-                    bulk.clear_content()
-                else:
-                    bulk.post()
+                self._post_batch(bulk, upload_size)
                 upload_size = 0
 
         if bulk.size() > 0:
-            perc = (float(ulcount) / upload_count) * 100.0
-            print("{0:.0f}% ... {1} files, {2} bytes" \
-                      .format(perc, bulk.size(), upload_size))
-            if self.dryrun:
-                bulk.clear_content()
+            self._post_batch(bulk, upload_size)
+
+        return uploaded
+
+    def _post_batch(self, bulk, upload_size):
+        """Post a batch of documents from the bulk loader."""
+        with self._lock:
+            self._ulcount += bulk.size()
+            if self._upload_count:
+                perc = (float(self._ulcount) / self._upload_count) * 100.0
+                print("{0:.0f}% ... {1} files, {2} bytes" \
+                          .format(perc, bulk.size(), upload_size))
+            else:
+                print("{0} ... {1} files, {2} bytes" \
+                          .format(self._ulcount, bulk.size(), upload_size))
+        if self.dryrun:
+            bulk.clear_content()
+        else:
+            bulk.post()
+
+    def _upload_partitions(self, upload_map, files, urihash):
+        """Upload files in partitions, each in its own transaction.
+
+        Up to self.threads partitions are uploaded concurrently. The
+        outcome of each partition is recorded in the progress file, so
+        that rerunning an interrupted or failed upload skips partitions
+        that have already been committed. A partition is only skipped if
+        none of its files have changed since. The progress file is
+        removed when every partition has committed. Returns True if any
+        partition failed.
+        """
+        files = sorted(files)
+        progress = self._load_progress()
+        partitions = []
+        for index in range(0, len(files), self.partition_size):
+            part = files[index:index+self.partition_size]
+            digest = self._partition_key(upload_map, part)
+            if digest in progress and progress[digest]['status'] == 'done':
+                print("Skipping committed partition {}..{}" \
+                          .format(part[0], part[-1]))
+                for doc in part:
+                    self._forget_target(upload_map, doc, urihash)
             else:
-                bulk.post()
+                partitions.append((digest, part))
 
-        docs.clear()
-        docs.set_txid(trans.txid())
-        docs.set_database(self.database)
-        delcount = 0
-        for uri in urihash:
-            if uri.startswith(self.root):
-                if self.verbose:
-                    print("DEL {}".format(uri))
-                docs.add_uri(uri)
-                delcount += 1
+        print("Uploading {} partitions...".format(len(partitions)))
 
-        if delcount > 0:
-            if self.regex or self.list:
-                print("Limited download, not deleting {} files..." \
-                          .format(delcount))
+        if self.dryrun:
+            time_limit = None
+        else:
+            time_limit = Transactions(self.connection).max_timeLimit()
+
+        def upload(partition):
+            digest, part = partition
+            try:
+                if self.dryrun:
+                    bulk = BulkLoader(self.connection)
+                    bulk.set_database(self.database)
+                    uploaded = self._upload_files(bulk, upload_map, part)
+                else:
+                    trans = Transactions(self.connection)
+                    trans.set_database(self.database)
+                    trans.set_timeLimit(time_limit)
+                    with trans:
+                        uploaded = self._upload_files(trans.bulkloader(), \
+                                                          upload_map, part)
+                return (digest, part, uploaded, None)
+            except Exception as err:
+                return (digest, part, None, err)
+
+        failed = False
+        for digest, part, uploaded, err in imap(upload, partitions, self.threads):
+            entry = {"first": part[0], "last": part[-1], "count": len(part)}
+            if err is None:
+                entry['status'] = 'done'
+                for doc, target in uploaded:
+                    if target in urihash:
+                        del urihash[target]
+                self._record_uploads(upload_map, uploaded)
+                self._flush_manifest()
             else:
-                print("Deleting {} URIs...".format(delcount))
-                if not self.dryrun:
-                    docs.delete()
+                failed = True
+                entry['status'] = 'failed'
+                entry['error'] = str(err)
+                print("Partition {}..{} failed: {}".format(part[0], part[-1], err))
+            if not self.dryrun:
+                progress[digest] = entry
+                self._save_progress(progress)
+
+        if not failed and not self.dryrun:
+            self._remove_progress()
+
+        return failed
+
+    def _partition_key(self, upload_map, part):
+        """Return a key for a partition that changes if any of its files do."""
+        lines = []
+        for doc in part:
+            mtime, size = self._local_stat(upload_map[doc])
+            lines.append("{}\t{!r}\t{}".format(doc, mtime, size))
+        return hashlib.sha1("\n".join(lines).encode('utf-8')).hexdigest()
+
+    def _target(self, upload_map, doc):
+        """Return the URI a file uploads to."""
+        target = self.root + doc
+        if 'uuid' in upload_map[doc] and upload_map[doc]['uuid']:
+            root = self._read_metadata(upload_map[doc])
+            txml = root.find("{http://marklogic.com/ns/mldbmirror/}uri")
+            if txml is not None:
+                target = txml.text
+        return target
+
+    def _forget_target(self, upload_map, doc, urihash):
+        """Keep the URI a file uploads to from being deleted."""
+        target = self._target(upload_map, doc)
+        if target in urihash:
+            del urihash[target]
+
+    def _validate_upload(self, upload_map):
+        """Check that every file uploaded is present on the server."""
+        print("Validating upload...")
+        expected = set()
+        for doc in upload_map:
+            expected.add(self._target(upload_map, doc))
+
+        for uri in self.utils.iter_uris(self.database):
+            expected.discard(uri)
+
+        if expected:
+            for uri in sorted(expected):
+                print("Missing:", uri)
+            raise RuntimeError("{} documents did not upload".format(len(expected)))
+        print("All {} documents present.".format(len(upload_map)))
+
+    def _load_progress(self):
+        """Load the partition progress file, if there is one."""
+        progfile = self.path + "/" + PROGRESSFILE
+        if os.path.isfile(progfile):
+            with open(progfile) as data:
+                return json.load(data)
+        return {}
+
+    def _save_progress(self, progress):
+        """Save the partition progress file."""
+        progfile = self.path + "/" + PROGRESSFILE
+        with open(progfile + ".tmp", "w") as data:
+            json.dump(progress, data, indent=2)
+        os.replace(progfile + ".tmp", progfile)
+
+    def _remove_progress(self):
+        """Remove the partition progress file, if there is one."""
+        progfile = self.path + "/" + PROGRESSFILE
+        if os.path.isfile(progfile):
+            os.remove(progfile)
+
+    def _open_manifest(self):
+        """Open the manifest, if one was requested."""
+        if self.use_manifest and self.manifest is None:
+            self.manifest = SyncManifest(self.path + "/" + MANIFESTFILE)
+
+    def _close_manifest(self):
+        """Close the manifest, discarding any unflushed changes."""
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+        self._manifest_updates = []
+        self._manifest_removals = []
+
+    def _local_stat(self, stanza):
+        """Return the modification time and size of a local document.
+
+        For a mirror, the modification time is the later of the content
+        and metadata times, so that editing either is noticed. For a
+        compact mirror, the metadata time is when it was last stored.
+        """
+        statinfo = os.stat(stanza['content'])
+        mtime = statinfo.st_mtime
+        if 'metadata' in stanza and os.path.exists(stanza['metadata']):
+            mtime = max(mtime, os.stat(stanza['metadata']).st_mtime)
+        if 'stored' in stanza and self.metadata_store is not None:
+            modified = self.metadata_store.modified(stanza['uri'])
+            if modified is not None:
+                mtime = max(mtime, modified)
+        return (mtime, statinfo.st_size)
+
+    def _record_uploads(self, upload_map, uploaded):
+        """Queue manifest entries for a list of uploaded (file, URI) pairs."""
+        if self.manifest is None or self.dryrun:
+            return
+        entries = []
+        for doc, target in uploaded:
+            mtime, size = self._local_stat(upload_map[doc])
+            entries.append({"path": doc, "uri": target,
+                            "mtime": mtime, "size": size})
+        with self._lock:
+            self._manifest_updates.extend(entries)
+
+    def _record_removals(self, paths):
+        """Queue the removal of manifest entries."""
+        if self.manifest is None or self.dryrun:
+            return
+        with self._lock:
+            self._manifest_removals.extend([p for p in paths if p is not None])
+
+    def _flush_manifest(self):
+        """Write queued changes to the manifest.
+
+        Changes are queued until the documents they describe have been
+        committed, so the manifest never records an upload that was
+        rolled back.
+        """
+        if self.manifest is None:
+            return
+        with self._lock:
+            updates = self._manifest_updates
+            removals = self._manifest_removals
+            self._manifest_updates = []
+            self._manifest_removals = []
+        if updates:
+            self.manifest.update(updates)
+        if removals:
+            self.manifest.remove(removals)
 
     def download(self):
         """Download data"""
+        # Requests in a multi-statement transaction are serialized by the
+        # server, so concurrent downloads read outside of one. They all
+        # read at the same timestamp instead, so that the download is
+        # still a consistent snapshot of the database.
+        transactional = not self.dryrun and self.threads == 1
         trans = Transactions(self.connection)
-        if not self.dryrun:
+        if transactional:
             trans.set_database(self.database)
             trans.set_timeLimit(trans.max_timeLimit())
             trans.create()
+        elif not self.dryrun:
+            self.read_timestamp = self.utils.timestamp(self.database)
 
         try:
-            if self.mirror:
+            if self.streaming:
+                self._download_streaming(trans)
+            elif self.mirror:
                 self._download_mirror(trans)
             else:
                 self._download_directory(trans)
         except KeyboardInterrupt:
-            if not self.dryrun:
+            if transactional:
                 trans.rollback()
         except:
-            if not self.dryrun:
+            if transactional:
                 trans.rollback()
             raise
         else:
-            if not self.dryrun:
+            if transactional:
                 trans.commit()
+            self._flush_manifest()
+        finally:
+            self._close_manifest()
+            self._close_metadata_store()
+
+    def _download_streaming(self, trans):
+        """Download a directory by merge-joining sorted listings.
+
+        This is the download counterpart of _upload_streaming(). URIs
+        that need to be downloaded are streamed straight into the
+        concurrent reader; only the timestamps of the batches in flight
+        are held in memory. Local files with no corresponding document
+        are deleted once all of the downloads have been written, so an
+        interrupted download never leaves the directory with fewer
+        files than it started with.
+        """
+        if not os.path.isdir(self.path):
+            print("Target directory must exist: {}".format(self.path))
+            sys.exit(1)
+
+        print("Comparing files with server...")
+        local = ((path, path) \
+                     for path, entry in walk_files(self.path, exclude=_PRIVATE, \
+                                                       ordered=True))
+        prefix = self.root if self.root else None
+        remote = self.utils.iter_last_modified( \
+            self.database, self.utils.iter_uris(self.database, prefix=prefix, \
+                                 timestamp=self.read_timestamp), \
+            concurrency=self.threads, ordered=True)
+
+        pending = {}
+        delfiles = []
+
+        def downloads():
+            for uri, litem, ritem in merge_join(local, remote):
+                if not self._selected(uri):
+                    continue
+                localfile = self.path + uri
+                if ritem is None:
+                    delfiles.append(localfile)
+                elif not self.can_store_on_filesystem(uri):
+                    print("Skipping " + uri + ": cannot store on filesystem")
+                else:
+                    stanza = {"content": localfile}
+                    if ritem[1] is not None:
+                        stanza['timestamp'] = ritem[1]
+                        if litem is not None:
+                            stamp = self._convert_timestamp(ritem[1])
+                            if os.stat(localfile).st_mtime >= stamp.timestamp():
+                                continue
+                    pending[uri] = stanza
+                    yield uri
+
+        docs = Documents(self.connection)
+        docs.set_database(self.database)
+        docs.set_txid(trans.txid())
+        docs.set_format('xml')
+        docs.set_category('content')
+
+        if self.dryrun:
+            dlcount = 0
+            for uri in downloads():
+                del pending[uri]
+                dlcount += 1
+            print("Would download {} documents.".format(dlcount))
+        else:
+            self._download_pipeline(docs.read_many(downloads(), self.batchsize, \
+                                                       self.threads, \
+                                                       spool_threshold=SPOOLTHRESHOLD, \
+                                                       timestamp=self.read_timestamp), \
+                                        pending)
+
+        if delfiles:
+            if self.regex:
+                print("Limited download, not deleting {} files..." \
+                          .format(len(delfiles)))
+            else:
+                print("Deleting {} files...".format(len(delfiles)))
+                for localfile in delfiles:
+                    if self.verbose:
+                        print("DEL {}".format(localfile))
+                    if not self.dryrun:
+                        os.remove(localfile)
+                if not self.dryrun:
+                    self._remove_empty_dirs(self.path)
 
     def _download_mirror(self, trans):
         """Download mirror"""
@@ -427,9 +1083,11 @@ class MarkLogicDatabaseMirror:
             sys.exit(1)
 
         self.logger.debug("Starting download_mirror")
+        self._open_manifest()
 
         print("Reading URIs from server...")
-        alluris = self.utils.uris(self.database, self.root)
+        alluris = self.utils.uris(self.database, self.root, \
+                                  timestamp=self.read_timestamp)
 
         if self.regex:
             uris = self.regex_filter(alluris, download=True)
@@ -444,6 +1102,9 @@ class MarkLogicDatabaseMirror:
         umdir = "{}/umetadata".format(self.path)
         down_map = {}
 
+        if self.compact and not self.dryrun:
+            self.metadata_store = MetadataStore(self.path + "/" + METADATASTORE)
+
         for uri in uris:
             if self.can_store_on_filesystem(uri):
                 down_map[uri] = {"content": cdir + uri, \
@@ -465,6 +1126,13 @@ class MarkLogicDatabaseMirror:
                                      "metadata": umdir + filename, \
                                      "uuid": True}
 
+            if self.compact:
+                stanza = down_map[uri]
+                stanza['stored'] = stanza.pop('metadata')[len(self.path):] \
+                                       .replace("/metadata/", "/content/", 1) \
+                                       .replace("/umetadata/", "/ucontent/", 1)
+                stanza['uri'] = uri
+
         self._download_map(trans, down_map)
 
     def _download_directory(self, trans):
@@ -474,9 +1142,11 @@ class MarkLogicDatabaseMirror:
             sys.exit(1)
 
         self.logger.debug("Starting download_directory")
+        self._open_manifest()
 
         print("Reading URIs from server...")
-        alluris = self.utils.uris(self.database, self.root)
+        alluris = self.utils.uris(self.database, self.root, \
+                                  timestamp=self.read_timestamp)
 
         if self.regex:
             uris = self.regex_filter(alluris, download=True)
@@ -485,8 +1155,24 @@ class MarkLogicDatabaseMirror:
         else:
             uris = alluris
 
-        print("Getting timestamps from server...")
-        stamps = self.get_timestamps(alluris)
+        # Only binary and text documents are hashed; the rest are
+        # compared by timestamp even with --hash
+        remote = {}
+        if self.use_hash:
+            print("Getting hashes from server...")
+            remote = self.utils.content_hashes(self.database, uris, \
+                                                   concurrency=self.threads)
+            localfiles = [self.path + uri for uri in remote \
+                              if self.can_store_on_filesystem(uri) \
+                              and os.path.exists(self.path + uri)]
+            print("Hashing {} local files...".format(len(localfiles)))
+            local = file_hashes(localfiles)
+
+        unhashed = [uri for uri in uris if uri not in remote]
+        stamps = {}
+        if unhashed:
+            print("Getting timestamps from server...")
+            stamps = self.get_timestamps(unhashed)
 
         down_map = {}
         skip_list = []
@@ -497,11 +1183,21 @@ class MarkLogicDatabaseMirror:
             if not self.can_store_on_filesystem(uri):
                 print("Skipping " + uri + ": cannot store on filesystem")
                 skip = True
+            elif uri in remote:
+                skip = localfile in local and local[localfile] == remote[uri]
             else:
                 if uri in stamps and os.path.exists(localfile):
                     statinfo = os.stat(localfile)
-                    stamp = self._convert_timestamp(stamps[uri])
-                    skip = statinfo.st_mtime >= stamp.timestamp()
+                    entry = None
+                    if self.manifest is not None:
+                        entry = self.manifest.get(uri)
+                    if entry is not None \
+                      and entry['mtime'] == statinfo.st_mtime \
+                      and entry['size'] == statinfo.st_size:
+                        skip = entry['server_timestamp'] == stamps[uri]
+                    else:
+                        stamp = self._convert_timestamp(stamps[uri])
+                        skip = statinfo.st_mtime >= stamp.timestamp()
 
             if skip:
                 skip_list.append(localfile)
@@ -534,43 +1230,22 @@ class MarkLogicDatabaseMirror:
         docs.set_database(self.database)
         docs.set_txid(trans.txid())
         docs.set_format('xml')
-        docs.set_accept("multipart/mixed")
         if self.mirror:
             docs.set_categories(['content', 'metadata'])
         else:
             docs.set_category('content')
 
-        dlprog = 0
-        dlcount = 0
-        for uri in down_map.keys():
-            dlcount += 1
-            docs.add_uri(uri)
-
+        for uri in down_map:
             if uri in filehash:
                 del filehash[uri]
 
-            if dlcount >= self.batchsize:
-                dlprog += dlcount
-                perc = (float(dlprog) / download_count) * 100.0
-                print("{0:.0f}% ... {1}/{2} files" \
-                          .format(perc, dlprog, download_count))
-
-                self._download_batch(docs, down_map)
-                docs.clear()
-                docs.set_database(self.database)
-                docs.set_txid(trans.txid())
-                docs.set_format('xml')
-                docs.set_accept("multipart/mixed")
-                if self.mirror:
-                    docs.set_categories(['content', 'metadata'])
-                else:
-                    docs.set_category('content')
-                dlcount = 0
-
-        if dlcount > 0:
-            perc = (float(dlcount) / download_count) * 100.0
-            print("{0:.0f}% ... {1} files".format(perc, dlcount))
-            self._download_batch(docs, down_map)
+        if not self.dryrun:
+            self._download_pipeline(docs.read_many(list(down_map), \
+                                                       self.batchsize, \
+                                                       self.threads, \
+                                                       spool_threshold=SPOOLTHRESHOLD, \
+                                                       timestamp=self.read_timestamp), \
+                                        down_map, download_count)
 
         delfiles = []
         for path in filehash.keys():
@@ -590,69 +1265,83 @@ class MarkLogicDatabaseMirror:
                     for path in delfiles:
                         os.remove(path)
                     self._remove_empty_dirs(self.path)
+                    self._record_removals([path[len(self.path):] \
+                                               for path in delfiles])
+
+    def _store_document(self, down_map, uri, meta, content, body_content_type):
+        """Store a single downloaded document"""
+        return self._write_document(self._decode_document(down_map, uri, meta, \
+                                                              content, \
+                                                              body_content_type))
+
+    def _decode_document(self, down_map, uri, meta, content, body_content_type):
+        """Prepare a downloaded document for writing.
+
+        This is the CPU-bound half of storing a document: the metadata is
+        parsed and reserialized and the timestamp is converted. Returns
+        a job for _write_document(). The document's entry is removed from
+        down_map, so a streamed download only holds the entries of the
+        documents in flight.
+        """
+        if content is None:
+            raise RuntimeError("Multipart without content!?")
 
-    def _download_batch(self, docs, down_map):
-        """Download a batch of files"""
-        if self.dryrun:
-            return
-
-        self.logger.debug("Downloading batch")
-        self.logger.debug(docs)
+        if uri is None:
+            raise RuntimeError("Multipart without filename!?")
 
-        resp = docs.get()
-        decoder = MultipartDecoder.from_response(resp)
+        stanza = down_map.pop(uri)
+        metadata = None
+        if meta is not None:
+            metadata, last_modified = self._decode_metadata(meta, stanza, \
+                                                                body_content_type, uri)
+            if last_modified is not None:
+                stanza['timestamp'] = last_modified
 
-        self.logger.debug("Downloaded {} bytes in {} parts" \
-                              .format(len(resp.text), len(decoder.parts)))
+        if 'timestamp' in stanza:
+            stamp = self._convert_timestamp(stanza['timestamp']).timestamp()
+        else:
+            stamp = None
 
-        meta_part = None
-        content_part = None
-        splitregex = re.compile(';\\s*')
+        return {"uri": uri, "stanza": stanza, "metadata": metadata,
+                "content": content, "stamp": stamp}
 
-        if not decoder.parts:
-            raise RuntimeError("FAILED TO GET ANY PARTS!?")
+    def _write_document(self, job):
+        """Write a document prepared by _decode_document().
 
-        for mimepart in decoder.parts:
-            disp = mimepart.headers[b'Content-Disposition'].decode('utf-8')
-            if 'category=metadata' in disp:
-                if meta_part is not None:
-                    raise RuntimeError("More than one metadata part!?")
-                meta_part = mimepart
+        Returns the number of content bytes written.
+        """
+        stanza = job['stanza']
+        if job['metadata'] is not None:
+            if 'stored' in stanza:
+                if self.metadata_store is not None:
+                    self.metadata_store.put(job['uri'], stanza['stored'], \
+                                                job['metadata'])
             else:
-                content_part = mimepart
-
-                disp = content_part.headers[b'Content-Disposition'].decode('utf-8')
-                dispositions = splitregex.split(disp)
-                filename = None
-                for disp in dispositions:
-                    if disp.startswith("filename="):
-                        filename = disp[10:len(disp)-1]
-
-                body_content_type = content_part.headers[b'Content-Type'].decode('utf-8')
-
-                if filename is None:
-                    raise RuntimeError("Multipart without filename!?")
-
-                #print("FN:",filename)
-
-                last_modified = None
-                stanza = down_map[filename]
-                if meta_part is not None:
-                    last_modified = self._store_metadata(meta_part, down_map[filename], \
-                                                             body_content_type, filename)
-                    if last_modified is not None:
-                        stanza['timestamp'] = last_modified
-                self._store_content(content_part, stanza)
-                meta_part = None
-                content_part = None
-
-    def _store_metadata(self, meta_part, stanza, body_content_type, uri):
-        # fromstring() doesn't return an an xml.etree.ElementTree and
-        # doesn't have a write method that we're going to need later
-        fakeio = io.StringIO(meta_part.content.decode('utf-8'))
-        metaxml = ET.parse(fakeio)
-        root = metaxml.getroot()
-        fakeio.close()
+                self._write_file(stanza['metadata'], job['metadata'])
+        size = self._write_file(stanza['content'], job['content'], job['stamp'])
+
+        if self.manifest is not None and not self.dryrun:
+            if 'uuid' in stanza:
+                path = stanza['content'][len(self.path + "/ucontent"):]
+            elif self.mirror:
+                path = stanza['content'][len(self.path + "/content"):]
+            else:
+                path = stanza['content'][len(self.path):]
+            mtime, fsize = self._local_stat(stanza)
+            with self._lock:
+                self._manifest_updates.append(
+                    {"path": path, "uri": job['uri'], "mtime": mtime,
+                     "size": fsize, "server_timestamp": stanza.get('timestamp')})
+
+        return size
+
+    def _decode_metadata(self, meta, stanza, body_content_type, uri):
+        """Parse downloaded metadata and add the mirror's own elements.
+
+        Returns the serialized metadata and the last-modified time, if
+        the document has one.
+        """
+        root = ET.fromstring(meta)
 
         last_mod = None
         properties = root.find('{http://marklogic.com/xdmp/property}properties')
@@ -665,45 +1354,97 @@ class MarkLogicDatabaseMirror:
         txml.text = body_content_type
         root.insert(0, txml)
 
-        metafn = stanza['metadata']
         if 'uuid' in stanza:
             txml = ET.Element("{http://marklogic.com/ns/mldbmirror/}uri")
             txml.text = uri
             root.insert(1, txml)
 
-        if not self.dryrun:
-            if not os.path.exists(os.path.dirname(metafn)):
-                os.makedirs(os.path.dirname(metafn))
-
-            metaxml.write(metafn)
-        else:
-            if self.verbose:
-                print("Meta:", metafn)
-
-        return last_mod
+        return (ET.tostring(root), last_mod)
 
-    def _store_content(self, content_part, stanza):
-        contfn = stanza['content']
+    def _write_file(self, filename, data, stamp=None):
+        """Write bytes or a file-like object to filename.
 
-        #print(stanza)
+        If stamp is provided, it's used as the modification time of the
+        file. Returns the number of bytes written.
+        """
+        if self.dryrun:
+            if self.verbose:
+                print("Write:", filename)
+            if not isinstance(data, bytes):
+                data.close()
+            return 0
 
-        if 'timestamp' in stanza:
-            stamp = self._convert_timestamp(stanza['timestamp'])
-        else:
-            stamp = None
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
 
-        if not self.dryrun:
-            if not os.path.exists(os.path.dirname(contfn)):
-                os.makedirs(os.path.dirname(contfn))
-
-            dataf = open(contfn, 'wb')
-            dataf.write(content_part.content)
-            dataf.close()
-            if stamp is not None:
-                os.utime(contfn, (stamp.timestamp(), stamp.timestamp()))
-        else:
-            if self.verbose:
-                print("Data:", contfn)
+        with open(filename, 'wb') as dataf:
+            if isinstance(data, bytes):
+                dataf.write(data)
+            else:
+                shutil.copyfileobj(data, dataf)
+                data.close()
+            size = dataf.tell()
+        if stamp is not None:
+            os.utime(filename, (stamp, stamp))
+        return size
+
+    def _download_pipeline(self, results, down_map, download_count=None):
+        """Decode and write downloaded documents on their own threads.
+
+        The results come from Documents.read_many(), which fetches on
+        self.threads threads. Decoding (self.decode_threads) and
+        writing (self.write_threads) are separate stages connected by
+        bounded queues, so the network, CPU and disk all stay busy.
+        Returns the number of documents stored and prints a throughput
+        summary.
+        """
+        timings = {"decode": 0.0, "write": 0.0}
+        totals = {"bytes": 0}
+
+        def timed(name, function):
+            def stage(item):
+                start = time.time()
+                result = function(item)
+                with self._lock:
+                    timings[name] += time.time() - start
+                return result
+            return stage
+
+        def decode(result):
+            uri, meta, content, body_content_type = result
+            return self._decode_document(down_map, uri, meta, content, \
+                                             body_content_type)
+
+        def write(job):
+            size = self._write_document(job)
+            with self._lock:
+                totals['bytes'] += size
+            return job['uri']
+
+        start = time.time()
+        dlcount = 0
+        for uri in pipeline(results, [(timed("decode", decode), self.decode_threads), \
+                                          (timed("write", write), self.write_threads)]):
+            dlcount += 1
+            if dlcount % self.batchsize == 0 or dlcount == download_count:
+                self._flush_manifest()
+                if download_count:
+                    perc = (float(dlcount) / download_count) * 100.0
+                    print("{0:.0f}% ... {1}/{2} files" \
+                              .format(perc, dlcount, download_count))
+                else:
+                    print("{} files...".format(dlcount))
+        self._flush_manifest()
+
+        elapsed = max(time.time() - start, 0.001)
+        print("Downloaded {} documents, {} bytes in {:.1f}s " \
+                  .format(dlcount, totals['bytes'], elapsed)
+              + "({:.1f} docs/s, {:.2f} MB/s)" \
+                  .format(dlcount / elapsed, totals['bytes'] / elapsed / 1024 / 1024))
+        print("Stage busy time: decode {:.1f}s on {} threads, " \
+                  .format(timings['decode'], self.decode_threads)
+              + "write {:.1f}s on {} threads" \
+                  .format(timings['write'], self.write_threads))
+        return dlcount
 
     def can_store_on_filesystem(self, filename):
         """Returns true if the filename can be stored.
@@ -750,41 +1491,14 @@ class MarkLogicDatabaseMirror:
 
     def get_timestamps(self, uris):
         """Get the database timestamp for these URIs"""
-        chunksize = 500
-        chunkcount = math.floor((len(uris) + chunksize - 1) / chunksize)
-        chunk = 0
-
-        stamps = []
-        for seg in self._chunks(uris, chunksize):
-            chunk += 1
-            if self.verbose:
-                print("\t-> chunk {} of {} ...".format(chunk, chunkcount))
-            stamps += self.utils.last_modified(self.database, seg)
-
-        # FIXME: make the XQuery return a single object
-        stamp_hash = {}
-        for stamp in stamps:
-            stamp_hash[stamp["uri"]] = stamp["dt"]
-        return stamp_hash
-
-    def _chunks(self, uris, n):
-        """Chop a long list into a list of lists"""
-        for index in range(0, len(uris), n):
-            yield uris[index:index+n]
+        return self.utils.last_modified(self.database, uris, \
+                                            concurrency=self.threads)
 
     def regex_filter(self, alluris, download=False):
         if self.regex:
             uris = []
-            cregex = []
-            for exp in self.regex:
-                cregex.append(re.compile(exp))
-
             for uri in alluris:
-                match = False
-                for exp in cregex:
-                    match = match or exp.match(uri)
-
-                if match:
+                if self._selected(uri):
                     if self.dryrun and self.verbose:
                         print("INCL:", uri)
                     uris.append(uri)
@@ -802,7 +1516,7 @@ class MarkLogicDatabaseMirror:
                           .format(len(alluris), cat, len(uris)))
             elif len(self.regex) > 1:
                 print("{} regex filters reduced {} {} to {}." \
-                          .format(len(self.regex), cat, len(alluris), len(uris)))
+                          .format(len(self.regex), len(alluris), cat, len(uris)))
 
             return uris
         else:
@@ -818,22 +1532,16 @@ class MarkLogicDatabaseMirror:
         if not os.listdir(directory):
             os.rmdir(directory)
 
-    def scan(self, directory, root=None, files=None):
+    def scan(self, directory, root=None):
         """Scan a directory recursively, returning all of the files"""
-        if files is None:
-            files = []
         if root is None:
             root = directory
-        skip = "/" + CONFIGFILE
+        prefix = directory[len(root):]
 
-        for name in os.listdir(directory):
-            path = os.path.join(directory, name)
-            if os.path.isfile(path):
-                if not path.endswith(skip):
-                    path = path[len(root):]
-                    files.append(path)
-            else:
-                self.scan(path, root, files)
+        files = []
+        for path, entry in walk_files(directory, exclude=_PRIVATE, \
+                                          threads=self.threads):
+            files.append(prefix + path)
         return files
 
     def loadconfig(self, path):
@@ -905,6 +1613,26 @@ def main():
                         help='Size of upload batches (bytes)')
     parser.add_argument('--batchsize', type=int, default=BATCHSIZE,
                         help='Size of download batches (number of files)')
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help='Number of concurrent requests to the server')
+    parser.add_argument('--compact', action='store_true',
+                        help='Download a mirror with all metadata in one store')
+    parser.add_argument('--convert', action='store_true',
+                        help='Convert a mirror to keep all metadata in one store')
+    parser.add_argument('--decode-threads', type=int, default=DECODETHREADS,
+                        help='Number of threads decoding downloaded documents')
+    parser.add_argument('--write-threads', type=int, default=WRITETHREADS,
+                        help='Number of threads writing downloaded documents')
+    parser.add_argument('--partition-size', type=int, default=0,
+                        help='Upload in partitions of this many files, each in its own transaction')
+    parser.add_argument('--hash', action='store_true',
+                        help='Compare binary and text documents by content hash instead of timestamp')
+    parser.add_argument('--manifest', action='store_true',
+                        help='Keep a manifest of synchronized files to speed up later runs')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Compare sorted listings in constant memory')
+    parser.add_argument('--validate', action='store_true',
+                        help='Check that all uploaded documents are on the server')
     parser.add_argument('--regex', action='append',
                         help='Regex(es) to match for URIs')
     parser.add_argument('--list', default=None,
@@ -916,6 +1644,12 @@ def main():
 
     args = vars(parser.parse_args())
 
+    if args['convert']:
+        mirror.path = os.path.abspath(args['path'])
+        mirror.dryrun = args['dryrun']
+        mirror.convert_mirror()
+        sys.exit(0)
+
     if args['upload'] == args['download']:
         print("Exactly one of --upload or --download must be specified.")
         sys.exit(1)
@@ -4,10 +4,11 @@
 #
 # This script restores the named databases. Or all databases.
 
-import argparse, json, logging, re, sys, time
+import argparse, json, logging, re, sys
 from marklogic.exceptions import UnsupportedOperation
 from marklogic.connection import Connection
 from marklogic.models.database import Database
+from marklogic.models.database.backup import BackupScheduler
 from marklogic import MarkLogic
 from requests.auth import HTTPDigestAuth
 from resources import TestConnection as tc
@@ -24,6 +25,8 @@ class RestoreDatabases:
         self.lag_limit       = 30
         self.incremental     = False
         self.max_parallel    = 5
+        self.max_per_host    = None
+        self.max_per_target  = None
         self.dry_run         = False
 
     # TODO: better checking of argument types
@@ -66,6 +69,14 @@ class RestoreDatabases:
         self.max_parallel = max_parallel
         return self
 
+    def set_max_per_host(self, max_per_host):
+        self.max_per_host = max_per_host
+        return self
+
+    def set_max_per_target(self, max_per_target):
+        self.max_per_target = max_per_target
+        return self
+
     def set_dry_run(self, dry_run):
         self.dry_run = dry_run
         return self
@@ -91,77 +102,30 @@ class RestoreDatabases:
                 raise UnsupportedOperation("Database does not exist: {0}"
                                            .format(dbname))
 
-        maxp = self.max_parallel
-        running = 0
-        done = False
-        queue = self.databases
-        status_list = {}
-        min_wait = 5
-        max_wait = 30
-        wait_incr = 5
-        wait = min_wait
+        if self.dry_run:
+            for dbname in self.databases:
+                print("Restoring {0}".format(dbname))
+            return
 
-        while not done:
-            done = True
+        scheduler = BackupScheduler(conn, max_per_host=self.max_per_host,
+                                    max_per_target=self.max_per_target,
+                                    max_running=self.max_parallel)
+        restores = {}
+        for dbname in self.databases:
+            print("Restoring {0}".format(dbname))
+            restores[dbname] = scheduler.restore(dbname,
+                                                 self.restore_root + dbname)
 
-            while len(queue) > 0 and running < maxp:
-                dbname = queue.pop(0)
-                running += 1
-                done = False
+        scheduler.wait()
 
-                print("Restoring {0}".format(dbname))
-                if not self.dry_run:
-                    db = self.marklogic.database(dbname)
-                    rst = db.restore(self.restore_root + dbname, connection=conn)
-                    status_list[dbname] = rst
-                    response = rst.status()
-                    for forest in response['forest']:
-                        if forest['status'] != 'in-progress':
-                            print("Forest {0}: {1}"
-                                  .format(forest['forest-name'],
-                                          forest['status']))
-
-            if self.dry_run:
-                if running > 0 or len(queue) > 0:
-                    print("{0} restores in dry-run; {1} in queue..."
-                          .format(running, len(queue)))
-                    running = 0
+        for dbname in self.databases:
+            future = restores[dbname]
+            if future.exception() is None:
+                for forest in future.result().last_status.get('forest', []):
+                    print("Forest {0}: {1}".format(forest['forest-name'],
+                                                   forest['status']))
             else:
-                if len(status_list) > 0:
-                    new_list = {}
-                    for dbname in status_list:
-                        rst = status_list[dbname]
-                        response = rst.status()
-                        fdone = True
-                        for forest in response['forest']:
-                            print("Forest {0}: {1}"
-                                  .format(forest['forest-name'],
-                                          forest['status']))
-                            if forest['status'] == 'in-progress':
-                                fdone = False
-                        if not fdone:
-                            done = False
-                            new_list[dbname] = rst
-                        else:
-                            running -= 1
-                            wait = min_wait
-
-                    done = done and len(queue) == 0
-
-                    if not done:
-                        status_list = new_list
-                        if running < maxp and len(queue) != 0:
-                            print("Running: {0} restores running; {1} in queue..."
-                                  .format(running, len(queue)))
-                            wait = min_wait
-                            print("")
-                        else:
-                            print("Waiting {0}s: {1} restores running; {2} in queue..."
-                                  .format(wait, running, len(queue)))
-                            time.sleep(wait)
-                            if wait < max_wait:
-                                wait += wait_incr
-                            print("")
+                print("{0}: {1}".format(dbname, future.exception()))
 
 def main():
     parser = argparse.ArgumentParser(description="Restore databases")
@@ -183,6 +147,10 @@ def main():
                         help='Perform incremental restore')
     parser.add_argument('--max-parallel', default=5, type=int,
                         help='Maximum number of restores to run in parallel.')
+    parser.add_argument('--max-per-host', type=int,
+                        help='Maximum number of restores running on any host.')
+    parser.add_argument('--max-per-target', type=int,
+                        help='Maximum number of restores reading from the same backup directory.')
     parser.add_argument('--lag-limit',
                         help='The lag limit')
     parser.add_argument('--dry-run', action='store_true',
@@ -215,6 +183,10 @@ def main():
             restore.set_lag_limit(arg)
         elif opt == 'max_parallel':
             restore.set_max_parallel(arg)
+        elif opt == 'max_per_host':
+            restore.set_max_per_host(arg)
+        elif opt == 'max_per_target':
+            restore.set_max_per_target(arg)
         elif opt == 'database':
             restore.set_database(arg)
         elif opt == 'dry_run':
@@ -30,6 +30,19 @@ import platform
 import shutil
 import subprocess
 import logging
+import mimetypes
+import threading
+import time
+from marklogic.client.bulkloader import BulkLoader
+from marklogic.client.documents import Documents
+from marklogic.utilities.concurrency import chunks
+from marklogic.utilities.files import walk_files
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
 
 
 """
@@ -124,9 +137,152 @@ class Watcher():
     Watcher will observe a directory and all the files in the director
     or its descendants.  If any change, it should upload the file to
     the appropriate database.
+
+    Changes are found by comparing snapshots of the modification time
+    and size of every file. The directory is polled, more often while
+    things are changing and less often while they aren't. If the
+    watchdog package is installed, its change notifications trigger a
+    poll straight away, so changes are seen without waiting for the
+    next interval.
+
+    A changed file is only sent to the database once it has stopped
+    changing for debounce seconds, so that a burst of saves results in
+    a single upload. Uploads are sent in BulkLoader batches; deleted
+    files are deleted from the database in batches too. If sending a
+    set of changes fails, the error is logged and the changes are
+    retried after another debounce.
     """
-    def __init__(self):
-        pass
+    def __init__(self, database=None, prefix="", collections=None,
+                 debounce=1.0, min_interval=0.5, max_interval=5.0,
+                 batch_size=100):
+        self.database = database
+        self.prefix = prefix
+        self.collections = collections
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.logger = logging.getLogger("marklogic.examples")
 
-    def watch(self, conn, directory):
-        pass
+    def watch(self, conn, directory, stop=None):
+        """
+        Watch directory, sending changes to the database until stop (a
+        threading.Event) is set or the process is interrupted.
+        """
+        if stop is None:
+            stop = threading.Event()
+        wake = threading.Event()
+        observer = self._observe(directory, wake)
+
+        snapshot = self.snapshot(directory)
+        pending = {}
+        interval = self.min_interval
+        try:
+            while not stop.is_set():
+                wake.wait(interval)
+                wake.clear()
+
+                current = self.snapshot(directory)
+                now = time.time()
+                changed = False
+                for path in set(snapshot) | set(current):
+                    if snapshot.get(path) != current.get(path):
+                        pending[path] = (current.get(path), now)
+                        changed = True
+                snapshot = current
+
+                ready = [path for path in pending
+                         if now - pending[path][1] >= self.debounce]
+                if ready:
+                    changes = dict([(path, pending.pop(path)[0])
+                                    for path in ready])
+                    try:
+                        self.sync(conn, directory, changes)
+                    except Exception as err:
+                        # Retry after the next debounce, unless the file
+                        # has changed again in the meantime
+                        self.logger.warning("Sync failed: {0}".format(err))
+                        for path in changes:
+                            if path not in pending:
+                                pending[path] = (changes[path], now)
+
+                if changed or pending:
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * 2, self.max_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def snapshot(self, directory):
+        """
+        Return a dictionary of (mtime, size) tuples for every file below
+        directory, keyed by relative path.
+        """
+        snapshot = {}
+        for path, entry in walk_files(directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue    # Deleted since it was listed
+            snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def sync(self, conn, directory, changes):
+        """
+        Send a set of changes to the database. The changes are a
+        dictionary keyed by relative path; the value is None for a file
+        that has been deleted.
+        """
+        uploads = sorted([path for path in changes if changes[path] is not None])
+        deletes = sorted([path for path in changes if changes[path] is None])
+
+        for batch in chunks(uploads, self.batch_size):
+            bulk = BulkLoader(conn)
+            if self.database is not None:
+                bulk.set_database(self.database)
+            for path in batch:
+                docs = Documents(conn)
+                docs.set_uri(self.prefix + path)
+                if self.collections:
+                    docs.set_collections(self.collections)
+                content_type = mimetypes.guess_type(path)[0]
+                if content_type is None:
+                    content_type = "application/octet-stream"
+                try:
+                    with open(directory + path, "rb") as data:
+                        docs.set_content(data.read(), content_type)
+                except (IOError, OSError):
+                    continue    # Deleted after it was seen
+                bulk.add(docs)
+            if bulk.size() > 0:
+                self.logger.info("Uploading {} files".format(bulk.size()))
+                bulk.post()
+
+        for batch in chunks(deletes, self.batch_size):
+            docs = Documents(conn)
+            if self.database is not None:
+                docs.set_database(self.database)
+            docs.set_uris([self.prefix + path for path in batch])
+            self.logger.info("Deleting {} documents".format(len(batch)))
+            docs.delete()
+
+    def _observe(self, directory, wake):
+        """
+        Start a watchdog observer that sets wake on any change, if
+        watchdog is available.
+        """
+        if Observer is None:
+            return None
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+
+        observer = Observer()
+        observer.schedule(Handler(), directory, recursive=True)
+        observer.start()
+        return observer
@@ -21,6 +21,7 @@ A MarkLogic server
 import logging
 import requests
 import json
+import threading
 from marklogic.connection import Connection
 from marklogic.models.cluster import LocalCluster
 from marklogic.models.host import Host
@@ -35,6 +36,9 @@ from requests.auth import HTTPDigestAuth
 from marklogic.models.server import Server, HttpServer, WebDAVServer
 from marklogic.models.server import OdbcServer, XdbcServer
 from marklogic.exceptions import InvalidAPIRequest, UnexpectedManagementAPIResponse
+from marklogic.exceptions import UnauthorizedAPIRequest
+from marklogic.utilities.concurrency import imap
+from concurrent.futures import ThreadPoolExecutor
 
 __version__ = "0.0.20"
 
@@ -445,6 +449,97 @@ class MarkLogic:
 
         return Host(host)._set_just_initialized()
 
+    @classmethod
+    def instances_init(cls, hosts, concurrency=8):
+        """
+        Performs first-time initialization of several servers at once.
+
+        Each host is initialized as by instance_init() and the restarts
+        are waited for concurrently. A host that has already been
+        initialized (and therefore refuses the unauthenticated request)
+        is returned as is.
+
+        :param hosts: A list of host names or IP addresses
+        :param concurrency: The maximum number of hosts initialized at once
+        :return: A list of Host objects, in the order given
+        """
+        return list(imap(cls._init_or_lookup, hosts, concurrency,
+                         ordered=True))
+
+    @classmethod
+    def _init_or_lookup(cls, host):
+        """
+        Initialize a host, treating an authorization failure as meaning
+        that it has already been initialized.
+        """
+        try:
+            return cls.instance_init(host)
+        except UnauthorizedAPIRequest:
+            return Host(host)
+
+    @classmethod
+    def bootstrap_cluster(cls, boothost, hosts, realm, admin, password,
+                          concurrency=8, initialized=None):
+        """
+        Initializes a set of new servers and joins them into a cluster.
+
+        The bootstrap host is initialized and, if it was just
+        initialized, its security database is installed. At the same
+        time, every other host is initialized. As soon as both its own
+        initialization and the bootstrap host's security are done, each
+        host joins the cluster (see LocalCluster.add_hosts()). All of
+        the waiting for restarts happens in parallel, so building a
+        cluster takes about as long as restarting one host a few times,
+        no matter how many hosts there are.
+
+        If initialized is provided, it is called with the name of each
+        host (the bootstrap host included) as soon as that host has been
+        initialized, so that a caller can record the hosts it has used
+        even if a later step fails. The calls are made one at a time.
+
+        :param boothost: The name or IP address of the bootstrap host
+        :param hosts: The names or IP addresses of the other hosts
+        :param realm: The security realm to install
+        :param admin: The name of the admin user
+        :param password: The password of the admin user
+        :param concurrency: The maximum number of hosts handled at once
+        :param initialized: A function called with each initialized host
+        :return: A MarkLogic object connected to the bootstrap host
+        """
+        logger = logging.getLogger("marklogic")
+        conn = Connection(boothost, HTTPDigestAuth(admin, password))
+        cluster = LocalCluster(connection=conn)
+
+        lock = threading.Lock()
+        initialized_lock = threading.Lock()
+
+        def init(host):
+            result = cls._init_or_lookup(host)
+            if initialized is not None:
+                with initialized_lock:
+                    initialized(host)
+            return result
+
+        def boot():
+            if init(boothost).just_initialized():
+                cls.instance_admin(boothost, realm, admin, password)
+            logger.debug("Bootstrap host {0} is ready".format(boothost))
+
+        with ThreadPoolExecutor(max_workers=concurrency + 1) as executor:
+            booted = executor.submit(boot)
+
+            def setup(host):
+                init(host)
+                booted.result()
+                return cluster._join(host, conn, lock)
+
+            joins = [executor.submit(setup, host) for host in hosts]
+            booted.result()
+            for future in joins:
+                future.result()
+
+        return MarkLogic(conn)
+
     @classmethod
     def instance_admin(cls,host,realm,admin,password,wallet_password=None):
         """
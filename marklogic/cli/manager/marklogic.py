@@ -32,6 +32,7 @@ from marklogic.cli.manager import Manager
 from marklogic.models.user import User
 from marklogic.models.host import Host
 from marklogic.models.cluster import LocalCluster
+from marklogic.models.logfollower import LogFollower
 from marklogic import MarkLogic
 
 class MarkLogicManager(Manager):
@@ -340,28 +341,35 @@ class MarkLogicManager(Manager):
             self.start(args,config,connection)
 
     def log(self, args, config, connection):
-        try:
-            datadir = config[args['config']]['datadir']
-        except KeyError:
-            print("No datadir in configuration file for section: {0}"
-                  .format(args['config']))
-            sys.exit(1)
-
-        if not datadir.endswith('/'):
-            datadir += "/"
-
         logfile = args['logfile']
         if "/" in logfile or "\\" in logfile:
             print("You may not specify a path, only a name: {0}"
                   .format(logfile))
             sys.exit(1)
 
+        hosts = None
+        if args['log_host'] is not None:
+            hosts = [host.strip() for host in args['log_host'].split(",")]
+
         status = self.status(args,config,connection,internal=True)
+        if status != 'up':
+            self.status(args,config,connection)
+            sys.exit(1)
+
+        follower = LogFollower(connection, files=[logfile], hosts=hosts,
+                               regex=args['regex'], min_level=args['level'],
+                               lines=args['lines'])
+        multihost = hosts is None or len(hosts) > 1
         try:
-            if status == 'up':
-                subprocess.call(['/usr/bin/tail', '-f', datadir + "Logs/" + logfile])
+            if not args['no_follow']:
+                events = follower.follow()
             else:
-                subprocess.call(['/usr/bin/tail', datadir + "Logs/" + logfile])
+                events = follower.poll()
+            for event in events:
+                if multihost:
+                    print("{0}: {1}".format(event['host'], event['line']))
+                else:
+                    print(event['line'])
         except KeyboardInterrupt:
             pass
 
@@ -33,6 +33,7 @@ from marklogic.cli.manager.cluster import ClusterManager
 from marklogic.cli.manager.foreigncluster import ForeignClusterManager
 from marklogic.cli.manager.task import TaskManager
 from marklogic.cli.manager.amp import AmpManager
+from marklogic.models.logfollower import LEVELS
 
 """
 Templates for the command line interface.
@@ -184,6 +185,16 @@ class Template:
         parser = self._make_parser('log',None,'Show logs')
         parser.add_argument('--logfile', default="ErrorLog.txt",
                             help='The name of the log file')
+        parser.add_argument('--log-host', default=None,
+                            help='Comma-separated hosts to read (default: all)')
+        parser.add_argument('--regex', default=None,
+                            help='Only show lines that match this regex')
+        parser.add_argument('--level', default=None, choices=LEVELS,
+                            help='Only show messages at this level or above')
+        parser.add_argument('--lines', default=10, type=int,
+                            help='Show this many of the last lines on each host')
+        parser.add_argument('--no-follow', action='store_true',
+                            help='Exit instead of showing new lines as they appear')
         self._parsers['log']['parser'] = parser
 
         parser = self._make_parser('debug',None,'Enable diagnostic events')
@@ -28,7 +28,118 @@ from __future__ import unicode_literals, print_function, absolute_import
 import logging
 import json
 from marklogic.client.eval import Eval
-from requests_toolbelt import MultipartDecoder
+from marklogic.utilities.concurrency import imap, chunks
+
+URIPAGESIZE = 10000
+URISAMPLESIZE = 1000
+CHUNKSIZE = 500
+
+_URIS_PROLOG = """xquery version "1.0-ml";
+declare variable $prefix as xs:string external;
+declare variable $collection as xs:string external;
+declare variable $directory as xs:string external;
+declare variable $timestamp as xs:string external;
+
+declare function local:query() as cts:query {
+  cts:and-query((
+    if ($collection = "") then () else cts:collection-query($collection),
+    if ($directory = "") then () else cts:directory-query($directory, "infinity")))
+};
+
+declare function local:at-timestamp($fn as function() as item()*) as item()* {
+  if ($timestamp = "")
+  then $fn()
+  else xdmp:invoke-function($fn,
+         <options xmlns="xdmp:eval">
+           <timestamp>{$timestamp}</timestamp>
+         </options>)
+};
+"""
+
+_URIS_PAGE = _URIS_PROLOG + """
+declare variable $start as xs:string external;
+declare variable $end as xs:string external;
+declare variable $limit as xs:unsignedInt external;
+
+let $page := local:at-timestamp(function() {
+               cts:uris(if ($start = "") then () else $start,
+                        concat("limit=", $limit), local:query())
+             })
+let $keep := $page[($prefix = "" or starts-with(., $prefix))
+                   and ($end = "" or . lt $end)]
+return
+  object-node {
+    "uris": array-node { $keep },
+    "more": count($keep) = count($page) and count($page) = $limit
+  }
+"""
+
+_URIS_SAMPLE = _URIS_PROLOG + """
+declare variable $sample as xs:unsignedInt external;
+
+(: A prefix that names a directory can restrict the fragments sampled :)
+let $query := cts:and-query((
+                local:query(),
+                if (ends-with($prefix, "/"))
+                then cts:directory-query($prefix, "infinity")
+                else ()))
+return array-node {
+  local:at-timestamp(function() {
+    cts:uris(if ($prefix = "") then () else $prefix,
+             concat("sample=", $sample), $query)
+      [$prefix = "" or starts-with(., $prefix)]
+  })
+}
+"""
+
+_LAST_MODIFIED = """xquery version "1.0-ml";
+declare variable $uris as xs:string external;
+
+let $stamps := map:map()
+let $_ :=
+  for $uri in json:array-values(xdmp:from-json-string($uris))
+  let $dt := xdmp:document-get-properties($uri, xs:QName("prop:last-modified"))
+  where $dt
+  return map:put($stamps, $uri, string($dt))
+return xdmp:to-json($stamps)
+"""
+
+_CONTENT_HASH = """xquery version "1.0-ml";
+declare variable $uris as xs:string external;
+
+let $hashes := map:map()
+let $_ :=
+  for $uri in json:array-values(xdmp:from-json-string($uris))
+  let $doc := fn:doc($uri)
+  where $doc/binary() or $doc/text()
+  return
+    map:put($hashes, $uri,
+            if ($doc/binary())
+            then xdmp:md5($doc/binary())
+            else xdmp:md5(string($doc)))
+return xdmp:to-json($hashes)
+"""
+
+def _none_as_empty(value):
+    """Convert None to the empty string for external variables."""
+    if value is None:
+        return ""
+    return str(value)
+
+def split_points(sample, count):
+    """
+    Choose up to count - 1 points that split the sorted sample into
+    count parts of approximately equal size. The points are distinct
+    and in order; the first member of the sample is never chosen, so
+    that no range is empty.
+    """
+    sample = sorted(set(sample))
+    points = []
+    for index in range(1, count):
+        pos = (index * len(sample)) // count
+        if pos > 0 and (not points or sample[pos] > points[-1]):
+            points.append(sample[pos])
+    return points
 
 class ClientUtils:
     """
@@ -47,85 +158,248 @@ class ClientUtils:
             self.connection = None
         self.logger = logging.getLogger("marklogic.client.utils")
 
-    def uris(self, database, root=None, connection=None):
+    def uris(self, database, root=None, timestamp=None, connection=None):
         """Get a list of all the URIs in a database.
 
         If root is provided, only URIs that start-with() that string
         will be returned.
+
+        The URIs are read a page at a time with iter_uris(); for very
+        large databases, iterate over iter_uris() directly instead of
+        building a list. If a timestamp is provided, the URIs are read
+        at that point in time.
         """
         uris = []
+        for uri in self.iter_uris(database, prefix=root, timestamp=timestamp,
+                                  connection=connection):
+            uris.append(uri)
+        return uris
+
+    def timestamp(self, database, connection=None):
+        """Get the current timestamp of a database.
 
+        Reads performed at this timestamp see a consistent view of the
+        database, no matter what updates happen in the meantime.
+        """
         if connection is None:
             connection = self.connection
 
         mleval = Eval(connection)
+        mleval.set_xquery("xquery version '1.0-ml'; xdmp:request-timestamp()")
+        mleval.set_database(database)
+        for stamp in mleval.results():
+            return int(stamp)
+        return None
 
-        version = "xquery version '1.0-ml';"
+    def iter_uris(self, database, prefix=None, collection=None,
+                  directory=None, start=None, end=None,
+                  page_size=URIPAGESIZE, timestamp=None, connection=None):
+        """Iterate over the URIs in a database, a page at a time.
 
-        if root is None or root == "":
-            mleval.set_xquery("{} cts:uris()".format(version))
-        else:
-            root = root.replace("'", "&apos;")
-            mleval.set_xquery("{} cts:uris()[starts-with(.,'{}')]" \
-                                  .format(version, root))
+        The URI lexicon is read in pages of page_size URIs. Every page
+        is read at the same timestamp, so the iteration is consistent
+        even if the database changes while it runs. If no timestamp is
+        provided, the current timestamp of the database is used.
+
+        The URIs can be limited to those that start with prefix, those
+        in collection, or those in directory (and its descendants). If
+        start is provided, iteration begins at the first URI greater
+        than or equal to start. If end is provided, iteration stops
+        before the first URI greater than or equal to end. See
+        uri_ranges() for a way to split the URIs into ranges that can
+        be read in parallel.
+        """
+        if connection is None:
+            connection = self.connection
+
+        if timestamp is None:
+            timestamp = self.timestamp(database, connection)
+
+        if prefix is not None and prefix != "":
+            if start is None or start < prefix:
+                start = prefix
 
+        mleval = Eval(connection)
+        mleval.set_xquery(_URIS_PAGE)
         mleval.set_database(database)
-        response = mleval.eval()
+        mleval.set_vars(self._uri_vars(prefix, collection, directory,
+                                       timestamp))
+        mleval.set_var("end", _none_as_empty(end))
 
-        if 'content-type' in response.headers:
-            if response.headers['content-type'].startswith("multipart/mixed"):
-                decoder = MultipartDecoder.from_response(response)
-                for part in decoder.parts:
-                    uris.append(part.text)
+        after = None
+        while True:
+            if after is None:
+                mleval.set_var("start", _none_as_empty(start))
+                mleval.set_var("limit", page_size)
+            else:
+                mleval.set_var("start", after)
+                mleval.set_var("limit", page_size + 1)
 
-        return uris
+            page = None
+            for result in mleval.results():
+                page = result
+            if page is None:
+                return
+
+            uris = page['uris']
+            if after is not None and uris and uris[0] == after:
+                uris = uris[1:]
+            for uri in uris:
+                yield uri
 
-    def last_modified(self, database, uris=None, connection=None):
-        """Get a list of last-modified times.
+            if not page['more'] or not uris:
+                return
+            after = uris[-1]
+
+    def uri_ranges(self, database, count, prefix=None, collection=None,
+                   directory=None, timestamp=None, sample_size=URISAMPLESIZE,
+                   connection=None):
+        """Split the URIs in a database into count contiguous ranges.
+
+        Returns a list of (start, end) tuples suitable for passing to
+        iter_uris(), so that each range can be read by a different
+        worker. The first start and the last end are None.
+
+        The lexicon isn't enumerated. The split points are chosen from
+        the URIs of a sample of sample_size fragments per forest, so the
+        ranges are only approximately equal in size, and there may be
+        fewer than count of them if the sample is small. A prefix that
+        doesn't end in "/" can't restrict the sample, so a narrow prefix
+        of that sort may need a larger sample_size.
+        """
+        if connection is None:
+            connection = self.connection
+
+        if count < 2:
+            return [(None, None)]
+
+        mleval = Eval(connection)
+        mleval.set_xquery(_URIS_SAMPLE)
+        mleval.set_database(database)
+        mleval.set_vars(self._uri_vars(prefix, collection, directory,
+                                       timestamp))
+        mleval.set_var("sample", sample_size)
+
+        sample = []
+        for result in mleval.results():
+            sample = result
+
+        bounds = [None] + split_points(sample, count) + [None]
+        ranges = []
+        for index in range(0, len(bounds) - 1):
+            ranges.append((bounds[index], bounds[index+1]))
+        return ranges
+
+    def _uri_vars(self, prefix, collection, directory, timestamp):
+        """Internal method to construct the variables for URI queries."""
+        return {"prefix": _none_as_empty(prefix),
+                "collection": _none_as_empty(collection),
+                "directory": _none_as_empty(directory),
+                "timestamp": _none_as_empty(timestamp)}
+
+    def last_modified(self, database, uris=None, chunk_size=CHUNKSIZE,
+                      concurrency=4, connection=None):
+        """Get a dictionary of last-modified times, keyed by URI.
 
         If uris are provided, returns last modified times for those URIs,
         otherwise attempts to find times for all URIs in the database.
         This requires the database setting to manage last modified times,
-        naturally.
+        naturally. URIs that have no last-modified time are omitted.
+
+        See iter_last_modified() for a description of the other
+        parameters.
+        """
+        stamps = {}
+        for uri, stamp in self.iter_last_modified(database, uris, chunk_size,
+                                                  concurrency,
+                                                  connection=connection):
+            stamps[uri] = stamp
+        return stamps
+
+    def iter_last_modified(self, database, uris=None, chunk_size=CHUNKSIZE,
+                           concurrency=4, ordered=False, connection=None):
+        """Iterate over the last-modified times of URIs.
+
+        The URIs are sent to the server in chunks of chunk_size, with up
+        to concurrency chunks in flight at once. The URIs are passed as an
+        external variable, so the query is the same for every chunk and
+        the server only has to compile it once. A (uri, timestamp) tuple
+        is yielded for each URI that has a last-modified time, in the
+        order in which the chunks complete.
+
+        If uris is None, all of the URIs in the database are read with
+        iter_uris().
+
+        If ordered is True, a tuple is yielded for every URI, in the
+        order of uris, and the timestamp is None for a URI that has no
+        last-modified time. Because iter_uris() returns URIs in sorted
+        order, this produces a sorted stream of the whole database in
+        constant memory.
+        """
+        return self._iter_chunked(_LAST_MODIFIED, database, uris, chunk_size,
+                                  concurrency, ordered, connection)
+
+    def content_hashes(self, database, uris=None, chunk_size=CHUNKSIZE,
+                       concurrency=4, connection=None):
+        """Get a dictionary of content hashes, keyed by URI.
+
+        See iter_content_hashes() for a description of the hashes and
+        the other parameters.
+        """
+        hashes = {}
+        for uri, digest in self.iter_content_hashes(database, uris,
+                                                    chunk_size, concurrency,
+                                                    connection=connection):
+            hashes[uri] = digest
+        return hashes
+
+    def iter_content_hashes(self, database, uris=None, chunk_size=CHUNKSIZE,
+                            concurrency=4, ordered=False, connection=None):
+        """Iterate over the content hashes of URIs.
+
+        The server computes the MD5 hash (in hex) of each binary and text
+        document: binaries as stored, text as UTF-8. Those are the bytes
+        the documents endpoint returns, so a file downloaded from the
+        database has the same hash as the document it came from. XML
+        and JSON documents are serialized differently by the documents
+        endpoint than by the server's other serializers, so they can't be
+        compared this way and aren't hashed.
+
+        A (uri, hash) tuple is yielded for each binary or text document
+        that exists. The chunking, concurrency and ordering are the same
+        as iter_last_modified().
+        """
+        return self._iter_chunked(_CONTENT_HASH, database, uris, chunk_size,
+                                  concurrency, ordered, connection)
+
+    def _iter_chunked(self, query, database, uris, chunk_size, concurrency,
+                      ordered, connection):
+        """Internal method to run a per-URI query over chunks of URIs.
+
+        The query must accept a JSON array of URIs in $uris and return
+        a JSON object keyed by URI.
         """
         if connection is None:
             connection = self.connection
 
-        mleval = Eval(connection)
-
         if uris is None:
-            leturis = "let $uris := cts:uris()"
-        else:
-            leturis = "let $uris := cts:uris()["
-            comma = ""
-            for uri in uris:
-                leturis += "{}'{}'".format(comma, uri)
-                comma = ", "
-            leturis += "]"
-
-        lines = (leturis, \
-                     'let $dts  := for $uri in $uris', \
-                     '             let $dt := xdmp:document-get-properties($uri, xs:QName("prop:last-modified"))', \
-                     '             where $dt', \
-                     '             return', \
-                     '                object-node { "uri": $uri, "dt": string($dt) }', \
-                     'return', \
-                     '  array-node { $dts }')
-
-        xquery = "\n".join(lines)
-        #print(xquery)
-        mleval.set_xquery(xquery)
-        mleval.set_database(database)
-        response = mleval.eval()
-
-        data = None
-        if 'content-type' in response.headers:
-            if response.headers['content-type'].startswith("multipart/mixed"):
-                decoder = MultipartDecoder.from_response(response)
-                for part in decoder.parts:
-                    if data is None:
-                        data = json.loads(part.text)
-                    else:
-                        raise RuntimeError("Multipart reply to timestamp query!?")
-
-        return data
+            uris = self.iter_uris(database, connection=connection)
+
+        def lookup(chunk):
+            mleval = Eval(connection)
+            mleval.set_xquery(query)
+            mleval.set_database(database)
+            mleval.set_var("uris", json.dumps(chunk))
+            data = {}
+            for result in mleval.results():
+                data = result
+            return (chunk, data)
+
+        for chunk, data in imap(lookup, chunks(uris, chunk_size),
+                                concurrency, ordered):
+            if ordered:
+                for uri in chunk:
+                    yield (uri, data.get(uri))
+            else:
+                for uri in data:
+                    yield (uri, data[uri])
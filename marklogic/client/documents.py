@@ -24,13 +24,26 @@
 Support the v1/documents endpoint
 """
 
+import copy
+import json
 import logging
+import re
+import time
+from functools import lru_cache
 from urllib import parse
+from xml.sax.saxutils import escape
 from marklogic.utilities import PropertyLists
+from marklogic.utilities.concurrency import imap_iter, chunks
 from marklogic.client.exceptions import InvalidAPIRequest, UnsupportedOperation
+from marklogic.client.exceptions import UnexpectedAPIResponse
+from marklogic.client.multipart import iter_parts
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+from requests.exceptions import RequestException
 from requests.packages.urllib3.fields import RequestField
 from requests.packages.urllib3.filepost import encode_multipart_formdata
 
+BATCHSIZE = 1000
+
 class Documents(PropertyLists):
     """
     The Documents class encapsulates a call to the Client API v1/documents
@@ -50,6 +63,7 @@ class Documents(PropertyLists):
         self._content = None
         self._metadata = None
         self._metadata_content_type = None
+        self._metadata_format = "xml"
         self.permissions = []
         self.properties = []
         self.transparams = []
@@ -228,6 +242,18 @@ class Documents(PropertyLists):
         """Get the current transaction id."""
         return self._get('txid')
 
+    def set_timestamp(self, timestamp):
+        """Set the point-in-time timestamp at which documents are read.
+
+        Reads at the same timestamp see the same version of the
+        database, whatever updates happen in between.
+        """
+        return self._set('timestamp', timestamp)
+
+    def timestamp(self):
+        """Get the point-in-time timestamp."""
+        return self._get('timestamp')
+
     def set_accept(self, accept):
         """Set the accept header for the requests."""
         return self._set('accept', accept)
@@ -468,11 +494,32 @@ class Documents(PropertyLists):
         else:
             raise InvalidAPIRequest("Metadata format must be 'application/json' or 'application/xml'")
 
+    def set_metadata_format(self, form):
+        """Set the format of generated metadata, 'xml' or 'json'.
+
+        This only applies to metadata generated from the quality,
+        collections, permissions, and properties settings. Arbitrary
+        metadata is sent as-is.
+        """
+        if form not in ["xml", "json"]:
+            raise InvalidAPIRequest("Metadata format must be 'xml' or 'json'")
+        self._metadata_format = form
+        return self
+
+    def metadata_format(self):
+        """Get the format of generated metadata."""
+        return self._metadata_format
+
     def metadata_content_type(self):
-        """Return the content type of arbitrary metadata.
-        Return None if arbitrary metadata has not been assigned.
+        """Return the content type of the metadata.
+
+        If arbitrary metadata has been assigned, this is the content type
+        it was assigned with, otherwise it's the content type of the
+        generated metadata.
         """
         if self._metadata_content_type is None:
+            if self._metadata_format == "json":
+                return "application/json"
             return "application/xml"
         else:
             return self._metadata_content_type
@@ -480,42 +527,22 @@ class Documents(PropertyLists):
     def metadata(self):
         """Returns the metadata.
 
-        If arbitrary metadata was assigned, it is returned and the format
-        parameter is ignored. If not, then metadata is returned as
-        an XML string.
+        If arbitrary metadata was assigned, it is returned unchanged. If not,
+        then metadata is generated in the current metadata format and
+        returned as UTF-8 encoded bytes.
+
+        Generated metadata is cached, so documents that share the same
+        quality, collections, permissions, and properties share a single
+        serialization.
         """
         if self._metadata:
             return self._metadata
 
-        xml = '<rapi:metadata xmlns:rapi="http://marklogic.com/rest-api" ' \
-          + 'xmlns:prop="http://marklogic.com/xdmp/property">\n'
-
-        if 'quality' in self._config:
-            xml += "<rapi:quality>{}</rapi:quality>\n".format(self._config['quality'])
-
-        if self._config['collection']:
-            xml += "<rapi:collections>\n"
-            for collection in self._config['collection']:
-                xml += "<rapi:collection>{}</rapi:collection>\n".format(collection)
-            xml += "</rapi:collections>\n"
-
-        if self.permissions:
-            xml += "<rapi:permissions>\n"
-            for pair in self.permissions:
-                xml += "<rapi:permission>\n"
-                xml += "  <rapi:role-name>{}</rapi:role-name>".format(pair[0])
-                xml += "  <rapi:capability>{}</rapi:capability>".format(pair[1])
-                xml += "</rapi:permission>\n"
-            xml += "</rapi:permissions>\n"
-
-        if self.properties:
-            xml += "<prop:properties>\n"
-            for pair in self.properties:
-                xml += "<{}>{}</{}>\n".format(pair[0], pair[1], pair[0])
-            xml += "</rapi:properties>\n"
-
-        xml += "</rapi:metadata>"
-        return xml
+        return _compile_metadata(self._metadata_format,
+                                 self._config.get('quality'),
+                                 tuple(self._config['collection']),
+                                 tuple(self.permissions),
+                                 tuple(self.properties))
 
     def set_content(self, data, content_type=None):
         """Set content.
@@ -545,6 +572,7 @@ class Documents(PropertyLists):
         self._content = None
         self._metadata = None
         self._metadata_content_type = None
+        self._metadata_format = "xml"
         self.permissions = []
         self.properties = []
         self.transparams = []
@@ -562,6 +590,130 @@ class Documents(PropertyLists):
         if connection is None:
             connection = self.connection
 
+        response = connection.get(self._get_uri(uri, connection),
+                                  accept=self._config['accept'])
+        return response
+
+    def stream(self, uri=None, connection=None, spool_threshold=None):
+        """
+        Perform an HTTP GET on the document(s) described by this object
+        and iterate over the results as they arrive.
+
+        The response is read as a multipart/mixed stream and decoded
+        incrementally. For each document, a tuple of (uri, metadata,
+        content, content_type) is yielded. The metadata is None unless the
+        metadata category was requested; the content and content_type are
+        None if only metadata was requested.
+
+        If spool_threshold is None, metadata and content are returned as
+        bytes. Otherwise, content is returned as a file-like object that
+        is held in memory up to spool_threshold bytes and spooled to a
+        temporary file beyond that, so memory use is bounded by the
+        threshold rather than by the size of the batch.
+        """
+        if connection is None:
+            connection = self.connection
+
+        response = connection.get(self._get_uri(uri, connection),
+                                  accept="multipart/mixed", stream=True)
+
+        if response.status_code != 200:
+            raise UnexpectedAPIResponse(response.text)
+
+        pending = None
+        try:
+            for part in iter_parts(response, spool_threshold):
+                target = part.filename()
+                if part.category() == 'metadata':
+                    if pending is not None:
+                        yield (pending[0], pending[1], None, None)
+                    pending = (target, part.content())
+                else:
+                    meta = None
+                    if pending is not None:
+                        if pending[0] == target:
+                            meta = pending[1]
+                        else:
+                            yield (pending[0], pending[1], None, None)
+                        pending = None
+                    yield (target, meta, part.body, part.content_type())
+            if pending is not None:
+                yield (pending[0], pending[1], None, None)
+        finally:
+            response.close()
+
+    def read_many(self, uris, batch_size=BATCHSIZE, concurrency=4,
+                  ordered=False, retries=2, spool_threshold=None,
+                  timestamp=None, connection=None):
+        """
+        Read a large number of documents in concurrent batches.
+
+        The uris are split into batches of batch_size and each batch is
+        read with a multi-URI GET. Up to concurrency batches are in flight
+        at once, so network reads overlap with whatever the caller does
+        with the results. All of the other settings on this object
+        (database, categories, transaction, etc.) apply to every batch.
+
+        Each batch is a separate request. Unless they are all in the
+        same transaction, pass a timestamp (see ClientUtils.timestamp())
+        so that every batch reads the database at the same point in time.
+
+        A tuple of (uri, metadata, content, content_type) is yielded for
+        each document, as for stream(), as soon as it has been decoded;
+        only a few documents per batch are held in memory. If ordered is
+        True, batches are yielded in the order they were requested,
+        otherwise documents are yielded as they arrive. A batch that
+        fails is retried up to retries times before the exception is
+        raised to the caller.
+        """
+        if connection is None:
+            connection = self.connection
+
+        def read(batch):
+            return self._read_batch(batch, retries, spool_threshold,
+                                    timestamp, connection)
+
+        for result in imap_iter(read, chunks(uris, batch_size),
+                                concurrency, ordered):
+            yield result
+
+    def _read_batch(self, batch, retries, spool_threshold, timestamp,
+                    connection):
+        """
+        Internal method to read a single batch for read_many().
+        """
+        docs = Documents(connection)
+        docs._config = copy.deepcopy(self._config)
+        docs.transparams = list(self.transparams)
+        docs.set_uris(batch)
+        if timestamp is not None:
+            docs.set_timestamp(timestamp)
+
+        # A retry starts the batch again; skip what was already yielded
+        done = 0
+        attempt = 0
+        while True:
+            try:
+                count = 0
+                for result in docs.stream(spool_threshold=spool_threshold):
+                    count += 1
+                    if count > done:
+                        done = count
+                        yield result
+                return
+            except (RequestException, UnexpectedAPIResponse,
+                    UnexpectedManagementAPIResponse) as err:
+                attempt += 1
+                if attempt > retries:
+                    raise
+                self.logger.debug("Retrying batch of {} ({}): {}"
+                                  .format(len(batch), attempt, err))
+                time.sleep(attempt)
+
+    def _get_uri(self, uri, connection):
+        """
+        Internal method to construct the URI for a GET request.
+        """
         params = []
         if uri is None:
             for uri in self._config['uri']:
@@ -569,7 +721,7 @@ class Documents(PropertyLists):
         else:
             params.append("uri=" + parse.quote(uri))
 
-        for key in ['database', 'format', 'transform', 'txid']:
+        for key in ['database', 'format', 'transform', 'txid', 'timestamp']:
             if key in self._config:
                 params.append("{}={}".format(key, self._config[key]))
 
@@ -581,10 +733,7 @@ class Documents(PropertyLists):
 
         uri = connection.client_uri("documents")
 
-        uri = uri + "?" + "&".join(params)
-
-        response = connection.get(uri, accept=self._config['accept'])
-        return response
+        return uri + "?" + "&".join(params)
 
     def put(self, data=None, uri=None, connection=None):
         """
@@ -682,10 +831,7 @@ class Documents(PropertyLists):
             params.append("trans:{}={}".format(pair[0], pair[1]))
 
         meta = self.metadata()
-        if self.metadata_content_type() is None:
-            metact = "application/xml"
-        else:
-            metact = self.metadata_content_type()
+        metact = self.metadata_content_type()
 
         uri = connection.client_uri("documents")
         if params:
@@ -745,3 +891,69 @@ class Documents(PropertyLists):
         response = connection.delete(uri)
 
         return response
+
+
+_PROPERTY_NAME = re.compile(r"^[A-Za-z_][\w.\-]*$")
+
+@lru_cache(maxsize=1024)
+def _compile_metadata(form, quality, collections, permissions, properties):
+    """
+    Serialize document metadata in the Client API format.
+
+    All of the arguments must be hashable; the results are cached so
+    that a batch of documents with the same settings only pays for
+    serialization once.
+    """
+    if form == "json":
+        meta = {}
+        if quality is not None:
+            meta['quality'] = int(quality)
+        if collections:
+            meta['collections'] = list(collections)
+        if permissions:
+            roles = {}
+            for role, capability in permissions:
+                if role not in roles:
+                    roles[role] = []
+                roles[role].append(capability)
+            meta['permissions'] = [{'role-name': role, 'capabilities': roles[role]}
+                                   for role in roles]
+        if properties:
+            props = {}
+            for name, value in properties:
+                props[name] = value
+            meta['properties'] = props
+        return json.dumps(meta, separators=(',', ':')).encode('utf-8')
+
+    lines = ['<rapi:metadata xmlns:rapi="http://marklogic.com/rest-api" '
+             + 'xmlns:prop="http://marklogic.com/xdmp/property">']
+
+    if quality is not None:
+        lines.append("<rapi:quality>{}</rapi:quality>".format(escape(str(quality))))
+
+    if collections:
+        lines.append("<rapi:collections>")
+        for collection in collections:
+            lines.append("<rapi:collection>{}</rapi:collection>"
+                         .format(escape(collection)))
+        lines.append("</rapi:collections>")
+
+    if permissions:
+        lines.append("<rapi:permissions>")
+        for role, capability in permissions:
+            lines.append("<rapi:permission>"
+                         + "<rapi:role-name>{}</rapi:role-name>".format(escape(role))
+                         + "<rapi:capability>{}</rapi:capability>".format(escape(capability))
+                         + "</rapi:permission>")
+        lines.append("</rapi:permissions>")
+
+    if properties:
+        lines.append("<prop:properties>")
+        for name, value in properties:
+            if not _PROPERTY_NAME.match(name):
+                raise InvalidAPIRequest("Invalid property name: {}".format(name))
+            lines.append("<{0}>{1}</{0}>".format(name, escape(str(value))))
+        lines.append("</prop:properties>")
+
+    lines.append("</rapi:metadata>")
+    return "\n".join(lines).encode('utf-8')
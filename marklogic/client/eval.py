@@ -25,9 +25,11 @@ Support the v1/eval endpoint
 """
 
 from __future__ import unicode_literals, print_function, absolute_import
-import json, logging
-from marklogic.client.exceptions import InvalidAPIRequest
-from requests_toolbelt import MultipartDecoder
+import codecs, hashlib, json, logging, threading
+from marklogic.client.documents import Documents
+from marklogic.client.exceptions import InvalidAPIRequest, UnexpectedAPIResponse
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+from marklogic.client.multipart import boundary, iter_parts, iter_response_events
 
 class Eval:
     """
@@ -43,6 +45,7 @@ class Eval:
         else:
             self.connection = None
         self.logger = logging.getLogger("marklogic.client.eval")
+        self._cached = False
 
     def _get(self, name):
         """Internal method to conditionally get a config variable"""
@@ -118,18 +121,131 @@ class Eval:
         """Get the transaction ID"""
         return self._get('txid')
 
+    def set_cached(self, cached=True):
+        """Evaluate the code through a cached module.
+
+        In cached mode, the code is installed once as a module in the
+        modules database of the app server (named by a hash of the code)
+        and then evaluated through the v1/invoke endpoint. Only the
+        variables are sent with each request and the server doesn't have
+        to parse the code again. This is worthwhile for code that is
+        evaluated many times. Installed modules are remembered for the
+        life of the process; call uninstall_modules() to remove them.
+
+        If the app server takes modules from the filesystem, the code
+        is evaluated normally.
+        """
+        self._cached = cached
+        return self
+
+    def cached(self):
+        """Get the cached mode"""
+        return self._cached
+
     def clear(self):
         """Clear the Eval object; return it to its initial state."""
         self._config = {}
+        self._cached = False
 
     def eval(self, connection=None):
         """Perform the evaluation specified."""
         if connection is None:
             connection = self.connection
 
+        return self._post(connection)
+
+    def results(self, encoding=None, connection=None):
+        """Perform the evaluation and iterate over the results.
+
+        The response is decoded incrementally as it arrives and each
+        result is converted to a Python value: JSON to a dict or list,
+        numeric types to int or float, booleans to bool, text and XML
+        to str, and anything else (binaries) to bytes.
+
+        Returning a very long sequence of items costs a multipart part per
+        item. If encoding is 'lines', the code is expected to return a
+        single string of newline-separated values (for example, with
+        string-join($items, "&#10;")) and each line is yielded as a str.
+        If encoding is 'json', the code is expected to return a single
+        JSON array and each member is yielded as it's decoded. In both
+        cases the result is streamed, it is never held in memory all at
+        once.
+        """
+        if encoding not in [None, 'lines', 'json']:
+            raise InvalidAPIRequest("Encoding must be 'lines' or 'json'")
+
+        if connection is None:
+            connection = self.connection
+
+        response = self._post(connection, stream=True)
+        try:
+            if response.status_code != 200:
+                raise UnexpectedAPIResponse(response.text)
+            if boundary(response.headers.get('content-type')) is None:
+                return
+
+            if encoding is None:
+                for part in iter_parts(response):
+                    yield _decode_part(part)
+            else:
+                events = iter_response_events(response)
+                if encoding == 'lines':
+                    values = _iter_lines(events)
+                else:
+                    values = _iter_json_array(events)
+                for value in values:
+                    yield value
+        finally:
+            response.close()
+
+    def uninstall_modules(self, connection=None):
+        """Remove the cached modules installed through this connection.
+
+        Returns the number of modules removed.
+        """
+        if connection is None:
+            connection = self.connection
+
+        count = 0
+        with _MODULES_LOCK:
+            for key in list(_MODULES):
+                host, port, modules_db = key
+                if host != connection.host or port != connection.port:
+                    continue
+                docs = Documents(connection)
+                docs.set_database(modules_db)
+                for module in _MODULES[key]:
+                    docs.delete(module)
+                    count += 1
+                del _MODULES[key]
+        return count
+
+    def _post(self, connection, stream=False):
+        """Internal method to post the evaluation request."""
+        if self._cached:
+            module = self._module(connection)
+            if module is not None:
+                # The module may have been removed behind our back;
+                # depending on the version, the server says so with a
+                # 404 or a 500
+                try:
+                    response = self._invoke(connection, module, stream)
+                except UnexpectedManagementAPIResponse as err:
+                    if "MODNOTFOUND" not in str(err):
+                        raise
+                    response = None
+                if response is not None:
+                    if (response.status_code != 404
+                            or "MODNOTFOUND" not in response.text):
+                        return response
+                    response.close()
+                self._forget_module(connection, module)
+                module = self._module(connection)
+                return self._invoke(connection, module, stream)
+
         data = {}
         for key in self._config:
-            if key is not 'vars':
+            if key != 'vars':
                 data[key] = self._config[key]
 
         if 'vars' in self._config:
@@ -138,6 +254,179 @@ class Eval:
         uri = connection.client_uri("eval")
         response = connection.post(uri, payload=data, \
                                        content_type="application/x-www-form-urlencoded", \
-                                       accept="multipart/mixed")
+                                       accept="multipart/mixed", stream=stream)
         return response
 
+    def _invoke(self, connection, module, stream):
+        """Internal method to invoke a cached module."""
+        data = {'module': module}
+        for key in ['database', 'txid']:
+            if key in self._config:
+                data[key] = self._config[key]
+
+        if 'vars' in self._config:
+            data['vars'] = json.dumps(self._config['vars'])
+
+        uri = connection.client_uri("invoke")
+        response = connection.post(uri, payload=data, \
+                                       content_type="application/x-www-form-urlencoded", \
+                                       accept="multipart/mixed", stream=stream)
+        return response
+
+    def _module(self, connection):
+        """Internal method to find or install the cached module.
+
+        Returns the module URI, or None if the app server doesn't use a
+        modules database.
+        """
+        if 'xquery' in self._config:
+            code = self._config['xquery']
+            ext = ".xqy"
+            content_type = "application/vnd.marklogic-xdmp"
+        elif 'javascript' in self._config:
+            code = self._config['javascript']
+            ext = ".sjs"
+            content_type = "application/vnd.marklogic-javascript"
+        else:
+            raise InvalidAPIRequest("No code to evaluate")
+
+        modules_db = _modules_database(connection)
+        if modules_db is None:
+            return None
+
+        digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+        module = MODULEROOT + digest + ext
+        key = (connection.host, connection.port, modules_db)
+
+        with _MODULES_LOCK:
+            installed = _MODULES.setdefault(key, set())
+            if module in installed:
+                return module
+
+            self.logger.debug("Installing {} in {}".format(module, modules_db))
+            docs = Documents(connection)
+            docs.set_database(modules_db)
+            docs.set_content_type(content_type)
+            for role, capability in MODULEPERMISSIONS:
+                docs.add_permission(role, capability)
+            response = docs.put(code, module)
+            if response.status_code not in [201, 204]:
+                raise UnexpectedAPIResponse(response.text)
+            installed.add(module)
+
+        return module
+
+    def _forget_module(self, connection, module):
+        """Internal method to remove a module from the registry."""
+        with _MODULES_LOCK:
+            for key in _MODULES:
+                if key[0] == connection.host and key[1] == connection.port:
+                    _MODULES[key].discard(module)
+
+MODULEROOT = "/marklogic-python-api/eval/"
+MODULEPERMISSIONS = [("rest-reader", "read"), ("rest-reader", "execute")]
+
+# The registry of installed modules, keyed by (host, port, modules database)
+_MODULES = {}
+_MODULES_LOCK = threading.RLock()
+
+# The modules database of each app server, keyed by (host, port); also
+# guarded by _MODULES_LOCK
+_MODULES_DATABASES = {}
+
+def _modules_database(connection):
+    """Find the name of the modules database of the app server.
+
+    Returns None if the app server reads modules from the filesystem.
+    """
+    key = (connection.host, connection.port)
+    with _MODULES_LOCK:
+        if key not in _MODULES_DATABASES:
+            mleval = Eval(connection)
+            mleval.set_xquery("xquery version '1.0-ml'; "
+                              + "if (xdmp:modules-database() = 0) then () "
+                              + "else xdmp:database-name(xdmp:modules-database())")
+            name = None
+            for result in mleval.results():
+                name = result
+            _MODULES_DATABASES[key] = name
+        return _MODULES_DATABASES[key]
+
+_INTEGER_TYPES = ['integer', 'int', 'long', 'short', 'byte',
+                  'nonNegativeInteger', 'nonPositiveInteger',
+                  'positiveInteger', 'negativeInteger',
+                  'unsignedLong', 'unsignedInt', 'unsignedShort',
+                  'unsignedByte']
+
+_FLOAT_TYPES = ['decimal', 'double', 'float']
+
+def _decode_part(part):
+    """Convert a single eval result part to a Python value."""
+    primitive = part.header('x-primitive')
+    content_type = part.content_type() or ""
+    body = part.content()
+
+    if primitive in _INTEGER_TYPES:
+        return int(body)
+    if primitive in _FLOAT_TYPES:
+        return float(body)
+    if primitive == 'boolean':
+        return body == b"true"
+    if content_type.startswith("application/json"):
+        return json.loads(body.decode('utf-8'))
+    if content_type.startswith("text/") or "xml" in content_type:
+        return body.decode('utf-8')
+    return body
+
+def _iter_lines(events):
+    """Iterate over the lines in the (single) part of a result stream."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    rest = ""
+    for headers, data in events:
+        if data is None:
+            continue
+        rest += decoder.decode(data)
+        lines = rest.split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    rest += decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+def _iter_json_array(events):
+    """Iterate over the members of a JSON array in a result stream."""
+    decoder = json.JSONDecoder()
+    chars = codecs.getincrementaldecoder('utf-8')()
+    buf = ""
+    pos = 0
+    started = False
+    for headers, data in events:
+        if data is None:
+            continue
+        buf = buf[pos:] + chars.decode(data)
+        pos = 0
+        while True:
+            # Skip whitespace and separators
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise UnexpectedAPIResponse("Result is not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break
+            # A number may be incomplete unless a delimiter follows it
+            if end >= len(buf) or buf[end] not in " \t\r\n,]":
+                break
+            yield value
+            pos = end
+    raise UnexpectedAPIResponse("Truncated JSON array")
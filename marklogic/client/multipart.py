@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Incremental decoding of multipart/mixed responses
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import re
+import tempfile
+from marklogic.client.exceptions import UnexpectedAPIResponse
+
+CHUNKSIZE = 64 * 1024
+
+_BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_FILENAME = re.compile(r'filename="((?:[^"\\]|\\.)*)"')
+_CATEGORY = re.compile(r'category=([\w-]+)')
+
+
+class MultipartPart:
+    """
+    A single part of a multipart/mixed response.
+
+    The headers are available as a dictionary with lower-cased names. The
+    body is either a bytes object or, if the part was spooled, a
+    file-like object positioned at the start of the body.
+    """
+    def __init__(self, headers, body):
+        self.headers = headers
+        self.body = body
+
+    def header(self, name):
+        """Get a header value, or None if the header isn't present"""
+        return self.headers.get(name.lower())
+
+    def content_type(self):
+        """Get the content type of the part"""
+        return self.header('content-type')
+
+    def filename(self):
+        """Get the filename (the document URI) from the content disposition"""
+        disp = self.header('content-disposition')
+        if disp is None:
+            return None
+        match = _FILENAME.search(disp)
+        if match is None:
+            return None
+        return re.sub(r'\\(.)', r'\1', match.group(1))
+
+    def category(self):
+        """Get the category from the content disposition"""
+        disp = self.header('content-disposition')
+        if disp is None:
+            return None
+        match = _CATEGORY.search(disp)
+        if match is None:
+            return None
+        return match.group(1)
+
+    def content(self):
+        """Get the body as bytes, reading it if it was spooled"""
+        if isinstance(self.body, bytes):
+            return self.body
+        return self.body.read()
+
+
+def boundary(content_type):
+    """Extract the boundary parameter from a multipart content type"""
+    if content_type is None:
+        return None
+    match = _BOUNDARY.search(content_type)
+    if match is None:
+        return None
+    return match.group(1).encode('ascii')
+
+
+def iter_parts(response, spool_threshold=None, chunk_size=CHUNKSIZE):
+    """
+    Iterate over the parts of a multipart/mixed response as they arrive.
+
+    The response should have been requested with stream=True, otherwise
+    requests will already have read the whole body. Parts are yielded as
+    MultipartPart objects. Only one part body is buffered at a time.
+
+    If spool_threshold is None, each body is returned as bytes. Otherwise
+    bodies are written to a temporary file that stays in memory until
+    it exceeds spool_threshold bytes, and the file is returned instead.
+    """
+    bound = boundary(response.headers.get('content-type'))
+    if bound is None:
+        raise UnexpectedAPIResponse("Response is not multipart")
+    return iter_stream(response.iter_content(chunk_size), bound,
+                       spool_threshold)
+
+
+def iter_response_events(response, chunk_size=CHUNKSIZE):
+    """
+    Iterate over the low-level events of a multipart/mixed response.
+
+    See iter_events() for a description of the events.
+    """
+    bound = boundary(response.headers.get('content-type'))
+    if bound is None:
+        raise UnexpectedAPIResponse("Response is not multipart")
+    return iter_events(response.iter_content(chunk_size), bound)
+
+
+def iter_stream(chunks, bound, spool_threshold=None):
+    """
+    Iterate over the parts of a multipart stream.
+
+    The chunks are an iterable of bytes objects; bound is the boundary
+    string (as bytes) without the leading dashes.
+    """
+    body = None
+    for headers, data in iter_events(chunks, bound):
+        if headers is not None:
+            if spool_threshold is None:
+                body = None
+            else:
+                body = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+            current = headers
+        elif data is not None:
+            if spool_threshold is not None:
+                body.write(data)
+            elif body is None:
+                # Most bodies arrive in one piece; that's the only copy
+                body = bytes(data)
+            else:
+                if isinstance(body, bytes):
+                    body = bytearray(body)
+                body.extend(data)
+        else:
+            if spool_threshold is None:
+                if body is None:
+                    body = b""
+                elif not isinstance(body, bytes):
+                    body = bytes(body)
+            else:
+                body.seek(0)
+            yield MultipartPart(current, body)
+            body = None
+
+
+def iter_events(chunks, bound):
+    """
+    Iterate over a multipart stream at the lowest level.
+
+    This yields a (headers, None) tuple at the start of each part, a
+    (None, data) tuple for each piece of the part body as it arrives,
+    and a (None, None) tuple at the end of each part. Nothing larger
+    than a single chunk is buffered, so a body of any size can be
+    processed in constant memory.
+
+    The data is a memoryview of the buffer, not a copy. It is only
+    valid until the next event; callers that keep it must copy it.
+    """
+    opening = b"--" + bound
+    delimiter = b"\r\n--" + bound
+    keep = len(delimiter) - 1
+    buf = bytearray()
+    chunks = iter(chunks)
+
+    def fill():
+        for chunk in chunks:
+            if chunk:
+                buf.extend(chunk)
+                return True
+        return False
+
+    # Skip the preamble
+    while True:
+        pos = buf.find(opening)
+        if pos >= 0:
+            del buf[:pos + len(opening)]
+            break
+        if len(buf) > len(opening):
+            del buf[:len(buf) - len(opening)]
+        if not fill():
+            return
+
+    while True:
+        # After a boundary comes either "--" (the end) or CRLF (a part)
+        while len(buf) < 2:
+            if not fill():
+                return
+        if buf[:2] == b"--":
+            return
+        if buf[:2] == b"\r\n":
+            del buf[:2]
+
+        while True:
+            pos = buf.find(b"\r\n\r\n")
+            if pos >= 0:
+                break
+            if not fill():
+                raise UnexpectedAPIResponse("Truncated multipart headers")
+        headers = {}
+        for line in buf[:pos].decode('utf-8').split("\r\n"):
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        del buf[:pos + 4]
+        yield (headers, None)
+
+        while True:
+            pos = buf.find(delimiter)
+            if pos >= 0:
+                break
+            if len(buf) > keep:
+                for event in _data(buf, len(buf) - keep):
+                    yield event
+                del buf[:len(buf) - keep]
+            if not fill():
+                raise UnexpectedAPIResponse("Truncated multipart body")
+
+        if pos > 0:
+            for event in _data(buf, pos):
+                yield event
+        del buf[:pos + len(delimiter)]
+        yield (None, None)
+
+
+def _data(buf, end):
+    """
+    Internal function to yield the first end bytes of buf as a data
+    event without copying them. The view is released before the caller
+    resumes, so that buf can be resized again.
+    """
+    view = memoryview(buf)
+    piece = view[:end]
+    try:
+        yield (None, piece)
+    finally:
+        piece.release()
+        view.release()
@@ -27,12 +27,28 @@ Support the v1/transactions endpoint
 from __future__ import unicode_literals, print_function, absolute_import
 import json, logging, re, sys
 from marklogic import MarkLogic
+from marklogic.client.bulkloader import BulkLoader
+from marklogic.client.documents import Documents
+from marklogic.client.eval import Eval
+from marklogic.client.exceptions import UnexpectedAPIResponse
 from marklogic.exceptions import UnexpectedManagementAPIResponse
-from requests_toolbelt import MultipartDecoder
 
 class Transactions:
     """The Transactions class encapsulates a call to the Client API
     v1/transactions endpoint.
+
+    A Transactions object can also be used as a context manager. On
+    entry, a transaction is created on a private copy of the connection
+    that keeps the HostId cookie, so every request in the transaction
+    goes to the host that owns it, even behind a load balancer. The
+    transaction is committed if the block exits normally and rolled
+    back if it raises an exception. Use documents(), bulkloader(), and
+    eval() to get objects that make requests in the transaction::
+
+        with Transactions(connection).set_database("Documents") as trans:
+            trans.documents().put(data, uri)
+
+    Several transactions can be used in parallel, one per thread.
     """
     def __init__(self, connection=None, save_connection=True):
         """
@@ -44,8 +60,63 @@ class Transactions:
         else:
             self.connection = None
         self.logger = logging.getLogger("marklogic.client.transactions")
+        self._unpinned = None
         self.clear()
 
+    def __enter__(self):
+        """Create a transaction pinned to a private session."""
+        self._unpinned = self.connection
+        self.connection = self.connection.clone(cookies=True)
+        response = self.create()
+        if response.status_code != 200:
+            self.connection = self._unpinned
+            raise UnexpectedAPIResponse(response.text)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit the transaction, or roll it back if there was an error."""
+        try:
+            if exc_type is None:
+                response = self.commit()
+                if response.status_code != 204:
+                    raise UnexpectedAPIResponse(response.text)
+            else:
+                try:
+                    self.rollback()
+                except Exception as err:
+                    self.logger.warning("Rollback of {} failed: {}"
+                                        .format(self.txid(), err))
+        finally:
+            self.connection.session.close()
+            self.connection = self._unpinned
+            self._unpinned = None
+            self._set('txid', None)
+        return False
+
+    def documents(self):
+        """Get a Documents object that operates in this transaction."""
+        docs = Documents(self.connection)
+        if self.database() is not None:
+            docs.set_database(self.database())
+        docs.set_txid(self.txid())
+        return docs
+
+    def bulkloader(self):
+        """Get a BulkLoader object that operates in this transaction."""
+        bulk = BulkLoader(self.connection)
+        if self.database() is not None:
+            bulk.set_database(self.database())
+        bulk.set_txid(self.txid())
+        return bulk
+
+    def eval(self):
+        """Get an Eval object that operates in this transaction."""
+        mleval = Eval(self.connection)
+        if self.database() is not None:
+            mleval.set_database(self.database())
+        mleval.set_txid(self.txid())
+        return mleval
+
     def _get(self, name):
         """Internal method to conditionally get a config variable"""
         if name in self._config:
@@ -24,6 +24,7 @@ import logging
 import requests
 import time
 from http.client import BadStatusLine
+from http.cookiejar import DefaultCookiePolicy
 from marklogic.exceptions import UnexpectedManagementAPIResponse
 from marklogic.exceptions import UnauthorizedAPIRequest
 from requests.auth import HTTPDigestAuth
@@ -45,7 +46,8 @@ class Connection:
     """
     def __init__(self, host, auth,
                  protocol="http", port=8000, management_port=8002,
-                 root="manage", version="v2", client_version="v1"):
+                 root="manage", version="v2", client_version="v1",
+                 pool_size=10, cookies=False):
         self.host = host
         self.auth = auth
         self.protocol = protocol
@@ -57,9 +59,43 @@ class Connection:
         self.logger = logging.getLogger("marklogic.connection")
         self.payload_logger = logging.getLogger("marklogic.connection.payloads")
 
+        self.pool_size = pool_size
+        self.cookies = cookies
+
         self.verify = False # Danger, Will Robinson!
         urllib3.disable_warnings()
 
+        # A single session lets requests reuse pooled connections,
+        # including across threads. Cookies are only kept if asked for;
+        # a HostId cookie from one transaction would otherwise pin every
+        # later request to that host.
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not cookies:
+            self.session.cookies.set_policy(
+                DefaultCookiePolicy(allowed_domains=[]))
+
+    def clone(self, cookies=None):
+        """
+        Return a new connection to the same server with its own session.
+
+        If cookies is None, the new connection keeps cookies if this one
+        does.
+        """
+        if cookies is None:
+            cookies = self.cookies
+        connection = Connection(self.host, self.auth,
+                                protocol=self.protocol, port=self.port,
+                                management_port=self.management_port,
+                                root=self.root, version=self.version,
+                                client_version=self.client_version,
+                                pool_size=self.pool_size, cookies=cookies)
+        connection.verify = self.verify
+        return connection
+
     # You'd expect parameters to be a dictionary, but then it couldn't
     # have repeated keys, so it's an array.
     def uri(self, relation, name=None,
@@ -108,10 +144,11 @@ class Connection:
 
     def head(self, uri, accept="application/json"):
         self.logger.debug("HEAD {0}...".format(uri))
-        self.response = requests.head(uri, auth=self.auth, verify=self.verify)
-        return self._response()
+        response = self.session.head(uri, auth=self.auth, verify=self.verify)
+        self.response = response
+        return self._response(response)
 
-    def get(self, uri, accept="application/json", headers=None):
+    def get(self, uri, accept="application/json", headers=None, stream=False):
         if headers is None:
             headers = {'accept': accept}
         else:
@@ -121,12 +158,14 @@ class Connection:
         self.payload_logger.debug("Headers:")
         self.payload_logger.debug(json.dumps(headers, indent=2))
 
-        self.response = requests.get(uri, auth=self.auth, headers=headers,
-                                     verify=self.verify)
-        return self._response()
+        response = self.session.get(uri, auth=self.auth, headers=headers,
+                                    verify=self.verify, stream=stream)
+        self.response = response
+        return self._response(response, stream)
 
     def post(self, uri, payload=None, etag=None, headers=None,
-             content_type="application/json", accept="application/json"):
+             content_type="application/json", accept="application/json",
+             stream=False):
 
         if headers is None:
             headers = {}
@@ -148,19 +187,20 @@ class Connection:
                 self.payload_logger.debug(payload)
 
         if payload is None:
-            self.response = requests.post(uri, auth=self.auth, headers=headers,
-                                          verify=self.verify)
+            response = self.session.post(uri, auth=self.auth, headers=headers,
+                                         verify=self.verify, stream=stream)
         else:
             if content_type == "application/json":
-                self.response = requests.post(uri, json=payload,
-                                              auth=self.auth, headers=headers,
-                                              verify=self.verify)
+                response = self.session.post(uri, json=payload,
+                                             auth=self.auth, headers=headers,
+                                             verify=self.verify, stream=stream)
             else:
-                self.response = requests.post(uri, data=payload,
-                                              auth=self.auth, headers=headers,
-                                              verify=self.verify)
+                response = self.session.post(uri, data=payload,
+                                             auth=self.auth, headers=headers,
+                                             verify=self.verify, stream=stream)
 
-        return self._response()
+        self.response = response
+        return self._response(response, stream)
 
     def put(self, uri, payload=None, etag=None,
             content_type="application/json", accept="application/json"):
@@ -181,19 +221,20 @@ class Connection:
                 self.payload_logger.debug(payload)
 
         if payload is None:
-            self.response = requests.put(uri, auth=self.auth, headers=headers,
-                                         verify=self.verify)
+            response = self.session.put(uri, auth=self.auth, headers=headers,
+                                        verify=self.verify)
         else:
             if content_type == "application/json":
-                self.response = requests.put(uri, json=payload,
-                                             auth=self.auth, headers=headers,
-                                             verify=self.verify)
+                response = self.session.put(uri, json=payload,
+                                            auth=self.auth, headers=headers,
+                                            verify=self.verify)
             else:
-                self.response = requests.put(uri, data=payload,
-                                             auth=self.auth, headers=headers,
-                                             verify=self.verify)
+                response = self.session.put(uri, data=payload,
+                                            auth=self.auth, headers=headers,
+                                            verify=self.verify)
 
-        return self._response()
+        self.response = response
+        return self._response(response)
 
     def delete(self, uri, payload=None, etag=None,
                content_type="application/json", accept="application/json"):
@@ -214,20 +255,21 @@ class Connection:
                 self.payload_logger.debug(payload)
 
         if payload is None:
-            self.response = requests.delete(uri, auth=self.auth, headers=headers,
-                                            verify=self.verify)
+            response = self.session.delete(uri, auth=self.auth, headers=headers,
+                                           verify=self.verify)
         else:
-            self.response = requests.delete(uri, json=payload,
-                                            auth=self.auth, headers=headers,
-                                            verify=self.verify)
-
-        return self._response()
+            response = self.session.delete(uri, json=payload,
+                                           auth=self.auth, headers=headers,
+                                           verify=self.verify)
 
-    def _response(self):
-        response = self.response
+        self.response = response
+        return self._response(response)
 
+    def _response(self, response, stream=False):
         self.logger.debug("Status code: {0}".format(response.status_code))
-        self.payload_logger.debug(response.text)
+        # Don't consume the body of a streamed response
+        if not stream or response.status_code >= 300:
+            self.payload_logger.debug(response.text)
 
         if response.status_code < 300:
             pass
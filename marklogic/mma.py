@@ -58,7 +58,7 @@ class MMA():
                 optarg = False
             elif tok.startswith("-"):
                 options.append(tok)
-                if tok != "--debug" and tok != "--https":
+                if tok not in ("--debug", "--https", "--no-follow"):
                     optarg = True
             elif "=" in tok:
                 params.append(tok)
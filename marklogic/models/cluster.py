@@ -27,10 +27,84 @@ Cluster class for manipulating MarkLogic clusters
 from __future__ import unicode_literals, print_function, absolute_import
 import json
 import logging
+import threading
+import time
+from requests.exceptions import ConnectionError
 from marklogic.connection import Connection
 from marklogic.models.model import Model
 from marklogic.models.host import Host
+from marklogic.models.forest import Forest
 from marklogic.exceptions import UnexpectedManagementAPIResponse
+from marklogic.utilities.concurrency import imap
+
+FOREST_READY_STATES = ("open", "open replica")
+FOREST_POLL_INTERVAL = 2
+
+def _copy_groups(forests):
+    """
+    Return a list of sets, one per master forest, of the hosts that
+    hold a copy of that forest.
+    """
+    replicas = set()
+    for forest in forests:
+        for replica in forest.forest_replicas() or []:
+            replicas.add(replica.replica_name())
+
+    groups = []
+    for forest in forests:
+        if forest.forest_name() in replicas:
+            continue
+        group = set([forest.host()])
+        for replica in forest.forest_replicas() or []:
+            group.add(replica.host())
+        if forest.failover_enable():
+            for host in forest.failover_host_names() or []:
+                group.add(host)
+        groups.append(group)
+    return groups
+
+def _plan_waves(zones, groups, max_wave=None):
+    """
+    Divide hosts into restart waves.
+
+    The zones argument maps each host name to its zone (or None) and
+    groups is a list of sets of hosts that hold copies of the same
+    forest. Each host is added to the first wave of its zone that
+    still leaves a copy of every forest outside the wave.
+    """
+    alone = set()
+    for group in groups:
+        if len(group) == 1:
+            alone |= group
+
+    def safe(wave, host):
+        candidate = wave | set([host])
+        for group in groups:
+            if len(group) > 1 and group <= candidate:
+                return False
+        return True
+
+    def zone_key(name):
+        zone = zones[name]
+        return (zone is None or zone == "", zone or "", name)
+
+    waves = []
+    zone_waves = {}
+    for name in sorted(zones, key=zone_key):
+        if name in alone:
+            waves.append(set([name]))
+            continue
+        candidates = zone_waves.setdefault(zones[name], [])
+        for wave in candidates:
+            if (max_wave is None or len(wave) < max_wave) and safe(wave, name):
+                wave.add(name)
+                break
+        else:
+            wave = set([name])
+            candidates.append(wave)
+            waves.append(wave)
+
+    return [sorted(wave) for wave in waves]
 
 
 class LocalCluster(Model):
@@ -115,6 +189,110 @@ class LocalCluster(Model):
         response = connection.post(uri, payload=struct)
         return self
 
+    def restart_plan(self, max_wave=None, concurrency=8, connection=None):
+        """
+        Plan a rolling restart of the cluster.
+
+        The hosts are divided into waves that can be restarted at the
+        same time without taking every copy of any forest offline. A
+        copy of a forest is the master, one of its replicas or, if
+        failover is enabled, one of its failover hosts. Waves are built
+        a zone at a time, so a cluster whose replicas are spread across
+        zones is restarted one zone at a time. A host that holds a
+        forest with no other copy is restarted in a wave of its own; its
+        forests are unavailable while it restarts no matter what.
+
+        :param max_wave: The maximum number of hosts in a wave
+        :param concurrency: The number of configurations read at once
+        :return: A list of waves, each a list of host names
+        """
+        if connection is None:
+            connection = self.connection
+
+        hosts = list(imap(lambda name: Host.lookup(connection, name),
+                          Host.list(connection), concurrency, ordered=True))
+        forests = list(imap(lambda name: Forest.lookup(connection, name),
+                            Forest.list(connection), concurrency))
+
+        zones = {}
+        for host in hosts:
+            zones[host.host_name()] = host.zone()
+
+        return _plan_waves(zones, _copy_groups(forests), max_wave)
+
+    def rolling_restart(self, plan=None, max_wave=None, timeout=600,
+                        concurrency=8, connection=None):
+        """
+        Restart the cluster one wave of hosts at a time.
+
+        If no plan is given, restart_plan() is used to make one. The
+        hosts in each wave are restarted in parallel. Once they have
+        all restarted, the next wave waits until every forest on them
+        is back to "open" or "open replica"; a replica that is still
+        synchronizing is not yet a safe copy.
+
+        :param plan: A list of waves, each a list of host names
+        :param max_wave: The maximum number of hosts in a wave
+        :param timeout: Seconds to wait for the forests after each wave
+        :param concurrency: The maximum number of requests made at once
+        :return: The plan that was carried out
+        """
+        if connection is None:
+            connection = self.connection
+
+        if plan is None:
+            plan = self.restart_plan(max_wave, concurrency, connection)
+
+        def restart(name):
+            # Restart through a connection to the host itself, so that
+            # waiting for the restart waits for the right host.
+            host_connection = Connection(name, connection.auth,
+                                         protocol=connection.protocol,
+                                         management_port=connection.management_port)
+            return Host(name, connection=host_connection).restart()
+
+        for number, wave in enumerate(plan):
+            self.logger.info("Restarting wave {0} of {1}: {2}"
+                             .format(number + 1, len(plan), ", ".join(wave)))
+            list(imap(restart, wave, concurrency))
+            self._wait_for_forests(wave, timeout, concurrency, connection)
+
+        return plan
+
+    def _wait_for_forests(self, hosts, timeout, concurrency, connection):
+        """
+        Internal method to wait until all of the forests on the given
+        hosts are open.
+        """
+        forests = []
+        for forest in imap(lambda name: Forest.lookup(connection, name),
+                           Forest.list(connection), concurrency):
+            if forest is not None and forest.host() in hosts:
+                forests.append(forest)
+
+        def state(forest):
+            try:
+                return (forest, forest.state(connection))
+            except ConnectionError:
+                # Pooled connections to a host that restarted are stale
+                return (forest, None)
+
+        deadline = time.time() + timeout
+        while forests:
+            waiting = []
+            for forest, value in imap(state, forests, concurrency):
+                if value not in FOREST_READY_STATES:
+                    waiting.append(forest)
+            forests = waiting
+            if not forests:
+                break
+            if time.time() > deadline:
+                raise UnexpectedManagementAPIResponse(
+                    "Forests not open after restart: {0}".format(
+                        ", ".join([forest.forest_name() for forest in forests])))
+            self.logger.debug("Waiting for {0} forests".format(len(forests)))
+            time.sleep(FOREST_POLL_INTERVAL)
+
     def shutdown(self, connection=None):
         if connection is None:
             connection = self.connection
@@ -171,14 +349,54 @@ class LocalCluster(Model):
         if connection is None:
             connection = self.connection
 
+        return self._join(host, connection)
+
+    def add_hosts(self, hosts, concurrency=8, connection=None):
+        """
+        Add several hosts to the cluster at once.
+
+        Each host goes through the same handshake as add_host(), but the
+        hosts are handled concurrently. Only the step on the bootstrap
+        host is done one host at a time; fetching each host's server
+        configuration and waiting for each host to restart with the
+        cluster configuration overlap, so adding any number of hosts
+        takes about as long as a single restart.
+
+        :param hosts: A list of Host objects or host names
+        :param concurrency: The maximum number of hosts joined at once
+        :return: The list of Host objects, in the order given
+        """
+        if connection is None:
+            connection = self.connection
+
+        lock = threading.Lock()
+
+        def join(host):
+            return self._join(host, connection, lock)
+
+        return list(imap(join, hosts, concurrency, ordered=True))
+
+    def _join(self, host, connection, lock=None):
+        """
+        Internal method to join a single host to the cluster. If a lock
+        is provided, the request to the bootstrap host is made while
+        holding it.
+        """
         if isinstance(host, str):
             host = Host(host)
 
         xml = host._get_server_config()
-        cfgzip = self._post_server_config(xml, connection)
+        if lock is None:
+            cfgzip = self._post_server_config(xml, connection)
+        else:
+            with lock:
+                cfgzip = self._post_server_config(xml, connection)
 
+        # The host restarts with its new configuration; the connection
+        # waits for that to finish.
         host_connection = Connection(host.host_name(), connection.auth)
         host._post_cluster_config(cfgzip, host_connection)
+        return host
 
     def remove_host(self, host, connection=None):
         if connection is None:
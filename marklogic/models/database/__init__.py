@@ -51,6 +51,9 @@ from marklogic.models.database.mergeblackout import MergeBlackoutOneTimeStartEnd
 from marklogic.models.database.scheduledbackup import ScheduledDatabaseBackup, ScheduledDatabaseBackupOnce
 from marklogic.models.database.scheduledbackup import ScheduledDatabaseBackupWeekly
 from marklogic.models.database.backup import DatabaseBackup, DatabaseRestore
+from marklogic.models.database.backup import BackupScheduler
+from marklogic.models.database.operation import DatabaseOperation
+from marklogic.models.database.reindex import ReindexPreview
 from marklogic.models.database.path import PathNamespace
 from marklogic.models.database.subdatabase import Subdatabase
 from marklogic.models.database.lexicon import ElementWordLexicon
@@ -3074,20 +3077,40 @@ class Database(Model,PropertyLists):
     def clear(self, connection=None):
         """
         Clear the database.
+
+        Returns a DatabaseOperation that can be used to wait for the
+        forests to be empty.
         """
-        self.operation({'operation': 'clear-database'}, connection)
+        return self._start_operation('clear-database', connection)
 
-    def merge(self, connenection=None):
+    def merge(self, connection=None):
         """
         Initiate a merge on the database.
+
+        Returns a DatabaseOperation that can be used to wait for the
+        merge to finish.
         """
-        self.operation({'operation': 'merge-database'}, connection)
+        return self._start_operation('merge-database', connection)
 
     def reindex(self, connection=None):
         """
         Initiate a re-index on the database.
+
+        Returns a DatabaseOperation that can be used to wait for the
+        reindexing to finish.
         """
-        self.operation({'operation': 'reindex-database'}, connection)
+        return self._start_operation('reindex-database', connection)
+
+    def _start_operation(self, operation, connection):
+        """
+        Internal method to start an operation that runs in the background.
+        """
+        if connection is None:
+            connection = self.connection
+
+        self.operation({'operation': operation}, connection)
+        return DatabaseOperation(self.name, operation, self.forest_names(),
+                                 connection)
 
     # ============================================================
 
@@ -3178,6 +3201,24 @@ class Database(Model,PropertyLists):
         self.name = self._config['database-name']
         return self
 
+    def preview_update(self, connection=None):
+        """
+        Preview the effect of update().
+
+        Returns a ReindexPreview that lists the changes update() would
+        make, reports which of them reindex the database, estimates the
+        fragments each forest would reindex, and can apply the changes
+        in stages with a lowered reindexer throttle.
+
+        :param connection:The server connection
+
+        :return: The preview
+        """
+        if connection is None:
+            connection = self.connection
+
+        return ReindexPreview(self, connection)
+
     def delete(self, forest_delete="data", connection=None):
         """
         Remove the given database and all its forests.
@@ -3857,6 +3898,51 @@ class Database(Model,PropertyLists):
         else:
             raise ValidationError('Not an index', index_def)
 
+    def remove_index(self, index_def):
+        """
+        Remove an index from the database configuration.
+
+        The index isn't actually removed on the server until
+        the server configuration is saved.
+
+        :param index_def: The index definition
+
+        :return: The database configuration.
+        """
+        # N.B. Get these in the right order because it's a class hierarchy
+        if isinstance(index_def, ElementRangeIndex):
+            return self.remove_from_property_list('range-element-index',
+                                                  index_def, ElementRangeIndex)
+        elif isinstance(index_def, AttributeRangeIndex):
+            return self.remove_from_property_list('range-element-attribute-index',
+                                                  index_def, AttributeRangeIndex)
+        elif isinstance(index_def, FieldRangeIndex):
+            return self.remove_from_property_list('range-field-index',
+                                                  index_def, FieldRangeIndex)
+        elif isinstance(index_def, PathRangeIndex):
+            return self.remove_from_property_list('range-path-index',
+                                                  index_def, PathRangeIndex)
+        elif isinstance(index_def, GeospatialElementChildIndex):
+            return self.remove_from_property_list('geospatial-element-child-index',
+                                                  index_def, GeospatialElementChildIndex)
+        elif isinstance(index_def, GeospatialElementAttributePairIndex):
+            return self.remove_from_property_list('geospatial-element-attribute-pair-index',
+                                                  index_def, GeospatialElementAttributePairIndex)
+        elif isinstance(index_def, GeospatialElementPairIndex):
+            return self.remove_from_property_list('geospatial-element-pair-index',
+                                                  index_def, GeospatialElementPairIndex)
+        elif isinstance(index_def, GeospatialElementIndex):
+            return self.remove_from_property_list('geospatial-element-index',
+                                                  index_def, GeospatialElementIndex)
+        elif isinstance(index_def, GeospatialPathIndex):
+            return self.remove_from_property_list('geospatial-path-index',
+                                                  index_def, GeospatialPathIndex)
+        elif isinstance(index_def, GeospatialRegionIndex):
+            return self.remove_from_property_list('geospatial-region-index',
+                                                  index_def, GeospatialRegionIndex)
+        else:
+            raise ValidationError('Not an index', index_def)
+
     def element_range_indexes(self):
         """
         The element range indexes.
@@ -24,9 +24,19 @@ Classes for dealing with scheduled backups
 """
 
 import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from marklogic.models.forest import Forest
+from marklogic.utilities.concurrency import imap
 from marklogic.utilities.validators import *
 from marklogic.exceptions import *
 
+ACTIVE_STATES = ("in-progress", "queued")
+FAILED_STATES = ("failed", "cancelled", "canceled")
+
 class DatabaseBackup:
     """
     The DatabaseBackup class represents a backup job that is running
@@ -43,6 +53,7 @@ class DatabaseBackup:
         self.host_name = host_name
         self.connection = None
         self.settings = {}
+        self.last_status = None
 
     def marshal(self):
         struct = { }
@@ -147,7 +158,8 @@ class DatabaseBackup:
         uri = connection.uri("databases", self.database_name, properties=None)
         response = connection.post(uri, payload=payload)
 
-        return json.loads(response.text)
+        self.last_status = json.loads(response.text)
+        return self.last_status
 
     def cancel(self, connection=None):
         """
@@ -221,6 +233,7 @@ class DatabaseRestore:
         self.host_name = host_name
         self.connection = None
         self.settings = {}
+        self.last_status = None
 
     @classmethod
     def restore(cls, connection, database_name, backup_dir, forests=None,
@@ -295,7 +308,8 @@ class DatabaseRestore:
         uri = connection.uri("databases", self.database_name, properties=None)
         response = connection.post(uri, payload=payload)
 
-        return json.loads(response.text)
+        self.last_status = json.loads(response.text)
+        return self.last_status
 
     def cancel(self, connection=None):
         """
@@ -331,3 +345,456 @@ class DatabaseRestore:
         response = connection.post(uri, payload=payload)
 
         return json.loads(response.text)
+
+def job_state(status):
+    """
+    Summarize a backup or restore status response.
+
+    Returns a (state, progress) tuple. The state is "in-progress",
+    "completed" or one of the failed states. The progress is the
+    fraction of the job that is done, between 0 and 1, or None if the
+    response doesn't say. A job that reports a status for each forest
+    is done when all of its forests are done.
+    """
+    forests = status.get('forest', [])
+    if isinstance(forests, dict):
+        forests = [forests]
+
+    states = [forest.get('status') for forest in forests]
+    if 'status' in status:
+        state = status['status']
+    elif not states:
+        state = "completed"
+    elif any([value in ACTIVE_STATES for value in states]):
+        state = "in-progress"
+    else:
+        failed = [value for value in states if value in FAILED_STATES]
+        state = failed[0] if failed else "completed"
+
+    progress = None
+    percents = [forest.get('percent-complete') for forest in forests]
+    if percents and None not in percents:
+        progress = sum([float(value) for value in percents]) \
+                   / (100.0 * len(percents))
+    elif states:
+        finished = [value for value in states if value not in ACTIVE_STATES]
+        progress = float(len(finished)) / len(states)
+
+    return (state, progress)
+
+def _forest_size(status):
+    """
+    Internal function to estimate the on-disk size of a forest from its
+    status view.
+    """
+    props = status.get('forest-status', {}).get('status-properties', {})
+
+    def value(prop):
+        if isinstance(prop, dict):
+            prop = prop.get('value', 0)
+        try:
+            return float(prop)
+        except (TypeError, ValueError):
+            return 0.0
+
+    if 'data-size' in props:
+        return value(props['data-size']) + value(props.get('large-data-size'))
+
+    def disk_sizes(data):
+        total = 0.0
+        if isinstance(data, dict):
+            for key in data:
+                if key == 'disk-size':
+                    total += value(data[key])
+                else:
+                    total += disk_sizes(data[key])
+        elif isinstance(data, list):
+            for item in data:
+                total += disk_sizes(item)
+        return total
+
+    return disk_sizes(props)
+
+class _ScheduledJob:
+    """
+    Internal class that tracks a backup or restore in a BackupScheduler.
+    """
+    def __init__(self, kind, database_name, target, after, start):
+        self.kind = kind
+        self.database_name = database_name
+        self.target = target
+        self.after = after
+        self.start = start
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+        self.estimated = False
+        self.hosts = set()
+        self.size = 0.0
+        self.job = None
+        self.interval = None
+        self.next_poll = None
+        self.polled = None
+        self.progress = None
+
+class BackupScheduler:
+    """
+    The BackupScheduler class runs many database backups and restores,
+    keeping as many running as the limits allow.
+
+    A backup or restore runs on every host that has one of the
+    database's forests, and writes to (or reads from) its backup
+    directory. The scheduler starts a job only when fewer than
+    max_per_host jobs are running on each of its hosts and fewer than
+    max_per_target jobs are using its target; by default the target is
+    the parent of the backup directory. A limit of None means no limit. When there is a choice, the
+    database with the largest forests (according to their status) is
+    started first.
+
+    Each running job is polled on its own schedule. From the progress
+    it reports, the scheduler estimates when the job will finish and
+    polls again about half way there, between min_poll and max_poll
+    seconds. Jobs that report no progress are polled at increasing
+    intervals. As soon as a job finishes, the next one is started.
+
+    Submitting a job returns a Future. It resolves to the DatabaseBackup
+    or DatabaseRestore object, whose last_status holds the final status,
+    or raises an exception if the job could not be started or did not
+    complete. A job can be made to wait for another by passing that
+    job's future as after; this is how an incremental backup is chained
+    to the full backup it depends on.
+    """
+    def __init__(self, connection, max_per_host=1, max_per_target=2,
+                 max_running=None, min_poll=1, max_poll=30, concurrency=8):
+        """
+        Create a backup scheduler.
+        """
+        self.connection = connection
+        self.max_per_host = max_per_host
+        self.max_per_target = max_per_target
+        self.max_running = max_running
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.concurrency = concurrency
+        self.logger = logging.getLogger("marklogic.backup")
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = []
+        self._thread = None
+        self._closed = False
+        self._finished = False
+
+    def backup(self, database_name, backup_dir, forests=None,
+               journal_archiving=False, journal_archive_path=None,
+               lag_limit=30, incremental=False, incremental_dir=None,
+               target=None, after=None):
+        """
+        Schedule a database backup. See DatabaseBackup.backup() for the
+        backup parameters.
+
+        :param target: The name of the backup target, for max_per_target
+        :param after: A future that must complete before the backup starts
+        :return: A Future for the backup
+        """
+        def start(connection):
+            return DatabaseBackup.backup(connection, database_name, backup_dir,
+                                         forests, journal_archiving,
+                                         journal_archive_path, lag_limit,
+                                         incremental, incremental_dir)
+
+        return self._submit("backup", database_name,
+                            self._target(target, backup_dir), after, start)
+
+    def incremental_backup(self, after, database_name, backup_dir,
+                           incremental_dir=None, **kwargs):
+        """
+        Schedule an incremental backup that starts when the backup
+        represented by the future after has completed.
+
+        :return: A Future for the incremental backup
+        """
+        if incremental_dir is None:
+            incremental_dir = backup_dir
+        return self.backup(database_name, backup_dir, incremental=True,
+                           incremental_dir=incremental_dir, after=after,
+                           **kwargs)
+
+    def restore(self, database_name, backup_dir, forests=None,
+                journal_archiving=False, journal_archive_path=None,
+                incremental=False, incremental_dir=None,
+                target=None, after=None):
+        """
+        Schedule a database restore. See DatabaseRestore.restore() for
+        the restore parameters.
+
+        :param target: The name of the backup target, for max_per_target
+        :param after: A future that must complete before the restore starts
+        :return: A Future for the restore
+        """
+        def start(connection):
+            return DatabaseRestore.restore(connection, database_name,
+                                           backup_dir, forests,
+                                           journal_archiving,
+                                           journal_archive_path,
+                                           incremental, incremental_dir)
+
+        return self._submit("restore", database_name,
+                            self._target(target, backup_dir), after, start)
+
+    def start(self):
+        """
+        Start running the scheduled jobs in the background.
+        """
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def wait(self):
+        """
+        Run all of the scheduled jobs and wait for them to finish.
+
+        :return: The list of futures, in the order they were submitted
+        """
+        with self._cond:
+            futures = [job.future for job in self._pending + self._running]
+        self.start()
+        for future in futures:
+            try:
+                future.exception()
+            except Exception:
+                pass
+        self.shutdown()
+        return futures
+
+    def shutdown(self):
+        """
+        Stop the scheduler once every job that has been submitted is done.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def _target(self, target, backup_dir):
+        """Internal method to choose the target of a job."""
+        if target is not None:
+            return target
+        return os.path.dirname(backup_dir.rstrip("/"))
+
+    def _submit(self, kind, database_name, target, after, start):
+        """Internal method to queue a job."""
+        job = _ScheduledJob(kind, database_name, target, after, start)
+        with self._cond:
+            if self._closed:
+                raise UnsupportedOperation("The scheduler has been shut down")
+            self._pending.append(job)
+            self._cond.notify_all()
+        if after is not None:
+            after.add_done_callback(self._wake)
+        return job.future
+
+    def _wake(self, future=None):
+        """Internal method to wake up the scheduler."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        """Internal method that runs the scheduler."""
+        while True:
+            with self._cond:
+                if self._closed and not self._pending and not self._running:
+                    return
+                unestimated = [job for job in self._pending
+                               if not job.estimated]
+
+            # Errors are handled job by job; anything else is logged so
+            # that one bad response doesn't strand every other job
+            try:
+                self._estimate(unestimated)
+                self._launch()
+                self._poll()
+            except Exception as err:
+                self.logger.warning("Scheduler error: {0}".format(err))
+
+            with self._cond:
+                # A finished job may have made room for another
+                if self._finished:
+                    self._finished = False
+                    continue
+                now = time.time()
+                wait = self.max_poll
+                for job in self._running:
+                    wait = min(wait, job.next_poll - now)
+                if wait > 0 and not [job for job in self._pending
+                                     if not job.estimated]:
+                    self._cond.wait(wait)
+
+    def _estimate(self, jobs):
+        """
+        Internal method to find the hosts and estimate the size of jobs
+        from the status of their forests.
+        """
+        connection = self.connection
+
+        def forests(job):
+            try:
+                uri = connection.uri("databases", job.database_name)
+                response = connection.get(uri)
+                names = []
+                if response.status_code == 200:
+                    names = json.loads(response.text).get('forest', [])
+                return (job, names, None)
+            except Exception as err:
+                return (job, None, err)
+
+        def size(name):
+            forest = Forest(name, connection=connection)
+            try:
+                return (name, forest.read().host(),
+                        _forest_size(forest.view("status")))
+            except Exception:
+                return (name, None, 0.0)
+
+        databases = []
+        for job, forest_names, err in imap(forests, jobs, self.concurrency):
+            if err is None:
+                databases.append((job, forest_names))
+            else:
+                self._finish(job, exception=err)
+        names = set()
+        for job, forest_names in databases:
+            names |= set(forest_names)
+        info = {}
+        for name, host, forest_size in imap(size, names, self.concurrency):
+            info[name] = (host, forest_size)
+
+        for job, forest_names in databases:
+            for name in forest_names:
+                host, forest_size = info[name]
+                if host is not None:
+                    job.hosts.add(host)
+                job.size += forest_size
+            job.estimated = True
+
+    def _launch(self):
+        """Internal method to start every job that can be started."""
+        with self._cond:
+            pending = sorted([job for job in self._pending if job.estimated],
+                             key=lambda job: -job.size)
+        for job in pending:
+            if job.after is not None:
+                if not job.after.done():
+                    continue
+                if job.after.exception() is not None:
+                    self._finish(job, exception=job.after.exception())
+                    continue
+            if not self._allowed(job):
+                continue
+
+            with self._cond:
+                self._pending.remove(job)
+            try:
+                job.job = job.start(self.connection)
+            except Exception as err:
+                self._finish(job, exception=err)
+                continue
+
+            self.logger.info("Started {0} of {1}".format(job.kind,
+                                                         job.database_name))
+            job.interval = self.min_poll
+            job.polled = time.time()
+            job.next_poll = job.polled + job.interval
+            with self._cond:
+                self._running.append(job)
+
+    def _allowed(self, job):
+        """Internal method to check a job against the limits."""
+        with self._cond:
+            running = list(self._running)
+        if self.max_running is not None and len(running) >= self.max_running:
+            return False
+        if self.max_per_target is not None:
+            if len([other for other in running
+                    if other.target == job.target]) >= self.max_per_target:
+                return False
+        if self.max_per_host is not None:
+            for host in job.hosts:
+                if len([other for other in running
+                        if host in other.hosts]) >= self.max_per_host:
+                    return False
+        return True
+
+    def _poll(self):
+        """Internal method to check on the jobs that are due."""
+        now = time.time()
+        with self._cond:
+            due = [job for job in self._running if job.next_poll <= now]
+
+        def status(job):
+            try:
+                return (job, job.job.status(self.connection), None)
+            except Exception as err:
+                return (job, None, err)
+
+        for job, response, err in imap(status, due, self.concurrency):
+            if err is not None:
+                self._finish(job, exception=err)
+                continue
+
+            try:
+                state, progress = job_state(response)
+            except Exception as err:
+                self._finish(job, exception=err)
+                continue
+            if state in ACTIVE_STATES:
+                self._reschedule(job, progress)
+            elif state in FAILED_STATES:
+                self._finish(job, exception=UnexpectedManagementAPIResponse(
+                    "{0} of {1} {2}: {3}".format(job.kind, job.database_name,
+                                                 state, json.dumps(response))))
+            else:
+                self.logger.info("Finished {0} of {1}"
+                                 .format(job.kind, job.database_name))
+                self._finish(job, result=job.job)
+
+    def _reschedule(self, job, progress):
+        """
+        Internal method to decide when to poll a running job again.
+        """
+        now = time.time()
+        interval = job.interval * 2
+        if (progress is not None and job.progress is not None
+                and progress > job.progress and now > job.polled):
+            rate = (progress - job.progress) / (now - job.polled)
+            interval = (1.0 - progress) / rate / 2
+        job.interval = min(max(interval, self.min_poll), self.max_poll)
+        if progress is not None and (job.progress is None
+                                     or progress > job.progress):
+            job.progress = progress
+            job.polled = now
+        job.next_poll = now + job.interval
+
+    def _finish(self, job, result=None, exception=None):
+        """Internal method to resolve a job's future."""
+        with self._cond:
+            if job in self._running:
+                self._running.remove(job)
+            if job in self._pending:
+                self._pending.remove(job)
+            self._finished = True
+            self._cond.notify_all()
+        if exception is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(exception)
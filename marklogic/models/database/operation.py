@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Classes for waiting on database operations
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from marklogic.models.forest import Forest
+from marklogic.utilities.concurrency import imap
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+
+POLL_INTERVAL = 2
+SETTLE_TIME = 5
+
+def _value(props, key):
+    """
+    Internal function to read a numeric or boolean property, which
+    the Management API may or may not wrap in a {"value": ...} object.
+    """
+    prop = props.get(key)
+    if isinstance(prop, dict):
+        prop = prop.get('value')
+    if isinstance(prop, bool) or prop is None:
+        return prop
+    try:
+        return float(prop)
+    except (TypeError, ValueError):
+        return None
+
+def _find(data, key):
+    """
+    Internal function to find every object that has a property named key.
+    """
+    found = []
+    if isinstance(data, dict):
+        if key in data:
+            found.append(data)
+        for name in data:
+            found.extend(_find(data[name], key))
+    elif isinstance(data, list):
+        for item in data:
+            found.extend(_find(item, key))
+    return found
+
+def merge_progress(status, counts):
+    """
+    Estimate the merge progress of a forest.
+
+    Returns an (active, fraction) tuple. The fraction is the current
+    size of the merges in progress divided by their final size, or None
+    if the forest doesn't report sizes.
+    """
+    props = status.get('forest-status', {}).get('status-properties', {})
+    merges = _find(props.get('merges', {}), 'final-size')
+    count = _value(props, 'merge-count')
+    active = bool(merges) or (count is not None and count > 0)
+    if not merges:
+        return (active, None)
+    current = sum([_value(merge, 'current-size') or 0 for merge in merges])
+    final = sum([_value(merge, 'final-size') or 0 for merge in merges])
+    if final <= 0:
+        return (active, None)
+    return (active, min(1.0, current / final))
+
+def reindex_progress(status, counts):
+    """
+    Estimate the reindexing progress of a forest.
+
+    Returns an (active, fraction) tuple. The fraction is the number of
+    fragments reindexed so far divided by the number of active
+    fragments, or None if the forest doesn't report them.
+    """
+    props = status.get('forest-status', {}).get('status-properties', {})
+    reindexing = _value(props, 'reindexing')
+    done = _value(props, 'reindex-count')
+    active = bool(reindexing)
+    cprops = counts.get('forest-counts', {}).get('count-properties', {})
+    total = _value(cprops, 'active-fragments')
+    if done is None or not total:
+        return (active, None)
+    return (active, min(1.0, done / total))
+
+def clear_progress(status, counts):
+    """
+    Estimate the progress of clearing a forest.
+
+    Returns an (active, documents) tuple; the forest is still being
+    cleared while it has documents.
+    """
+    cprops = counts.get('forest-counts', {}).get('count-properties', {})
+    documents = _value(cprops, 'documents')
+    if documents is None:
+        return (False, None)
+    return (documents > 0, documents)
+
+class DatabaseOperation:
+    """
+    The DatabaseOperation class represents a clear, merge or reindex
+    that is running in the background on the server.
+
+    The Management API starts these operations and returns at once.
+    A DatabaseOperation polls the status and counts of all of the
+    database's forests, concurrently, to find out how far along the
+    operation is and when it has finished.
+    """
+    OPERATIONS = {'clear-database': clear_progress,
+                  'merge-database': merge_progress,
+                  'reindex-database': reindex_progress}
+
+    def __init__(self, database_name, operation, forests=None,
+                 connection=None, save_connection=True):
+        """
+        Instantiate a database operation. This constructor is used
+        internally, it should never be called directly. Use the
+        `clear`, `merge` and `reindex` methods of Database instead.
+        """
+        if operation not in self.OPERATIONS:
+            raise UnexpectedManagementAPIResponse(
+                "Cannot wait for {0}".format(operation))
+        self.database_name = database_name
+        self.operation = operation
+        self.forests = forests
+        if save_connection:
+            self.connection = connection
+        else:
+            self.connection = None
+        self.started = time.time()
+        self.concurrency = 8
+        self.logger = logging.getLogger("marklogic.database")
+        self._seen_active = False
+        self._initial = {}
+
+    def status(self, connection=None):
+        """
+        Check on the operation.
+
+        Returns a dictionary with 'done' (True or False), 'percent' (how
+        much of the operation is complete, 0 to 100), 'eta' (estimated
+        seconds remaining, or None) and 'forests' (the percent complete
+        of each forest).
+        """
+        if connection is None:
+            connection = self.connection
+
+        if self.forests is None:
+            uri = connection.uri("databases", self.database_name)
+            response = connection.get(uri)
+            if response.status_code != 200:
+                raise UnexpectedManagementAPIResponse(response.text)
+            self.forests = json.loads(response.text).get('forest', [])
+
+        progress = self.OPERATIONS[self.operation]
+
+        def check(name):
+            forest = Forest(name, connection=connection)
+            return (name, progress(forest.view("status"),
+                                   forest.view("counts")))
+
+        active = False
+        forests = {}
+        for name, (forest_active, value) in imap(check, self.forests,
+                                                 self.concurrency):
+            active = active or forest_active
+            forests[name] = self._percent(name, forest_active, value)
+
+        if active:
+            self._seen_active = True
+
+        # A merge or reindex may take a moment to show up in the forest
+        # status, so it's only done once it has been seen running or
+        # the settle time has passed. A cleared forest has no documents.
+        elapsed = time.time() - self.started
+        done = not active and (self._seen_active or elapsed >= SETTLE_TIME
+                               or self.operation == 'clear-database')
+
+        percent = 100.0
+        if forests:
+            percent = sum(forests.values()) / len(forests)
+        if done:
+            percent = 100.0
+        elif percent >= 100.0:
+            percent = 99.0
+
+        eta = None
+        if done:
+            eta = 0
+        elif percent > 0:
+            eta = elapsed * (100.0 - percent) / percent
+
+        return {'done': done, 'percent': percent, 'eta': eta,
+                'forests': forests}
+
+    def _percent(self, name, active, value):
+        """
+        Internal method to turn a forest's progress into a percentage.
+        """
+        if not active:
+            return 100.0
+        if value is None:
+            return 0.0
+        if self.operation == 'clear-database':
+            # Progress is measured against the first count seen
+            initial = self._initial.setdefault(name, value)
+            if initial <= 0:
+                return 100.0
+            return 100.0 * (initial - value) / initial
+        return 100.0 * value
+
+    def done(self, connection=None):
+        """
+        Returns True if the operation has finished.
+        """
+        return self.status(connection)['done']
+
+    def wait(self, timeout=None, interval=POLL_INTERVAL, progress=None,
+             connection=None):
+        """
+        Wait for the operation to finish.
+
+        If progress is provided, it is called with the status (see
+        status()) after every poll.
+
+        :param timeout: The maximum number of seconds to wait, or None
+        :param interval: The number of seconds between polls
+        :param progress: A function to report progress
+        :return: The final status
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            status = self.status(connection)
+            if progress is not None:
+                progress(status)
+            if status['done']:
+                return status
+            if deadline is not None and time.time() > deadline:
+                raise UnexpectedManagementAPIResponse(
+                    "{0} of {1} not finished after {2}s".format(
+                        self.operation, self.database_name, timeout))
+            self.logger.debug("{0} of {1}: {2:.1f}%".format(
+                self.operation, self.database_name, status['percent']))
+            time.sleep(interval)
+
+    def future(self, timeout=None, interval=POLL_INTERVAL, progress=None,
+               connection=None):
+        """
+        Wait for the operation in the background.
+
+        :return: A Future that resolves to the final status
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                result.set_result(self.wait(timeout, interval, progress,
+                                            connection))
+            except Exception as err:
+                result.set_exception(err)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return result
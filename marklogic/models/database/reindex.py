@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Classes for previewing the reindexing a database update will cause
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import json
+import logging
+from marklogic.models.database.operation import DatabaseOperation
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+
+# Changing any of these properties, in either direction, reindexes
+# every fragment in the database.
+REINDEX_ALL = {'attribute-value-positions', 'collection-lexicon',
+               'element-value-positions', 'element-word-positions',
+               'fast-case-sensitive-searches',
+               'fast-diacritic-sensitive-searches',
+               'fast-element-character-searches',
+               'fast-element-phrase-searches',
+               'fast-element-trailing-wildcard-searches',
+               'fast-element-word-searches', 'fast-phrase-searches',
+               'fast-reverse-searches', 'field-value-positions',
+               'field-value-searches', 'language',
+               'one-character-searches', 'stemmed-searches',
+               'three-character-searches',
+               'three-character-word-positions',
+               'trailing-wildcard-searches',
+               'trailing-wildcard-word-positions', 'triple-index',
+               'triple-positions', 'two-character-searches',
+               'uri-lexicon', 'word-positions', 'word-searches',
+               'field', 'fragment-root', 'fragment-parent',
+               'phrase-through', 'phrase-around',
+               'element-word-query-through', 'path-namespace'}
+
+# Adding one of these indexes reindexes the fragments that contain
+# the indexed element; removing one simply drops it.
+REINDEX_ADDED = {'range-element-index', 'range-element-attribute-index',
+                 'range-path-index', 'range-field-index',
+                 'geospatial-element-index', 'geospatial-path-index',
+                 'geospatial-region-index',
+                 'geospatial-element-child-index',
+                 'geospatial-element-pair-index',
+                 'geospatial-element-attribute-pair-index',
+                 'element-word-lexicon', 'element-attribute-word-lexicon'}
+
+_ESTIMATE = """xquery version "1.0-ml";
+declare variable $specs as xs:string external;
+
+let $specs := xdmp:from-json-string($specs)
+let $queries :=
+  for $spec in json:array-values($specs)
+  let $names := json:array-values(map:get($spec, "names"))
+  return
+    if (empty($names))
+    then cts:and-query(())
+    else cts:element-query(
+           for $name in $names
+           return fn:QName(map:get($name, "ns"), map:get($name, "name")),
+           cts:and-query(()))
+return array-node {
+  for $fid in xdmp:database-forests(xdmp:database())
+  let $estimate := function($query) {
+    xdmp:estimate(cts:search(fn:doc(), $query, "unfiltered", 1.0, $fid))
+  }
+  return object-node {
+    "forest": xdmp:forest-name($fid),
+    "fragments": $estimate(cts:and-query(())),
+    "affected": $estimate(cts:or-query($queries)),
+    "changes": array-node { for $query in $queries
+                            return $estimate($query) }
+  }
+}
+"""
+
+def _key(item):
+    """Internal function to compare configuration values."""
+    return json.dumps(item, sort_keys=True)
+
+def _names(prop, item):
+    """
+    Internal function to list the elements an added index covers, as
+    a list of {"ns": ..., "name": ...} objects. An empty list means the
+    index may cover any fragment.
+    """
+    names = []
+    if prop in ('range-element-index', 'element-word-lexicon',
+                'geospatial-element-index'):
+        for name in (item.get('localname') or "").split():
+            names.append({'ns': item.get('namespace-uri') or "",
+                          'name': name})
+    elif prop in ('range-element-attribute-index',
+                  'element-attribute-word-lexicon',
+                  'geospatial-element-child-index',
+                  'geospatial-element-pair-index',
+                  'geospatial-element-attribute-pair-index'):
+        for name in (item.get('parent-localname') or "").split():
+            names.append({'ns': item.get('parent-namespace-uri') or "",
+                          'name': name})
+    return names
+
+def diff_config(current, pending):
+    """
+    Compare two marshalled database configurations.
+
+    Only the properties in pending are compared; the Management API
+    leaves the others unchanged. Each change is a dictionary with the
+    property, the old and new values, the items added to and removed
+    from a list property, and whether the change reindexes (reindex)
+    every fragment or just the ones an added index covers (names).
+
+    :return: A list of changes
+    """
+    changes = []
+    for prop in sorted(pending):
+        old = current.get(prop)
+        new = pending[prop]
+        if _key(old) == _key(new):
+            continue
+
+        change = {'property': prop, 'old': old, 'new': new,
+                  'added': [], 'removed': [], 'reindex': False,
+                  'names': []}
+        if isinstance(old, list) or isinstance(new, list):
+            oldkeys = [_key(item) for item in old or []]
+            newkeys = [_key(item) for item in new or []]
+            change['added'] = [item for item in new or []
+                               if _key(item) not in oldkeys]
+            change['removed'] = [item for item in old or []
+                                 if _key(item) not in newkeys]
+
+        if prop in REINDEX_ALL:
+            change['reindex'] = True
+        elif prop in REINDEX_ADDED and change['added']:
+            change['reindex'] = True
+            for item in change['added']:
+                names = _names(prop, item)
+                if not names:
+                    change['names'] = []
+                    break
+                change['names'].extend(names)
+        changes.append(change)
+    return changes
+
+class ReindexPreview:
+    """
+    The ReindexPreview class shows what updating a database will do
+    before it is done.
+
+    Changing index settings with Database setters and update() starts
+    a reindex of the whole database, or of every fragment that contains
+    a newly indexed element. A preview compares the pending
+    configuration with the one on the server, reports which changes
+    reindex, and estimates how many fragments each forest will have to
+    reindex. The estimates are unfiltered, so an added index on an
+    attribute or a path counts every fragment that might contain it.
+
+    The changes can then be applied in stages: first the changes that
+    don't reindex, then the ones that do, all together (so that the
+    database is reindexed once) with a lowered reindexer throttle. When
+    the reindex has finished, restore_throttle() puts back the pending
+    configuration's throttle.
+    """
+    def __init__(self, database, connection=None):
+        """
+        Create a preview of updating database. Use Database.preview_update()
+        instead of calling this constructor directly.
+        """
+        if connection is None:
+            connection = database.connection
+        self.database = database
+        self.connection = connection
+        self.current = None
+        self.logger = logging.getLogger("marklogic.database")
+
+    def changes(self, refresh=False):
+        """
+        Compare the pending configuration with the server's.
+
+        :return: A list of changes (see diff_config)
+        """
+        if self.current is None or refresh:
+            self.current = self._lookup()
+        return diff_config(self.current.marshal(), self.database.marshal())
+
+    def requires_reindex(self):
+        """
+        Returns True if applying the changes will reindex the database.
+        """
+        return len([change for change in self.changes()
+                    if change['reindex']]) > 0
+
+    def estimate(self):
+        """
+        Estimate the fragments each forest will reindex.
+
+        Returns a dictionary with an entry for each forest. Each entry
+        has the number of 'fragments' in the forest, the number
+        'affected' by all of the changes together, and a dictionary of
+        the number affected by each change ('changes'). If nothing will
+        be reindexed, the dictionary is empty.
+        """
+        # Imported here, the client package imports the models
+        from marklogic.client.eval import Eval
+
+        changes = [change for change in self.changes() if change['reindex']]
+        if not changes:
+            return {}
+
+        specs = [{'property': change['property'], 'names': change['names']}
+                 for change in changes]
+
+        mleval = Eval(self.connection)
+        mleval.set_database(self.database.name)
+        mleval.set_xquery(_ESTIMATE)
+        mleval.set_vars({"specs": json.dumps(specs)})
+        found = []
+        for result in mleval.results():
+            found = result
+
+        estimates = {}
+        for forest in found:
+            counts = {}
+            for spec, count in zip(specs, forest['changes']):
+                counts[spec['property']] = count
+            estimates[forest['forest']] = {'fragments': forest['fragments'],
+                                           'affected': forest['affected'],
+                                           'changes': counts}
+        return estimates
+
+    def apply(self, throttle=1, connection=None):
+        """
+        Apply the changes in stages.
+
+        The changes that don't reindex are applied first. The reindexer
+        throttle is then set to throttle (1 is the gentlest, 5 the most
+        aggressive) and the rest are applied.
+
+        :param throttle: The reindexer throttle to use while reindexing
+        :return: A DatabaseOperation for the reindex, or None if there
+        is nothing to reindex
+        """
+        if connection is None:
+            connection = self.connection
+
+        current = self._lookup(connection)
+        if (self.database.etag is not None and current.etag is not None
+                and self.database.etag != current.etag):
+            raise UnexpectedManagementAPIResponse(
+                "{0} has changed since it was read".format(self.database.name))
+
+        changes = diff_config(current.marshal(), self.database.marshal())
+        staged = {}
+        reindexed = {}
+        for change in changes:
+            if change['reindex']:
+                reindexed[change['property']] = change['new']
+            else:
+                staged[change['property']] = change['new']
+
+        if staged:
+            self.logger.info("Updating {0} without reindexing"
+                             .format(self.database.name))
+            self._update(staged, current.etag, connection)
+
+        self.current = None
+        if not reindexed:
+            return None
+
+        self.logger.info("Updating {0} with reindexer throttle {1}"
+                         .format(self.database.name, throttle))
+        # The throttle is lowered before the reindexing changes are made,
+        # so that the reindexer never starts at the old throttle.
+        self._update({'reindexer-throttle': throttle}, None, connection)
+        self._update(reindexed, None, connection)
+        return DatabaseOperation(self.database.name, 'reindex-database',
+                                 current.forest_names(), connection)
+
+    def restore_throttle(self, connection=None):
+        """
+        Set the reindexer throttle back to the pending configuration's
+        (or the default, 5) after a staged apply.
+        """
+        if connection is None:
+            connection = self.connection
+        throttle = self.database.reindexer_throttle()
+        if throttle is None:
+            throttle = 5
+        self._update({'reindexer-throttle': throttle}, None, connection)
+        return self
+
+    def _lookup(self, connection=None):
+        """Internal method to read the server's configuration."""
+        # Imported here, the database package imports this module
+        from marklogic.models.database import Database
+
+        if connection is None:
+            connection = self.connection
+        current = Database.lookup(connection, self.database.name)
+        if current is None:
+            raise UnexpectedManagementAPIResponse(
+                "No database named {0}".format(self.database.name))
+        return current
+
+    def _update(self, config, etag, connection):
+        """Internal method to save a marshalled configuration."""
+        uri = connection.uri("databases", self.database.name)
+        connection.put(uri, payload=config, etag=etag)
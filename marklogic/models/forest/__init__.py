@@ -333,6 +333,33 @@ class Forest(Model,PropertyLists):
         response = connection.delete(uri)
         return self
 
+    def view(self, view, connection=None):
+        """
+        Get the requested view.
+        """
+        if connection is None:
+            connection = self.connection
+
+        uri = connection.uri("forests", self.name, properties=None,
+                             parameters=["view="+view])
+        response = connection.get(uri)
+        data = json.loads(response.text)
+        return data
+
+    def state(self, connection=None):
+        """
+        Returns the current state of the forest, for example "open",
+        "open replica" or "sync replicating".
+
+        :param connection: The connection to a MarkLogic server
+        :return: The state, or None if the forest does not report one
+        """
+        status = self.view("status", connection)
+        try:
+            return status['forest-status']['status-properties']['state']['value']
+        except KeyError:
+            return None
+
     @classmethod
     def lookup(cls, connection, name):
         """
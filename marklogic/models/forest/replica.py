@@ -42,3 +42,14 @@ class ForestReplica(Model):
             'fast-data-directory': fast_data_dir
             }
 
+    def replica_name(self):
+        """
+        The name of the replica forest.
+        """
+        return self._get_config_property('replica-name')
+
+    def host(self):
+        """
+        The host of the replica forest.
+        """
+        return self._get_config_property('host')
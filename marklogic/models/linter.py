@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Classes for finding configuration settings that are expensive in production
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import json
+import re
+from marklogic.models.database import Database
+from marklogic.models.group import Group
+from marklogic.models.host import Host
+from marklogic.models.server import Server
+from marklogic.models.metrics import flatten
+from marklogic.utilities.concurrency import imap
+from marklogic.exceptions import UnsupportedOperation
+
+SEVERITIES = ["info", "warning", "error"]
+
+# Query features that justify the more expensive indexes. The usage
+# passed to a ConfigLinter is a collection of these.
+FEATURES = ("near", "phrase", "wildcard", "element-wildcard")
+
+# Index settings that are only worth their cost if some query uses
+# one of the features listed. The cost is a rough, relative estimate.
+_COSTLY_INDEXES = [
+    ('word-positions', "set_word_positions", ("near", "phrase"),
+     "position lists for every word: often 20-40% more index space, "
+     + "slower loads and merges"),
+    ('element-word-positions', "set_element_word_positions", ("near",),
+     "position lists for every word in every element: often 20-40% "
+     + "more index space, slower loads and merges"),
+    ('element-value-positions', "set_element_value_positions", ("near",),
+     "position lists for every element value"),
+    ('attribute-value-positions', "set_attribute_value_positions", ("near",),
+     "position lists for every attribute value"),
+    ('field-value-positions', "set_field_value_positions", ("near",),
+     "position lists for every field value"),
+    ('one-character-searches', "set_one_character_searches", ("wildcard",),
+     "a term for every character: large indexes and slow loads"),
+    ('two-character-searches', "set_two_character_searches", ("wildcard",),
+     "a term for every pair of characters: large indexes and slow loads"),
+    ('three-character-searches', "set_three_character_searches",
+     ("wildcard",),
+     "a term for every three characters: often the largest index, "
+     + "50% or more of forest size, and much slower loads"),
+    ('three-character-word-positions',
+     "set_three_character_word_positions", ("wildcard",),
+     "position lists for every three character term: very large indexes"),
+    ('trailing-wildcard-searches', "set_trailing_wildcard_searches",
+     ("wildcard",),
+     "a term for every word prefix: larger indexes and slower loads"),
+    ('trailing-wildcard-word-positions',
+     "set_trailing_wildcard_word_positions", ("wildcard",),
+     "position lists for every word prefix: very large indexes"),
+    ('fast-element-character-searches',
+     "set_fast_element_character_searches", ("element-wildcard",),
+     "character terms for every element: very large indexes"),
+    ('fast-element-trailing-wildcard-searches',
+     "set_fast_element_trailing_wildcard_searches", ("element-wildcard",),
+     "word prefix terms for every element: larger indexes"),
+]
+
+# The range index properties of a database and the properties that
+# identify what each kind of index is on
+_RANGE_INDEXES = [
+    ('range-element-index', ('namespace-uri', 'localname')),
+    ('range-element-attribute-index', ('parent-namespace-uri',
+                                       'parent-localname',
+                                       'namespace-uri', 'localname')),
+    ('range-path-index', ('path-expression',)),
+    ('range-field-index', ('field-name',)),
+]
+
+# Group caches: the size property, the partitions property, the largest
+# size allowed, and the recommended fraction of host memory. These are
+# the fractions that automatic cache sizing uses.
+_CACHES = [
+    ('list-cache', "list cache", 73728, 1.0 / 8),
+    ('compressed-tree-cache', "compressed tree cache", 73728, 1.0 / 16),
+    ('expanded-tree-cache', "expanded tree cache", 73728, 1.0 / 8),
+]
+
+MAX_PARTITION_SIZE = 8192
+MAX_PARTITIONS = 32
+
+def _enabled(config, key):
+    """Internal function to test a boolean property."""
+    value = config.get(key)
+    return value is True or value == "true"
+
+def _number(config, key):
+    """Internal function to read a numeric property."""
+    value = config.get(key)
+    if isinstance(value, dict):
+        value = value.get('value')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class Finding:
+    """
+    A Finding is a configuration setting that is expensive in production.
+
+    Each finding records the rule that found it, its severity ("info",
+    "warning" or "error"), the kind and name of the resource, a message,
+    an estimate of the cost, and the setter (and the value to pass it)
+    that would fix it. The setter is None if the fix can't be made
+    with a single call.
+    """
+    def __init__(self, rule, severity, kind, name, message, cost,
+                 setter=None, value=None):
+        """
+        Create a finding.
+        """
+        self.rule = rule
+        self.severity = severity
+        self.kind = kind
+        self.name = name
+        self.message = message
+        self.cost = cost
+        self.setter = setter
+        self.value = value
+
+    def fix(self):
+        """
+        Describe the fix, for example "Database.set_word_positions(False)".
+        """
+        if self.setter is None:
+            return None
+        cls = {'database': "Database", 'group': "Group",
+               'server': "Server"}[self.kind]
+        if self.setter == "remove_index":
+            return "{0}.remove_index({1})".format(cls, json.dumps(self.value))
+        return "{0}.{1}({2})".format(cls, self.setter, repr(self.value))
+
+    def apply(self, model):
+        """
+        Apply the fix to a Database, Group or Server. The change is
+        only made on the server when the model is updated.
+
+        :param model: The model to change
+        :return: The model
+        """
+        if self.setter is None:
+            raise UnsupportedOperation(
+                "No automatic fix for {0}".format(self.rule))
+        if self.setter == "remove_index":
+            for prop, keys in _RANGE_INDEXES:
+                for index in model._config.get(prop) or []:
+                    if index._config == self.value:
+                        return model.remove_index(index)
+            return model
+        return getattr(model, self.setter)(self.value)
+
+    def marshal(self):
+        """
+        Return a flat structure suitable for conversion to JSON.
+        """
+        return {'rule': self.rule, 'severity': self.severity,
+                'kind': self.kind, 'name': self.name,
+                'message': self.message, 'cost': self.cost,
+                'fix': self.fix()}
+
+    def __str__(self):
+        return "{0}: {1} {2}: {3} ({4})".format(
+            self.severity, self.kind, self.name, self.message, self.cost)
+
+def costly_indexes(linter, kind, name, config):
+    """
+    Find positions and wildcard indexes that no query needs.
+
+    If the linter doesn't know which query features are used, the
+    findings are informational.
+    """
+    findings = []
+    for key, setter, features, cost in _COSTLY_INDEXES:
+        if not _enabled(config, key):
+            continue
+        if linter.usage is None:
+            severity = "info"
+            message = "{0} is enabled; it is only needed by {1} queries" \
+                      .format(key, " or ".join(features))
+        elif set(features) & linter.usage:
+            continue
+        else:
+            severity = "warning"
+            message = "{0} is enabled but no {1} queries are used" \
+                      .format(key, " or ".join(features))
+        findings.append(Finding("costly-index", severity, kind, name,
+                                message, cost + "; removing it reindexes",
+                                setter, False))
+    return findings
+
+def _index_targets(prop, keys, index):
+    """
+    Internal function to list what a range index is on. An index may be
+    on several element or attribute names.
+    """
+    values = [index.get(key) or "" for key in keys]
+    if 'localname' not in keys:
+        return [tuple(values)]
+    names = values[-1].split()
+    return [tuple(values[:-1] + [localname]) for localname in names]
+
+def duplicate_range_indexes(linter, kind, name, config):
+    """
+    Find range indexes that duplicate or overlap other range indexes.
+    """
+    findings = []
+    for prop, keys in _RANGE_INDEXES:
+        seen = {}
+        for index in config.get(prop) or []:
+            signature = (index.get('scalar-type'), index.get('collation') or "")
+            targets = _index_targets(prop, keys, index)
+            duplicated = []
+            for target in targets:
+                others = seen.setdefault(target, [])
+                if signature in others:
+                    duplicated.append(target)
+                    continue
+                if others:
+                    findings.append(Finding(
+                        "overlapping-range-index", "info", kind, name,
+                        "{0} {1} has range indexes of type {2} and {3}"
+                        .format(prop, "/".join(target[1::2] or target),
+                                others[0][0], signature[0]),
+                        "each range index is held in memory for "
+                        + "every stand and updated on every merge"))
+                others.append(signature)
+            if duplicated:
+                setter = None
+                if len(duplicated) == len(targets):
+                    setter = "remove_index"
+                findings.append(Finding(
+                    "duplicate-range-index", "warning", kind, name,
+                    "{0} on {1} is defined more than once".format(
+                        prop, ", ".join(["/".join(target[1::2] or target)
+                                         for target in duplicated])),
+                    "twice the range index memory, disk and merge work "
+                    + "for the same values", setter, index))
+
+    # An element range index and a path range index on //name are the
+    # same index; the path index is the more expensive to maintain.
+    elements = {}
+    for index in config.get('range-element-index') or []:
+        if (index.get('namespace-uri') or "") == "":
+            for localname in (index.get('localname') or "").split():
+                elements[localname] = index.get('scalar-type')
+    for index in config.get('range-path-index') or []:
+        match = re.match(r"^//([\w.-]+)$", index.get('path-expression') or "")
+        if (match and elements.get(match.group(1))
+                == index.get('scalar-type')):
+            findings.append(Finding(
+                "duplicate-range-index", "warning", kind, name,
+                "range-path-index {0} duplicates the element range index "
+                "on {1}".format(index['path-expression'], match.group(1)),
+                "a second copy of the element range index, with path "
+                + "matching on every update", "remove_index", index))
+    return findings
+
+def undersized_caches(linter, kind, name, config):
+    """
+    Find group caches that are small relative to host memory.
+    Groups with automatic cache sizing are skipped.
+    """
+    findings = []
+    memory = linter.memory(name)
+    if memory is None or config.get('cache-sizing', 'manual') == 'auto':
+        return findings
+    for prop, label, maximum, fraction in _CACHES:
+        size = _number(config, prop + "-size")
+        recommended = min(maximum, int(memory * fraction))
+        if size is None or size * 2 > recommended:
+            continue
+        findings.append(Finding(
+            "undersized-cache", "warning", kind, name,
+            "the {0} is {1}MB, {2:.1%} of {3}MB host memory".format(
+                label, size, float(size) / memory, memory),
+            "{0}MB less {1} than recommended: more cache misses, so "
+            "more disk reads and decompression per query".format(
+                recommended - size, label),
+            "set_" + prop.replace("-", "_") + "_size", recommended))
+    return findings
+
+def cache_partitions(linter, kind, name, config):
+    """
+    Find group caches with too few partitions for their size.
+    """
+    findings = []
+    if config.get('cache-sizing', 'manual') == 'auto':
+        return findings
+    for prop, label, maximum, fraction in _CACHES:
+        size = _number(config, prop + "-size")
+        partitions = _number(config, prop + "-partitions")
+        if size is None or partitions is None:
+            continue
+        needed = min(MAX_PARTITIONS,
+                     (size + MAX_PARTITION_SIZE - 1) // MAX_PARTITION_SIZE)
+        if partitions >= needed:
+            continue
+        findings.append(Finding(
+            "cache-partitions", "warning", kind, name,
+            "the {0}MB {1} has {2} partition(s)".format(size, label,
+                                                       partitions),
+            "{0}MB per partition: threads contend for the partition "
+            "lock".format(size // partitions),
+            "set_" + prop.replace("-", "_") + "_partitions", needed))
+    return findings
+
+def unlimited_requests(linter, kind, name, config):
+    """
+    Find HTTP and XDBC servers that let a single user run any number
+    of concurrent requests.
+    """
+    if config.get('server-type') not in ("http", "xdbc"):
+        return []
+    if _number(config, 'concurrent-request-limit') != 0:
+        return []
+    threads = _number(config, 'threads') or 32
+    return [Finding(
+        "concurrent-request-limit", "warning", kind, name,
+        "the concurrent request limit is 0 (unlimited)",
+        "one user can occupy all {0} threads while other requests wait "
+        "in the backlog".format(threads),
+        "set_concurrent_request_limit", max(1, threads // 2))]
+
+RULES = {'database': [costly_indexes, duplicate_range_indexes],
+         'group': [undersized_caches, cache_partitions],
+         'server': [unlimited_requests]}
+
+class ConfigLinter:
+    """
+    The ConfigLinter class applies rules to database, group and app
+    server configurations and reports the settings that are expensive
+    in production.
+
+    The configurations can be Database, Group and Server objects, their
+    marshalled (JSON) form, or a snapshot of a whole cluster. Linting
+    makes no requests to the server.
+
+    The usage is a collection of the query features (see FEATURES) that
+    the applications use; if it is None, the positions and wildcard
+    indexes are reported only for information. Host memory (in
+    megabytes, either a number or a dictionary keyed by group name) is
+    needed to check cache sizes; it is read from the hosts in a
+    snapshot if it isn't provided.
+
+    Rules are functions that take the linter, the kind of resource,
+    its name and its marshalled configuration and return a list of
+    findings. The default rules are in RULES.
+    """
+    def __init__(self, usage=None, host_memory=None, rules=None,
+                 min_severity="info"):
+        """
+        Create a linter.
+        """
+        if usage is not None:
+            usage = set(usage)
+        if rules is None:
+            rules = RULES
+        self.usage = usage
+        self.host_memory = host_memory
+        self.rules = rules
+        self.min_severity = min_severity
+
+    def memory(self, group):
+        """
+        Return the host memory, in megabytes, of the hosts in group,
+        or None if it isn't known.
+        """
+        if isinstance(self.host_memory, dict):
+            return self.host_memory.get(group)
+        return self.host_memory
+
+    def lint(self, item):
+        """
+        Lint a Database, Group or Server, or the marshalled form of one.
+
+        :return: A list of findings, most severe first
+        """
+        if isinstance(item, (Database, Group, Server)):
+            config = item.marshal()
+        else:
+            config = item
+
+        if 'database-name' in config:
+            kind, name = 'database', config['database-name']
+        elif 'server-name' in config:
+            kind, name = 'server', "{0}|{1}".format(
+                config.get('group-name', 'Default'), config['server-name'])
+        elif 'group-name' in config:
+            kind, name = 'group', config['group-name']
+        else:
+            raise UnsupportedOperation("Not a database, group or server")
+
+        findings = []
+        for rule in self.rules.get(kind, []):
+            findings.extend(rule(self, kind, name, config))
+        return self._sort(findings)
+
+    def lint_snapshot(self, snapshot):
+        """
+        Lint a snapshot of a cluster: a dictionary with lists of
+        marshalled 'databases', 'groups' and 'servers', as made by
+        snapshot() or by the get-config example. If the snapshot has
+        'hosts' with a 'memory-size', they are used to check the caches.
+
+        :return: A list of findings, most severe first
+        """
+        saved = self.host_memory
+        if self.host_memory is None and snapshot.get('hosts'):
+            memory = {}
+            for host in snapshot['hosts']:
+                size = _number(host, 'memory-size')
+                group = host.get('group-name', 'Default')
+                if size is not None:
+                    memory[group] = min(size, memory.get(group, size))
+            self.host_memory = memory
+
+        try:
+            findings = []
+            for key in ('databases', 'groups', 'servers'):
+                for config in snapshot.get(key, []):
+                    findings.extend(self.lint(config))
+        finally:
+            self.host_memory = saved
+        return self._sort(findings)
+
+    def _sort(self, findings):
+        """
+        Internal method to drop findings below the minimum severity
+        and put the most severe first.
+        """
+        minimum = SEVERITIES.index(self.min_severity)
+        findings = [finding for finding in findings
+                    if SEVERITIES.index(finding.severity) >= minimum]
+        return sorted(findings,
+                      key=lambda finding: -SEVERITIES.index(finding.severity))
+
+def snapshot(connection, concurrency=8):
+    """
+    Read the configuration of every database, group and app server, and
+    the memory of every host, so that they can be linted (or saved as
+    JSON and linted later).
+
+    :return: A dictionary with lists of 'databases', 'groups',
+    'servers' and 'hosts'
+    """
+    def database(name):
+        return Database.lookup(connection, name).marshal()
+
+    def group(name):
+        return Group.lookup(connection, name).marshal()
+
+    def server(name):
+        return Server.lookup(connection, name).marshal()
+
+    def host(name):
+        config = {'host-name': name,
+                  'group-name': Host.lookup(connection, name).group_name()}
+        uri = connection.uri("hosts", name, properties=None,
+                             parameters=["view=status"])
+        response = connection.get(uri)
+        if response.status_code == 200:
+            values = flatten(json.loads(response.text))
+            for key in ("memory-system-total", "memory-size"):
+                found = [values[path] for path in values
+                         if path.endswith("." + key)]
+                if found:
+                    config['memory-size'] = int(found[0])
+                    break
+        return config
+
+    return {'databases': list(imap(database, Database.list(connection),
+                                   concurrency)),
+            'groups': list(imap(group, Group.list(connection), concurrency)),
+            'servers': list(imap(server, Server.list(connection),
+                                 concurrency)),
+            'hosts': list(imap(host, Host.list(connection), concurrency))}
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Classes for following server logs through the Management API
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import heapq
+import json
+import logging
+import re
+import threading
+from datetime import datetime
+from urllib.parse import quote
+from marklogic.models.host import Host
+from marklogic.utilities.concurrency import imap
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+
+LEVELS = ["Finest", "Finer", "Fine", "Debug", "Config", "Info", "Notice",
+          "Warning", "Error", "Critical", "Alert", "Emergency"]
+
+_ERRORLOG_LINE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?) "
+                            + r"(\w+): ?(.*)$")
+_ACCESSLOG_LINE = re.compile(r'^\S+ \S+ \S+ \[([^\]]+)\] ')
+
+def parse_line(line):
+    """
+    Parse a log line.
+
+    Returns a (timestamp, level, message) tuple. Error log lines have
+    a level; access log lines have the level None and the whole line
+    as the message. Lines that don't start with a timestamp (the
+    continuation of a multi-line message) return None.
+    """
+    match = _ERRORLOG_LINE.match(line)
+    if match:
+        stamp = match.group(1)
+        if "." in stamp:
+            timestamp = datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S.%f")
+        else:
+            timestamp = datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S")
+        return (timestamp, match.group(2), match.group(3))
+
+    match = _ACCESSLOG_LINE.match(line)
+    if match:
+        # The log is in the server's local time; the offset is dropped
+        # so that access and error log times compare.
+        stamp = match.group(1).split(" ")[0]
+        try:
+            timestamp = datetime.strptime(stamp, "%d/%b/%Y:%H:%M:%S")
+        except ValueError:
+            return None
+        return (timestamp, None, line)
+
+    return None
+
+class LogFollower:
+    """
+    The LogFollower class reads server logs from every host through the
+    Management API logs endpoint.
+
+    Each call to poll() returns only the events logged since the last
+    call. The endpoint selects lines by time, not by byte offset, so
+    the offset kept for each host and file is the time of the last line
+    read (to the second) and the number of lines already read at that
+    time. Offsets can be saved to a file and loaded again, so that a
+    follower can pick up where a previous one stopped.
+
+    The first read of a file returns all of it, unless lines is
+    provided; then only the last lines events are returned, as tail
+    does. Later reads return everything logged since.
+
+    If regex is provided, it is applied by the server. If min_level is
+    provided, only error log events at that level or above are
+    returned; when there is no regex, the level test is also done by
+    the server. Access log lines have no level and are not filtered by
+    min_level.
+
+    Events are dictionaries with the host, file, timestamp (a naive
+    datetime in the server's local time), level, message and the
+    original line. Events from all of the hosts and files are merged
+    in timestamp order.
+    """
+    def __init__(self, connection, files=("ErrorLog.txt",), hosts=None,
+                 regex=None, min_level=None, state_file=None, concurrency=8,
+                 lines=None):
+        """
+        Create a log follower.
+        """
+        if min_level is not None and min_level not in LEVELS:
+            raise UnexpectedManagementAPIResponse(
+                "Unknown log level: {0}".format(min_level))
+        self.connection = connection
+        self.files = files
+        self.hosts = hosts
+        self.regex = regex
+        self.min_level = min_level
+        self.state_file = state_file
+        self.concurrency = concurrency
+        self.lines = lines
+        self.offsets = {}
+        self.logger = logging.getLogger("marklogic.logs")
+        if state_file is not None:
+            self.load_state()
+
+    def poll(self):
+        """
+        Read the events logged since the last poll.
+
+        :return: A list of events, in timestamp order
+        """
+        hosts = self.hosts
+        if hosts is None:
+            hosts = Host.list(self.connection)
+
+        sources = []
+        for host in hosts:
+            for filename in self.files:
+                sources.append((host, filename))
+
+        streams = list(imap(self._read, sources, self.concurrency))
+        events = list(heapq.merge(*streams))
+        if self.state_file is not None:
+            self.save_state()
+        return [event for key, event in events]
+
+    def follow(self, interval=2, stop=None):
+        """
+        Yield events as they are logged, polling every interval seconds
+        until stop (a threading.Event) is set.
+        """
+        if stop is None:
+            stop = threading.Event()
+        while not stop.is_set():
+            for event in self.poll():
+                yield event
+            stop.wait(interval)
+
+    def load_state(self):
+        """Load the offsets from the state file, if it exists."""
+        try:
+            with open(self.state_file, "r") as state:
+                data = json.load(state)
+        except (IOError, ValueError):
+            return
+        for item in data:
+            self.offsets[(item['host'], item['file'])] \
+                = (item['time'], item['count'])
+
+    def save_state(self):
+        """Save the offsets to the state file."""
+        data = []
+        for (host, filename), (stamp, count) in self.offsets.items():
+            data.append({'host': host, 'file': filename,
+                         'time': stamp, 'count': count})
+        with open(self.state_file, "w") as state:
+            json.dump(data, state)
+
+    def _server_regex(self):
+        """Internal method to construct the regex applied by the server."""
+        if self.regex is not None:
+            return self.regex
+        if self.min_level is not None:
+            levels = LEVELS[LEVELS.index(self.min_level):]
+            return " ({0}):".format("|".join(levels))
+        return None
+
+    def _read(self, source):
+        """
+        Internal method to read new lines from one log file on one host.
+        Returns a sorted list of (key, event) tuples.
+        """
+        host, filename = source
+        connection = self.connection
+
+        parameters = ["format=text",
+                      "filename=" + quote(filename),
+                      "host=" + quote(host)]
+        offset = self.offsets.get(source)
+        if offset is not None:
+            parameters.append("start=" + quote(offset[0]))
+        regex = self._server_regex()
+        if regex is not None:
+            parameters.append("regex=" + quote(regex))
+
+        uri = connection.uri("logs", properties=None, parameters=parameters)
+        response = connection.get(uri, accept="text/plain")
+        if response.status_code != 200:
+            self.logger.debug("No {0} on {1}".format(filename, host))
+            return []
+
+        skip_time, skip = (None, 0) if offset is None else offset
+        last_time, count = None, 0
+        events = []
+        event = None
+        for line in response.text.splitlines():
+            parsed = parse_line(line)
+            if parsed is None:
+                # A continuation of the previous message
+                if event is not None:
+                    event['message'] += "\n" + line
+                    event['line'] += "\n" + line
+                continue
+
+            timestamp, level, message = parsed
+            second = timestamp.strftime("%Y-%m-%dT%H:%M:%S")
+            if second == last_time:
+                count += 1
+            else:
+                last_time, count = second, 1
+
+            event = None
+            if second == skip_time and count <= skip:
+                continue
+            if (self.min_level is not None and level is not None
+                    and level in LEVELS
+                    and LEVELS.index(level) < LEVELS.index(self.min_level)):
+                continue
+
+            event = {'host': host, 'file': filename, 'timestamp': timestamp,
+                     'level': level, 'message': message, 'line': line}
+            events.append(((timestamp, host, filename, len(events)), event))
+
+        if last_time is not None:
+            self.offsets[source] = (last_time, count)
+        if offset is None and self.lines is not None:
+            events = events[-self.lines:] if self.lines > 0 else []
+        return events
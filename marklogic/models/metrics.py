@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Classes for sampling Management API status views over time
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import collections
+import csv
+import json
+import logging
+import re
+import threading
+import time
+from marklogic.models.host import Host
+from marklogic.models.forest import Forest
+from marklogic.models.database import Database
+from marklogic.models.server import Server
+from marklogic.utilities.concurrency import imap
+
+RESOURCES = ("hosts", "forests", "databases", "servers")
+REFRESH = 60
+SKIPPED = {'meta', 'relations', 'related-views', 'units'}
+
+def flatten(data, prefix="", values=None):
+    """
+    Flatten a Management API view into a dictionary of numbers.
+
+    Each number (or boolean) in the view becomes an entry keyed by the
+    dotted path to it. Values wrapped in {"units": ..., "value": ...}
+    objects are unwrapped. Items in lists are named by their nameref
+    (or name), when they have one, and by position otherwise. Strings
+    and metadata are ignored.
+    """
+    if values is None:
+        values = {}
+
+    if isinstance(data, bool):
+        values[prefix] = 1.0 if data else 0.0
+    elif isinstance(data, (int, float)):
+        values[prefix] = float(data)
+    elif isinstance(data, dict):
+        if 'value' in data and not isinstance(data['value'], (dict, list)):
+            flatten(data['value'], prefix, values)
+        else:
+            for key in data:
+                if key not in SKIPPED:
+                    flatten(data[key], _join(prefix, key), values)
+    elif isinstance(data, list):
+        for index, item in enumerate(data):
+            name = str(index)
+            if isinstance(item, dict):
+                for key in ('nameref', 'name', 'idref'):
+                    if isinstance(item.get(key), str):
+                        name = item[key]
+                        break
+            flatten(item, _join(prefix, name), values)
+
+    return values
+
+def _join(prefix, key):
+    """Internal function to extend a series name."""
+    if prefix == "":
+        return key
+    return prefix + "." + key
+
+class RingBuffer:
+    """
+    The RingBuffer class keeps the most recent samples of a set of
+    time series, plus a downsampled history.
+
+    Each sample is a timestamp and a dictionary of values. At most
+    capacity samples are kept. Every downsample samples are also
+    averaged into a single sample in the history, which keeps at most
+    history samples. With the defaults and one sample a second, that's
+    an hour at full resolution and a day at one minute resolution.
+    """
+    def __init__(self, capacity=3600, downsample=60, history=1440):
+        """
+        Create a ring buffer.
+        """
+        self.capacity = capacity
+        self.downsample = downsample
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=capacity)
+        self._history = collections.deque(maxlen=history)
+        self._pending = []
+
+    def append(self, timestamp, values):
+        """Add a sample."""
+        with self._lock:
+            self._samples.append((timestamp, values))
+            self._pending.append((timestamp, values))
+            if len(self._pending) >= self.downsample:
+                self._history.append(self._average(self._pending))
+                self._pending = []
+
+    def samples(self, downsampled=False):
+        """Return a list of (timestamp, values) samples, oldest first."""
+        with self._lock:
+            if downsampled:
+                return list(self._history)
+            return list(self._samples)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def _average(self, samples):
+        """
+        Internal method to average samples. The timestamp is that of
+        the last sample.
+        """
+        totals = {}
+        counts = {}
+        for timestamp, values in samples:
+            for name in values:
+                totals[name] = totals.get(name, 0.0) + values[name]
+                counts[name] = counts.get(name, 0) + 1
+        average = {}
+        for name in totals:
+            average[name] = totals[name] / counts[name]
+        return (samples[-1][0], average)
+
+class MetricsCollector:
+    """
+    The MetricsCollector class samples the status of a cluster.
+
+    Each cycle reads the status views of the hosts, forests, databases
+    and app servers, concurrently, and stores every number in them in a
+    RingBuffer. By default the list views are read; one request per
+    kind of resource covers every resource of that kind, so a cycle
+    takes about as long as the slowest single request, however many
+    forests there are. With detail=True the status view of each
+    resource is read instead, with up to concurrency requests in flight
+    (give the connection a pool_size at least that large); the lists of
+    resources are reread every REFRESH cycles.
+
+    Series are named by resource kind and the path to the value, for
+    example "forests.forest-status-list.status-list-summary.total-forests".
+    With detail=True the name of the resource comes next; app servers
+    are named by group and name, for example "servers.Default.App-Services".
+
+    The status views report the current state of the cluster. To sample
+    the server's own historical metrics instead, pass view="metrics";
+    they are only updated as often as the server's meters are.
+    """
+    def __init__(self, connection, interval=1.0, resources=RESOURCES,
+                 detail=False, concurrency=32, capacity=3600,
+                 downsample=60, history=1440, view="status"):
+        """
+        Create a metrics collector.
+        """
+        self.connection = connection
+        self.interval = interval
+        self.resources = resources
+        self.detail = detail
+        self.view = view
+        self.concurrency = concurrency
+        self.buffer = RingBuffer(capacity, downsample, history)
+        self.cycle_time = None
+        self.logger = logging.getLogger("marklogic.metrics")
+        self._stop = threading.Event()
+        self._thread = None
+        self._requests_cache = None
+        self._cycles = 0
+
+    def sample(self):
+        """
+        Take one sample and add it to the buffer.
+
+        :return: The (timestamp, values) sample
+        """
+        start = time.time()
+        values = {}
+        for name, view in imap(self._read, self._requests(), self.concurrency):
+            flatten(view, name, values)
+        self.buffer.append(start, values)
+        self.cycle_time = time.time() - start
+        return (start, values)
+
+    def start(self):
+        """
+        Start sampling every interval seconds in the background.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def series(self, pattern=None, downsampled=False):
+        """
+        Return the samples as a dictionary of series. Each series is a
+        list of (timestamp, value) tuples. If pattern is provided, only
+        series whose names match that regular expression are returned.
+        """
+        regex = None if pattern is None else re.compile(pattern)
+        result = {}
+        for timestamp, values in self.buffer.samples(downsampled):
+            for name in values:
+                if regex is None or regex.search(name):
+                    result.setdefault(name, []).append((timestamp,
+                                                        values[name]))
+        return result
+
+    def to_csv(self, stream, pattern=None, downsampled=False):
+        """
+        Write the samples to stream as CSV: a timestamp column and one
+        column per series. Values missing from a sample are left empty.
+        """
+        regex = None if pattern is None else re.compile(pattern)
+        samples = self.buffer.samples(downsampled)
+        names = set()
+        for timestamp, values in samples:
+            for name in values:
+                if regex is None or regex.search(name):
+                    names.add(name)
+        names = sorted(names)
+
+        writer = csv.writer(stream)
+        writer.writerow(["timestamp"] + names)
+        for timestamp, values in samples:
+            writer.writerow([timestamp] + [values.get(name, "")
+                                           for name in names])
+
+    def to_json(self, stream, pattern=None, downsampled=False):
+        """
+        Write the samples to stream as JSON: an object with a list of
+        [timestamp, value] pairs for each series.
+        """
+        series = self.series(pattern, downsampled)
+        data = {}
+        for name in series:
+            data[name] = [list(point) for point in series[name]]
+        json.dump({"series": data}, stream)
+
+    def _run(self):
+        """Internal method that samples until stopped."""
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                self.sample()
+            except Exception as err:
+                self.logger.warning("Sample failed: {0}".format(err))
+            elapsed = time.time() - start
+            if elapsed > self.interval:
+                self.logger.warning("Sample took {0:.2f}s".format(elapsed))
+            self._stop.wait(max(0, self.interval - elapsed))
+
+    def _requests(self):
+        """
+        Internal method to list the (series prefix, uri) pairs to read.
+        """
+        if self._requests_cache is None or self._cycles % REFRESH == 0:
+            self._requests_cache = self._list_requests()
+        self._cycles += 1
+        return self._requests_cache
+
+    def _list_requests(self):
+        """Internal method to construct the list of requests."""
+        connection = self.connection
+        requests = []
+        for resource in self.resources:
+            if not self.detail:
+                requests.append((resource,
+                                 connection.uri(resource, properties=None,
+                                                parameters=["view=" + self.view])))
+                continue
+
+            if resource == "hosts":
+                names = Host.list(connection)
+            elif resource == "forests":
+                names = Forest.list(connection)
+            elif resource == "databases":
+                names = Database.list(connection)
+            else:
+                names = Server.list(connection)
+
+            for name in names:
+                parameters = ["view=" + self.view]
+                prefix = resource
+                if resource == "servers":
+                    group, name = name.split("|")
+                    parameters.append("group-id=" + group)
+                    prefix = _join(resource, group)
+                requests.append((_join(prefix, name),
+                                 connection.uri(resource, name,
+                                                properties=None,
+                                                parameters=parameters)))
+        return requests
+
+    def _read(self, request):
+        """Internal method to read one view."""
+        name, uri = request
+        response = self.connection.get(uri)
+        if response.status_code != 200:
+            return (name, {})
+        return (name, json.loads(response.text))
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0#
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Classes for monitoring and cancelling the requests running on app servers
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import collections
+import logging
+import re
+import threading
+import time
+from marklogic.client.eval import Eval
+from marklogic.models.host import Host
+from marklogic.utilities.concurrency import imap
+
+HISTORYSIZE = 1000
+
+_ACTIVE_REQUESTS = """xquery version "1.0-ml";
+declare namespace ss = "http://marklogic.com/xdmp/status/server";
+declare variable $host as xs:string external;
+declare variable $server as xs:string external;
+
+let $hostid := xdmp:host($host)
+let $group := xdmp:host-group($hostid)
+let $now := fn:current-dateTime()
+return array-node {
+  for $sid in (if ($server = "")
+               then xdmp:group-servers($group)
+               else xdmp:server($server, $group))
+  let $status := try { xdmp:server-status($hostid, $sid) } catch ($e) { () }
+  for $req in $status/ss:request-statuses/ss:request-status
+  let $start := xs:dateTime($req/ss:start-time)
+  let $db := ($req/ss:database, $status/ss:database)[1]
+  where not($hostid = xdmp:host() and $req/ss:request-id = xdmp:request())
+  return object-node {
+    "host": $host,
+    "server": xdmp:server-name($sid),
+    "request-id": string($req/ss:request-id),
+    "elapsed": ($now - $start) div xs:dayTimeDuration("PT1S"),
+    "start-time": string($start),
+    "user": try { xdmp:user-name(xs:unsignedLong($req/ss:user)) }
+            catch ($e) { string($req/ss:user) },
+    "database": if (empty($db)) then ""
+                else try { xdmp:database-name(xs:unsignedLong($db)) }
+                     catch ($e) { string($db) },
+    "update": string($req/ss:update) = "true",
+    "kind": string($req/ss:request-kind),
+    "state": string($req/ss:request-state),
+    "text": string($req/ss:request-text)
+  }
+}
+"""
+
+_CANCEL_REQUEST = """xquery version "1.0-ml";
+declare namespace error = "http://marklogic.com/xdmp/error";
+declare variable $host as xs:string external;
+declare variable $server as xs:string external;
+declare variable $request as xs:string external;
+
+let $hostid := xdmp:host($host)
+let $sid := xdmp:server($server, xdmp:host-group($hostid))
+return
+  (: The request may have finished in the meantime :)
+  try { xdmp:request-cancel($hostid, $sid, xs:unsignedLong($request)), true() }
+  catch ($e) {
+    if ($e/error:code = "XDMP-NOREQUEST") then false() else xdmp:rethrow()
+  }
+"""
+
+class CancelRule:
+    """
+    A CancelRule describes requests that should be cancelled.
+
+    A request matches the rule if it matches every criterion that is
+    not None: the app server name, the minimum elapsed time in seconds,
+    whether it is an update (False matches only queries), the user
+    name, the database name and a regular expression that is searched
+    for in the request text.
+    """
+    def __init__(self, server=None, older_than=None, update=None,
+                 user=None, database=None, pattern=None, name=None):
+        """
+        Create a cancel rule.
+        """
+        self.server = server
+        self.older_than = older_than
+        self.update = update
+        self.user = user
+        self.database = database
+        self.pattern = None if pattern is None else re.compile(pattern)
+        if name is None:
+            name = self._describe()
+        self.name = name
+
+    def matches(self, request):
+        """
+        Returns True if the request (as returned by
+        RequestMonitor.requests()) matches the rule.
+        """
+        if self.server is not None and request['server'] != self.server:
+            return False
+        if self.older_than is not None and request['elapsed'] < self.older_than:
+            return False
+        if self.update is not None and request['update'] != self.update:
+            return False
+        if self.user is not None and request['user'] != self.user:
+            return False
+        if self.database is not None and request['database'] != self.database:
+            return False
+        if self.pattern is not None and not self.pattern.search(request['text']):
+            return False
+        return True
+
+    def _describe(self):
+        """Internal method to describe the rule."""
+        parts = []
+        if self.update is True:
+            parts.append("updates")
+        elif self.update is False:
+            parts.append("queries")
+        else:
+            parts.append("requests")
+        if self.server is not None:
+            parts.append("on {0}".format(self.server))
+        if self.older_than is not None:
+            parts.append("older than {0}s".format(self.older_than))
+        if self.user is not None:
+            parts.append("by {0}".format(self.user))
+        if self.database is not None:
+            parts.append("in {0}".format(self.database))
+        if self.pattern is not None:
+            parts.append("matching {0}".format(self.pattern.pattern))
+        return " ".join(parts)
+
+class RequestMonitor:
+    """
+    The RequestMonitor class lists the requests running on app servers
+    and cancels them.
+
+    The status of the app servers on every host is read concurrently.
+    Each request is returned as a dictionary with the host, server,
+    request-id, elapsed (seconds), start-time, user, database, update
+    (True for updates, False for queries), kind, state and text of the
+    request.
+
+    Requests can be cancelled one at a time or by rule. Every request
+    cancelled is recorded, with the time and the rule, in history; a
+    request that had already finished when it was to be cancelled is
+    not.
+    """
+    def __init__(self, connection, concurrency=8, history_size=HISTORYSIZE):
+        """
+        Create a request monitor.
+        """
+        self.connection = connection
+        self.concurrency = concurrency
+        self.history = collections.deque(maxlen=history_size)
+        self.logger = logging.getLogger("marklogic.requests")
+        self._lock = threading.Lock()
+
+    def requests(self, server=None, hosts=None):
+        """
+        List the active requests, longest running first.
+
+        :param server: Only list requests on the app server with this name
+        :param hosts: The hosts to check, by default all of them
+        :return: A list of requests
+        """
+        connection = self.connection
+        if hosts is None:
+            hosts = Host.list(connection)
+
+        def read(host):
+            mleval = Eval(connection)
+            mleval.set_xquery(_ACTIVE_REQUESTS)
+            mleval.set_vars({"host": host,
+                             "server": "" if server is None else server})
+            found = []
+            for result in mleval.results():
+                found = result
+            return found
+
+        requests = []
+        for found in imap(read, hosts, self.concurrency):
+            requests.extend(found)
+        return sorted(requests, key=lambda request: -request['elapsed'])
+
+    def cancel(self, request, rule=None):
+        """
+        Cancel a request.
+
+        :param request: A request, as returned by requests()
+        :param rule: The rule that selected the request, if any
+        :return: True if the request was cancelled, False if it had
+        already finished
+        """
+        mleval = Eval(self.connection)
+        mleval.set_xquery(_CANCEL_REQUEST)
+        mleval.set_vars({"host": request['host'],
+                         "server": request['server'],
+                         "request": request['request-id']})
+        cancelled = False
+        for result in mleval.results():
+            cancelled = result
+
+        if not cancelled:
+            self.logger.debug("Request {0} on {1}/{2} had already finished"
+                              .format(request['request-id'], request['host'],
+                                      request['server']))
+            return False
+
+        self.logger.info("Cancelled request {0} on {1}/{2} after {3:.1f}s"
+                         .format(request['request-id'], request['host'],
+                                 request['server'], request['elapsed']))
+        with self._lock:
+            self.history.append({'time': time.time(),
+                                 'rule': None if rule is None else rule.name,
+                                 'request': request})
+        return True
+
+    def cancel_matching(self, rules, server=None, dry_run=False):
+        """
+        Cancel every active request that matches one of the rules.
+
+        :param rules: A CancelRule or a list of them
+        :param server: Only consider requests on this app server
+        :param dry_run: If True, find the requests but don't cancel them
+        :return: A list of (request, rule) tuples for the requests
+        cancelled (or, for a dry run, that would have been)
+        """
+        if isinstance(rules, CancelRule):
+            rules = [rules]
+
+        matched = []
+        for request in self.requests(server):
+            for rule in rules:
+                if rule.matches(request):
+                    matched.append((request, rule))
+                    break
+
+        if dry_run:
+            return matched
+
+        cancelled = list(imap(lambda match: self.cancel(match[0], match[1]),
+                              matched, self.concurrency, ordered=True))
+        return [match for match, done in zip(matched, cancelled) if done]
+
+    def watch(self, rules, interval=5, server=None, stop=None):
+        """
+        Cancel matching requests every interval seconds until stop
+        (a threading.Event) is set.
+        """
+        if stop is None:
+            stop = threading.Event()
+        while not stop.is_set():
+            try:
+                self.cancel_matching(rules, server)
+            except Exception as err:
+                self.logger.warning("Request check failed: {0}".format(err))
+            stop.wait(interval)
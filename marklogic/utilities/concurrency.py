@@ -0,0 +1,244 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Helpers for running requests concurrently
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import collections
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+def imap(function, items, concurrency=4, ordered=False):
+    """
+    Apply function to each of the items on a pool of threads.
+
+    Results are yielded as they become available. At most concurrency
+    calls are in flight at once and the items are consumed lazily, so
+    items may be an arbitrarily long iterator. If ordered is True,
+    results are yielded in the order of the items, otherwise they are
+    yielded in the order in which they complete.
+
+    If a call raises an exception, it is raised to the caller when that
+    result would have been yielded and any outstanding calls are
+    cancelled.
+    """
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    pending = []
+    try:
+        for item in itertools.islice(items, max(1, concurrency)):
+            pending.append(executor.submit(function, item))
+        while pending:
+            if ordered:
+                future = pending[0]
+            else:
+                done, notdone = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+            pending.remove(future)
+
+            for item in itertools.islice(items, 1):
+                pending.append(executor.submit(function, item))
+
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def imap_iter(function, items, concurrency=4, ordered=False, queue_size=64):
+    """
+    Apply function, which returns an iterable, to each of the items on a
+    pool of threads and yield the members of the iterables.
+
+    This is imap() for functions that produce a stream of results. Each
+    call is iterated on its own thread and its results are handed over
+    through a queue of at most queue_size results, so no more than
+    concurrency * queue_size results are held in memory, however many
+    each call produces. If ordered is True, all of the results of one
+    item are yielded before any of the next, otherwise results are
+    yielded as they arrive.
+
+    If a call raises an exception, it is raised to the caller after the
+    results that call produced before it failed.
+    """
+    items = iter(items)
+    concurrency = max(1, concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    stop = threading.Event()
+    shared = queue.Queue(queue_size)
+    pending = collections.OrderedDict()
+    count = itertools.count()
+
+    def put(results, value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(results, key, item):
+        # Results are (result,) tuples; (_DONE, key) marks the end
+        try:
+            for result in function(item):
+                if not put(results, (result,)):
+                    return
+        finally:
+            put(results, (_DONE, key))
+
+    def submit():
+        for item in itertools.islice(items, 1):
+            key = next(count)
+            results = queue.Queue(queue_size) if ordered else shared
+            pending[key] = (results, executor.submit(run, results, key, item))
+
+    try:
+        for _ in range(concurrency):
+            submit()
+        while pending:
+            results = next(iter(pending.values()))[0]
+            value = results.get()
+            if len(value) == 1:
+                yield value[0]
+                continue
+            future = pending.pop(value[1])[1]
+            future.result()
+            submit()
+    finally:
+        stop.set()
+        for results, future in pending.values():
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def chunks(items, size):
+    """
+    Split an iterable into lists of at most size items.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+_DONE = object()
+
+def pipeline(items, stages, queue_size=64):
+    """
+    Run items through a sequence of stages, each on its own threads.
+
+    Each stage is a (function, workers) tuple. The items are passed to
+    the first stage's function, its results to the second stage's, and
+    so on; a function may return None to drop an item. The stages are
+    connected by queues holding at most queue_size items, so a slow
+    stage holds back the ones before it instead of letting work pile
+    up in memory. The items are consumed on a separate thread, so
+    items can itself be a lazy iterator that does I/O.
+
+    Results of the last stage are yielded as they become available.
+    If any stage raises an exception, the pipeline is stopped and the
+    exception is raised to the caller.
+    """
+    stages = [(function, max(1, workers)) for function, workers in stages]
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(queue_size) for stage in stages]
+    queues.append(queue.Queue(queue_size))
+    remaining = [workers for function, workers in stages]
+    lock = threading.Lock()
+
+    def put(index, item):
+        while not stop.is_set():
+            try:
+                queues[index].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def fail(err):
+        with lock:
+            errors.append(err)
+        stop.set()
+
+    def finish(index):
+        # The last worker of a stage to finish tells the next stage
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            count = stages[index + 1][1] if index + 1 < len(stages) else 1
+            for _ in range(count):
+                put(index + 1, _DONE)
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                put(0, item)
+        except Exception as err:
+            fail(err)
+        finally:
+            for _ in range(stages[0][1]):
+                put(0, _DONE)
+
+    def work(index, function):
+        try:
+            while not stop.is_set():
+                try:
+                    item = queues[index].get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    return
+                result = function(item)
+                if result is not None:
+                    put(index + 1, result)
+        except Exception as err:
+            fail(err)
+        finally:
+            finish(index)
+
+    threads = [threading.Thread(target=feed)]
+    for index, (function, workers) in enumerate(stages):
+        for _ in range(workers):
+            threads.append(threading.Thread(target=work,
+                                            args=(index, function)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        while not stop.is_set():
+            try:
+                item = queues[-1].get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
@@ -19,7 +19,8 @@
 # Paul Hoehne       03/01/2015     Initial development
 #
 
-import os, sys, stat
+import os, sys, hashlib, re, queue, threading
+from concurrent.futures import ProcessPoolExecutor
 
 """
 MarkLogic file classes
@@ -30,12 +31,224 @@ def walk_directories(current_directory):
     Recursively walk a directory returning all of the files found.
     """
     file_list = []
-    for dir in os.listdir(current_directory):
-        pathname = os.path.join(current_directory, dir)
-        mode = os.stat(pathname).st_mode
-
-        if stat.S_ISDIR(mode):
-            file_list.extend(walk_directories(pathname))
-        else:
-            file_list.append({u'filename': dir, u'partial-directory': pathname})
+    for path, entry in walk_files(current_directory):
+        file_list.append({u'filename': entry.name, u'partial-directory': entry.path})
     return file_list
+
+def compile_patterns(patterns):
+    """
+    Compile a list of regular expressions (strings or already compiled
+    patterns). Returns an empty list if patterns is None.
+    """
+    if patterns is None:
+        return []
+    if isinstance(patterns, str) or hasattr(patterns, 'match'):
+        patterns = [patterns]
+    return [re.compile(pattern) if isinstance(pattern, str) else pattern
+            for pattern in patterns]
+
+def walk_files(directory, include=None, exclude=None, threads=1,
+               ordered=False):
+    """
+    Iterate over the files below a directory.
+
+    A (path, entry) tuple is yielded for each file, where path is the
+    path relative to directory (with a leading "/") and entry is the
+    os.DirEntry. Directories are read with os.scandir(), so no extra
+    stat() is needed to tell files from directories on most platforms,
+    and files are yielded as they're found rather than collected first.
+
+    If include is given, only files whose relative path matches one of
+    the include patterns are yielded; files whose relative path matches
+    one of the exclude patterns never are. Patterns are matched (with
+    match(), not search()) and compiled only once.
+
+    If ordered is True, files are yielded in code point order of their
+    paths (the order of a MarkLogic URI lexicon), so the listing can be
+    merge-joined with the URIs of a database. Only one directory
+    listing per level is held in memory. Otherwise, if threads is
+    greater than one, the top-level subdirectories are walked
+    concurrently and files are yielded in no particular order.
+    """
+    include = compile_patterns(include)
+    exclude = compile_patterns(exclude)
+
+    if ordered:
+        for item in _walk_ordered(directory, include, exclude):
+            yield item
+        return
+
+    if threads <= 1:
+        for item in _walk(directory, [""], include, exclude):
+            yield item
+        return
+
+    subdirs = []
+    for item in _walk(directory, [""], include, exclude, subdirs):
+        yield item
+    for item in _walk_parallel(directory, subdirs, include, exclude, threads):
+        yield item
+
+def _walk(directory, stack, include, exclude, subdirs=None):
+    """
+    Internal generator that walks the relative directories in stack.
+
+    If subdirs is a list, subdirectories are appended to it instead of
+    being walked.
+    """
+    while stack:
+        relative = stack.pop()
+        with _ScanDir(directory + relative) as entries:
+            for entry in entries:
+                path = relative + "/" + entry.name
+                if entry.is_dir():
+                    if subdirs is None:
+                        stack.append(path)
+                    else:
+                        subdirs.append(path)
+                elif (not include or any(p.match(path) for p in include)) \
+                  and not any(p.match(path) for p in exclude):
+                    yield (path, entry)
+
+def _walk_ordered(directory, include, exclude):
+    """
+    Internal generator that walks directory in code point order.
+
+    The stack holds the entries not yet visited, last first. Sorting a
+    directory as "name/" puts its contents exactly where their full
+    paths sort among the other names.
+    """
+    stack = [("", None)]
+    while stack:
+        relative, entry = stack.pop()
+        if entry is None or entry.is_dir():
+            with _ScanDir(directory + relative) as entries:
+                found = [(relative + "/" + child.name, child)
+                         for child in entries]
+            found.sort(key=lambda pair: pair[0] + "/" if pair[1].is_dir()
+                       else pair[0], reverse=True)
+            stack.extend(found)
+        elif (not include or any(p.match(relative) for p in include)) \
+          and not any(p.match(relative) for p in exclude):
+            yield (relative, entry)
+
+class _ScanDir:
+    """os.scandir() as a context manager, even where it isn't one."""
+    def __init__(self, path):
+        self.iterator = os.scandir(path)
+
+    def __enter__(self):
+        return self.iterator
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        close = getattr(self.iterator, 'close', None)
+        if close is not None:
+            close()
+        return False
+
+_DONE = object()
+
+def _walk_parallel(directory, subdirs, include, exclude, threads,
+                   batch_size=1000):
+    """
+    Internal generator that walks subdirectories on a pool of threads.
+
+    Each thread takes a subdirectory at a time and passes what it finds
+    back in batches through a bounded queue.
+    """
+    pending = queue.Queue()
+    for subdir in subdirs:
+        pending.put(subdir)
+    output = queue.Queue(threads * 4)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    subdir = pending.get_nowait()
+                except queue.Empty:
+                    return
+                batch = []
+                for item in _walk(directory, [subdir], include, exclude):
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        put(batch)
+                        batch = []
+                if batch:
+                    put(batch)
+        except Exception as err:
+            errors.append(err)
+            stop.set()
+        finally:
+            put(_DONE)
+
+    workers = [threading.Thread(target=worker)
+               for _ in range(min(threads, max(1, len(subdirs))))]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        running = len(workers)
+        while running and not stop.is_set():
+            try:
+                batch = output.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if batch is _DONE:
+                running -= 1
+            else:
+                for item in batch:
+                    yield item
+    finally:
+        stop.set()
+        for thread in workers:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+def file_hash(pathname, chunk_size=1024*1024):
+    """
+    Return the MD5 hash (in hex) of a file, reading it a chunk at a time.
+    """
+    digest = hashlib.md5()
+    with open(pathname, "rb") as data:
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_hashes(pathnames, processes=None):
+    """
+    Return a dictionary of MD5 hashes, keyed by pathname.
+
+    The files are hashed in a pool of processes (by default, one per
+    CPU) so that hashing isn't limited to a single core. The hashes
+    match those computed by ClientUtils.content_hashes() for identical
+    content.
+    """
+    pathnames = list(pathnames)
+    if not pathnames:
+        return {}
+    hashes = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        workers = processes or os.cpu_count() or 1
+        chunksize = max(1, len(pathnames) // (4 * workers))
+        for pathname, digest in zip(pathnames,
+                                    executor.map(file_hash, pathnames,
+                                                 chunksize=chunksize)):
+            hashes[pathname] = digest
+    return hashes
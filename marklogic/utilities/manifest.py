@@ -0,0 +1,165 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+A persistent record of the files synchronized with a database
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import sqlite3
+import threading
+
+_COLUMNS = ['path', 'uri', 'mtime', 'size', 'server_timestamp', 'state']
+
+class SyncManifest:
+    """
+    The SyncManifest class records, for each local file, the URI it is
+    synchronized with, the local modification time and size, and the
+    server timestamp last seen.
+
+    The manifest is stored in an SQLite database. Updates are committed
+    as they are made, so if a run is interrupted, the next run can pick
+    up where it stopped.
+    """
+    def __init__(self, filename):
+        """
+        Open (or create) a manifest.
+        """
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS manifest ("
+                         + "path TEXT PRIMARY KEY, uri TEXT, "
+                         + "mtime REAL, size INTEGER, "
+                         + "server_timestamp TEXT, state TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS manifest_uri "
+                         + "ON manifest (uri)")
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Close the manifest."""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def get(self, path):
+        """Get the entry for a path as a dictionary, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM manifest WHERE path = ?",
+                                   (path,)).fetchone()
+        if row is None:
+            return None
+        return dict(row)
+
+    def get_uri(self, uri):
+        """Get the entry for a URI as a dictionary, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM manifest WHERE uri = ?",
+                                   (uri,)).fetchone()
+        if row is None:
+            return None
+        return dict(row)
+
+    def unchanged(self, path, mtime, size):
+        """
+        Return True if path is recorded as synchronized with the given
+        modification time and size.
+        """
+        entry = self.get(path)
+        return (entry is not None and entry['state'] == 'synced'
+                and entry['mtime'] == mtime and entry['size'] == size)
+
+    def paths(self):
+        """Return a list of all of the paths in the manifest, in order."""
+        with self._lock:
+            rows = self._db.execute("SELECT path FROM manifest ORDER BY path")
+            return [row[0] for row in rows]
+
+    def entries(self):
+        """Iterate over all of the entries in the manifest, in path order.
+
+        The entries are read a row at a time through a connection of
+        their own, so a large manifest isn't held in memory and the
+        manifest can be updated while the entries are being read. The
+        entries are those committed when the iteration started.
+        """
+        db = sqlite3.connect(self.filename)
+        db.row_factory = sqlite3.Row
+        try:
+            for row in db.execute("SELECT * FROM manifest ORDER BY path"):
+                yield dict(row)
+        finally:
+            db.close()
+
+    def update(self, entries):
+        """
+        Insert or replace a list of entries and commit them.
+
+        Each entry is a dictionary with (at least) 'path' and 'uri' keys;
+        missing values are stored as NULL. The 'state' defaults to
+        'synced'. An entry without a 'server_timestamp' (a file that
+        was uploaded) keeps the one already recorded for its path.
+        """
+        rows = []
+        for entry in entries:
+            row = []
+            for column in _COLUMNS:
+                if column == 'state':
+                    row.append(entry.get('state', 'synced'))
+                else:
+                    row.append(entry.get(column))
+                if column == 'server_timestamp':
+                    row.append(entry['path'])
+            rows.append(row)
+
+        values = []
+        for column in _COLUMNS:
+            if column == 'server_timestamp':
+                values.append("COALESCE(?, (SELECT server_timestamp "
+                              + "FROM manifest WHERE path = ?))")
+            else:
+                values.append("?")
+
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO manifest ("
+                                 + ", ".join(_COLUMNS) + ") VALUES ("
+                                 + ", ".join(values) + ")", rows)
+            self._db.commit()
+
+    def remove(self, paths):
+        """Remove the entries for a list of paths and commit."""
+        with self._lock:
+            self._db.executemany("DELETE FROM manifest WHERE path = ?",
+                                 [(path,) for path in paths])
+            self._db.commit()
+
+    def count(self):
+        """Return the number of entries in the manifest."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM manifest") \
+                       .fetchone()[0]
@@ -0,0 +1,61 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Merge-join of sorted streams
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+def merge_join(left, right):
+    """
+    Join two streams of (key, value) pairs that are sorted by key.
+
+    Yields a (key, left_item, right_item) tuple for every key in either
+    stream, in key order, where each item is the (key, value) pair from
+    that stream or None if the stream doesn't contain the key. Only one
+    item from each stream is held at a time, so the streams can be
+    arbitrarily long.
+
+    Keys must be unique and strictly increasing in each stream. A
+    stream that goes backwards raises a ValueError rather than producing
+    a wrong answer.
+    """
+    left = _checked(left, "left")
+    right = _checked(right, "right")
+    litem = next(left, None)
+    ritem = next(right, None)
+    while litem is not None or ritem is not None:
+        if ritem is None or (litem is not None and litem[0] < ritem[0]):
+            yield (litem[0], litem, None)
+            litem = next(left, None)
+        elif litem is None or ritem[0] < litem[0]:
+            yield (ritem[0], None, ritem)
+            ritem = next(right, None)
+        else:
+            yield (litem[0], litem, ritem)
+            litem = next(left, None)
+            ritem = next(right, None)
+
+def _checked(items, name):
+    """Yield items, raising ValueError if the keys aren't increasing."""
+    last = None
+    for item in items:
+        if last is not None and not last < item[0]:
+            raise ValueError("The {} stream is not sorted: {!r} after {!r}"
+                             .format(name, item[0], last))
+        last = item[0]
+        yield item
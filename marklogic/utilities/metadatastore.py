@@ -0,0 +1,156 @@
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+A single-file store for document metadata
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+import sqlite3
+import threading
+import time
+
+COMMITSIZE = 1000
+
+class MetadataStore:
+    """
+    The MetadataStore class keeps the metadata for many documents in a
+    single SQLite database, keyed by URI, instead of one file per
+    document.
+
+    Each entry records the URI, the path of the corresponding content
+    file, the metadata itself (as bytes) and when it was last stored.
+    Entries can be read one at a time by URI or by path, or iterated
+    over in URI order. Writes are committed every commit_size entries
+    and when the store is closed.
+    """
+    def __init__(self, filename, commit_size=COMMITSIZE):
+        """
+        Open (or create) a metadata store.
+        """
+        self.filename = filename
+        self.commit_size = commit_size
+        self._lock = threading.RLock()
+        self._uncommitted = 0
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS metadata ("
+                         + "uri TEXT PRIMARY KEY, path TEXT, metadata BLOB, "
+                         + "modified REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS metadata_path "
+                         + "ON metadata (path)")
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Commit any outstanding writes and close the store."""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def commit(self):
+        """Commit any outstanding writes."""
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def put(self, uri, path, metadata, modified=None):
+        """
+        Store the metadata (bytes) for a URI and its content path. The
+        modification time defaults to now.
+        """
+        if modified is None:
+            modified = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO metadata "
+                             + "(uri, path, metadata, modified) "
+                             + "VALUES (?, ?, ?, ?)",
+                             (uri, path, sqlite3.Binary(metadata), modified))
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_size:
+                self.commit()
+
+    def get(self, uri):
+        """Get the metadata for a URI, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT metadata FROM metadata "
+                                   + "WHERE uri = ?", (uri,)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def modified(self, uri):
+        """
+        Get the time (in seconds since the epoch) the metadata for a URI
+        was last stored, or None.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT modified FROM metadata "
+                                   + "WHERE uri = ?", (uri,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_path(self, path):
+        """Get a (uri, metadata) tuple for a content path, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT uri, metadata FROM metadata "
+                                   + "WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        return (row[0], bytes(row[1]))
+
+    def paths(self):
+        """Iterate over (uri, path) tuples in URI order."""
+        return self._iterate("SELECT uri, path FROM metadata ORDER BY uri")
+
+    def items(self):
+        """Iterate over (uri, path, metadata) tuples in URI order."""
+        for uri, path, metadata in self._iterate(
+                "SELECT uri, path, metadata FROM metadata ORDER BY uri"):
+            yield (uri, path, bytes(metadata))
+
+    def delete(self, uri):
+        """Remove the entry for a URI."""
+        with self._lock:
+            self._db.execute("DELETE FROM metadata WHERE uri = ?", (uri,))
+            self._uncommitted += 1
+
+    def count(self):
+        """Return the number of entries in the store."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM metadata") \
+                       .fetchone()[0]
+
+    def _iterate(self, query, size=COMMITSIZE):
+        """Internal method to iterate over a query a page at a time."""
+        with self._lock:
+            cursor = self._db.cursor()
+            cursor.execute(query)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(size)
+            if not rows:
+                return
+            for row in rows:
+                yield row
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Fake connections and responses for the tests that run without a server.
+"""
+
+import json
+import threading
+from urllib.parse import urlparse, parse_qs
+from requests.exceptions import ConnectionError
+
+BOUNDARY = "TEST_BOUNDARY"
+
+class FakeResponse:
+    """
+    A response with a text body or a multipart body. The multipart
+    body is returned in chunks of chunk_size bytes (all at once if
+    chunk_size is None); if fail_after is set, the connection is reset
+    after that many bytes.
+    """
+    def __init__(self, status_code=200, text="", body=b"", chunk_size=None,
+                 fail_after=None):
+        self.status_code = status_code
+        self.text = text
+        self.body = body
+        self.chunk_size = chunk_size
+        self.fail_after = fail_after
+        self.headers = {}
+        if body:
+            self.headers['content-type'] = ("multipart/mixed; boundary="
+                                            + BOUNDARY)
+
+    def iter_content(self, chunk_size):
+        size = self.chunk_size or max(len(self.body), 1)
+        for pos in range(0, len(self.body), size):
+            if self.fail_after is not None and pos >= self.fail_after:
+                raise ConnectionError("connection reset")
+            yield self.body[pos:pos + size]
+
+    def close(self):
+        pass
+
+def json_response(data, status_code=200):
+    """A response with a JSON body."""
+    return FakeResponse(status_code, text=json.dumps(data))
+
+def multipart_body(parts):
+    """
+    Format a multipart body. Each part is a (headers, content) tuple,
+    where headers is a list of (name, value) tuples.
+    """
+    body = ""
+    for headers, content in parts:
+        body += "--" + BOUNDARY + "\r\n"
+        for name, value in headers:
+            body += name + ": " + value + "\r\n"
+        body += "\r\n" + content + "\r\n"
+    body += "--" + BOUNDARY + "--\r\n"
+    return body.encode('utf-8')
+
+def eval_response(value):
+    """A v1/eval or v1/invoke response with one result."""
+    if isinstance(value, bool):
+        part = ([("Content-Type", "text/plain"), ("X-Primitive", "boolean")],
+                "true" if value else "false")
+    else:
+        part = ([("Content-Type", "application/json"),
+                 ("X-Primitive", "map")], json.dumps(value))
+    return FakeResponse(body=multipart_body([part]))
+
+class FakeConnection:
+    """
+    A connection to localhost that builds URIs the way Connection does.
+    Subclasses answer the requests their tests make; record() keeps the
+    query parameters of each one in requests.
+    """
+    def __init__(self):
+        self.host = "localhost"
+        self.port = 8000
+        self.management_port = 8002
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def uri(self, relation, name=None, properties="/properties",
+            parameters=None):
+        if name is None:
+            name = ""
+        else:
+            name = "/" + name
+            if properties is not None:
+                name = name + properties
+        uri = "http://{0}:{1}/manage/v2/{2}{3}" \
+              .format(self.host, self.management_port, relation, name)
+        if parameters is not None:
+            uri = uri + "?" + "&".join(parameters)
+        return uri
+
+    def client_uri(self, path):
+        return "http://{0}:{1}/v1/{2}".format(self.host, self.port, path)
+
+    def record(self, uri):
+        """Record a request and return its query parameters."""
+        params = parse_qs(urlparse(uri).query)
+        with self.lock:
+            self.requests.append(params)
+        return params
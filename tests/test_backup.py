@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+from requests.exceptions import ConnectionError
+from marklogic.models.database.backup import BackupScheduler
+from fakes import FakeConnection, json_response
+
+class DatabaseConnection(FakeConnection):
+    """
+    Databases have no forests; reading a database whose name starts
+    with "unreachable" fails.
+    """
+    def get(self, uri):
+        if "/unreachable" in uri:
+            raise ConnectionError("connection refused")
+        return json_response({"forest": []})
+
+class FakeJob:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def status(self, connection):
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return status
+
+class TestSchedulerErrors(TestCase):
+    def schedule(self, jobs):
+        scheduler = BackupScheduler(DatabaseConnection(), min_poll=0.01,
+                                    max_poll=0.05)
+        futures = {}
+        for name, statuses in jobs:
+            def start(connection, statuses=statuses):
+                if isinstance(statuses, Exception):
+                    raise statuses
+                return FakeJob(statuses)
+            futures[name] = scheduler._submit("backup", name, "/backups",
+                                              None, start)
+        scheduler.wait()
+        return futures
+
+    def test_unreachable(self):
+        futures = self.schedule([
+            ("unreachable", [{"status": "completed"}]),
+            ("Documents", [{"status": "in-progress"},
+                           {"status": "completed"}])])
+        assert isinstance(futures["unreachable"].exception(), ConnectionError)
+        assert isinstance(futures["Documents"].result(), FakeJob)
+
+    def test_start_and_status_errors(self):
+        futures = self.schedule([
+            ("start", ValueError("start failed")),
+            ("status", [{"status": "in-progress"},
+                        ConnectionError("connection reset")]),
+            ("garbled", [["not", "a", "status"]]),
+            ("Documents", [{"status": "completed"}])])
+        assert isinstance(futures["start"].exception(), ValueError)
+        assert isinstance(futures["status"].exception(), ConnectionError)
+        assert futures["garbled"].exception() is not None
+        assert futures["Documents"].exception() is None
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+from unittest import TestCase
+import marklogic
+from marklogic import MarkLogic
+from marklogic.connection import Connection
+from marklogic.models.cluster import LocalCluster
+from marklogic.models.host import Host
+
+RESTART = 0.1
+
+class Recorder:
+    """Records the steps of a cluster handshake, with timings."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.active = 0
+        self.most_active = 0
+
+    def event(self, name, host):
+        with self.lock:
+            self.events.append((name, host, time.time()))
+
+    def times(self, name):
+        return dict([(host, when) for event, host, when in self.events
+                     if event == name])
+
+class FakeHost(Host):
+    """A host whose handshake steps take a restart's time offline."""
+    def __init__(self, name, recorder, fail=False):
+        Host.__init__(self, name)
+        self.recorder = recorder
+        self.fail = fail
+
+    def _get_server_config(self):
+        self.recorder.event("get-config", self.host_name())
+        return "<config host='{0}'/>".format(self.host_name())
+
+    def _post_cluster_config(self, cfgzip, connection):
+        if self.fail:
+            raise RuntimeError("{0} refused".format(self.host_name()))
+        assert self.host_name() == connection.host
+        time.sleep(RESTART)
+        self.recorder.event("joined", self.host_name())
+
+class FakeCluster(LocalCluster):
+    recorder = None
+
+    def _post_server_config(self, xml, connection):
+        recorder = self.recorder
+        with recorder.lock:
+            recorder.active += 1
+            recorder.most_active = max(recorder.most_active,
+                                       recorder.active)
+        time.sleep(0.01)
+        with recorder.lock:
+            recorder.active -= 1
+        return xml.encode('utf-8')
+
+class TestAddHosts(TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        FakeCluster.recorder = self.recorder
+        self.cluster = FakeCluster(connection=Connection("boot", None))
+
+    def test_add_hosts(self):
+        hosts = [FakeHost("host{0}".format(i), self.recorder)
+                 for i in range(6)]
+        start = time.time()
+        added = self.cluster.add_hosts(hosts, concurrency=6)
+        elapsed = time.time() - start
+        assert hosts == added
+        assert sorted([host.host_name() for host in hosts]) \
+            == sorted(self.recorder.times("joined"))
+        # The restarts overlap, the bootstrap host step doesn't
+        assert elapsed < RESTART * 3
+        assert 1 == self.recorder.most_active
+
+    def test_host_names(self):
+        self.cluster._join = lambda host, connection, lock=None: host
+        added = self.cluster.add_hosts(["a", "b"])
+        assert ["a", "b"] == added
+
+    def test_failure(self):
+        hosts = [FakeHost("good", self.recorder),
+                 FakeHost("bad", self.recorder, fail=True)]
+        with self.assertRaises(RuntimeError):
+            self.cluster.add_hosts(hosts)
+
+class FakeMarkLogic(MarkLogic):
+    """Initializes hosts offline; the bootstrap host is new."""
+    recorder = None
+    initialized = set()
+
+    @classmethod
+    def _init_or_lookup(cls, host):
+        time.sleep(RESTART)
+        cls.recorder.event("init", host)
+        if host in cls.initialized:
+            return Host(host)
+        return Host(host)._set_just_initialized()
+
+    @classmethod
+    def instance_admin(cls, host, realm, admin, password,
+                       wallet_password=None):
+        time.sleep(RESTART)
+        cls.recorder.event("admin", host)
+
+class JoinCluster(LocalCluster):
+    recorder = None
+
+    def _join(self, host, connection, lock=None):
+        assert lock is not None
+        self.recorder.event("join", host)
+        return Host(host)
+
+class FailingCluster(LocalCluster):
+    def _join(self, host, connection, lock=None):
+        raise RuntimeError("{0} refused".format(host))
+
+class TestBootstrapCluster(TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        FakeMarkLogic.recorder = self.recorder
+        JoinCluster.recorder = self.recorder
+        self.saved = marklogic.LocalCluster
+        marklogic.LocalCluster = JoinCluster
+
+    def tearDown(self):
+        marklogic.LocalCluster = self.saved
+
+    def bootstrap(self, hosts):
+        return FakeMarkLogic.bootstrap_cluster("boot", hosts, "public",
+                                               "admin", "secret")
+
+    def test_bootstrap(self):
+        FakeMarkLogic.initialized = set()
+        hosts = ["host{0}".format(i) for i in range(5)]
+        start = time.time()
+        result = self.bootstrap(hosts)
+        elapsed = time.time() - start
+        assert isinstance(result, MarkLogic)
+        assert "boot" == result.connection.host
+
+        inits = self.recorder.times("init")
+        admin = self.recorder.times("admin")
+        joins = self.recorder.times("join")
+        assert ["boot"] + hosts == sorted(inits)
+        assert ["boot"] == list(admin)
+        assert hosts == sorted(joins)
+        # Every host joins after the bootstrap host's security is
+        # installed, and the hosts are initialized at the same time
+        for host in hosts:
+            assert joins[host] >= admin["boot"]
+        assert elapsed < RESTART * 4
+
+    def test_already_initialized(self):
+        FakeMarkLogic.initialized = {"boot"}
+        self.bootstrap(["host0"])
+        assert {} == self.recorder.times("admin")
+        assert ["host0"] == list(self.recorder.times("join"))
+
+    def test_initialized(self):
+        # Hosts are reported as soon as they are initialized, even if
+        # joining the cluster fails later
+        FakeMarkLogic.initialized = set()
+        reported = []
+        marklogic.LocalCluster = FailingCluster
+        with self.assertRaises(RuntimeError):
+            FakeMarkLogic.bootstrap_cluster(
+                "boot", ["host0", "host1"], "public", "admin", "secret",
+                initialized=reported.append)
+        assert ["boot", "host0", "host1"] == sorted(reported)
@@ -22,9 +22,11 @@ from __future__ import unicode_literals, print_function, absolute_import
 # Norman Walsh      02/11/2016     Initial tests
 #
 
+import hashlib
+import json
 from mlconfig import MLConfig
 from marklogic.models import Host
-from marklogic.client import Transactions, Documents, ClientUtils
+from marklogic.client import Transactions, Documents, ClientUtils, Eval
 from marklogic.exceptions import UnexpectedManagementAPIResponse
 
 class TestClient(MLConfig):
@@ -131,3 +133,128 @@ class TestClient(MLConfig):
         assert 200 == resp.status_code
 
         docs.delete()
+
+    def test_doc_metadata_formats(self):
+        """
+        Generate XML and JSON metadata.
+        """
+        docs = Documents(self.connection)
+
+        docs.set_quality(2)
+        docs.set_collections(["a&b", "c"])
+        docs.add_permission("rest-reader", "read")
+        docs.add_permission("rest-reader", "update")
+
+        meta = docs.metadata()
+        assert "application/xml" == docs.metadata_content_type()
+        assert b"<rapi:collection>a&amp;b</rapi:collection>" in meta
+        assert meta is docs.metadata()
+
+        docs.set_metadata_format("json")
+        assert "application/json" == docs.metadata_content_type()
+        assert {"quality": 2, "collections": ["a&b", "c"],
+                "permissions": [{"role-name": "rest-reader",
+                                 "capabilities": ["read", "update"]}]} \
+                == json.loads(docs.metadata().decode('utf-8'))
+
+    def test_eval_results(self):
+        """
+        Decode typed eval results.
+        """
+        mleval = Eval(self.connection)
+        mleval.set_xquery('(1, "two", 3.5, true(), object-node { "a": 1 })')
+
+        assert [1, "two", 3.5, True, {"a": 1}] == list(mleval.results())
+
+        mleval.clear()
+        mleval.set_xquery('string-join(("a", "b", "c"), "&#10;")')
+        assert ["a", "b", "c"] == list(mleval.results(encoding="lines"))
+
+        mleval.clear()
+        mleval.set_xquery('array-node { 1, "two", 3.5 }')
+        assert [1, "two", 3.5] == list(mleval.results(encoding="json"))
+
+    def test_iter_uris(self):
+        """
+        Page through the URI lexicon.
+        """
+        docs = Documents(self.connection)
+        docs.set_database("Documents")
+        docs.set_content_type("application/json")
+
+        expected = []
+        for count in range(0, 5):
+            uri = "/iter-uris/doc{}.json".format(count)
+            expected.append(uri)
+            docs.put({"count": count}, uri)
+
+        utils = ClientUtils(self.connection)
+        uris = list(utils.iter_uris("Documents", prefix="/iter-uris/",
+                                    page_size=2))
+
+        for uri in expected:
+            docs.delete(uri)
+
+        assert expected == uris
+
+    def test_content_hashes(self):
+        """
+        Compare server content hashes with local ones.
+        """
+        docs = Documents(self.connection)
+        docs.set_database("Documents")
+        docs.set_content_type("text/plain")
+        docs.put("Hello, world.", "/content-hash/hello.txt")
+
+        utils = ClientUtils(self.connection)
+        hashes = utils.content_hashes("Documents",
+                                      ["/content-hash/hello.txt",
+                                       "/content-hash/missing.txt"])
+
+        docs.delete("/content-hash/hello.txt")
+
+        assert {"/content-hash/hello.txt": hashlib.md5(b"Hello, world.")
+                .hexdigest()} == hashes
+
+    def test_eval_cached(self):
+        """
+        Evaluate code through a cached module.
+        """
+        mleval = Eval(self.connection)
+        mleval.set_xquery('declare variable $x external; $x + 1')
+        mleval.set_cached()
+
+        for value in range(0, 3):
+            mleval.set_var("x", value)
+            assert [value + 1] == list(mleval.results())
+
+        assert 1 == mleval.uninstall_modules()
+
+    def test_tx_context(self):
+        """
+        Commit and roll back transactions with a context manager.
+        """
+        docs = Documents(self.connection)
+        docs.set_database("Documents")
+        docs.set_uri("/path/hello.json")
+        docs.delete()
+
+        try:
+            with Transactions(self.connection).set_database("Documents") as trans:
+                tdocs = trans.documents()
+                tdocs.set_content_type("application/json")
+                tdocs.put({"message": "Hello World"}, "/path/hello.json")
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+
+        assert 404 == docs.get().status_code
+
+        with Transactions(self.connection).set_database("Documents") as trans:
+            tdocs = trans.documents()
+            tdocs.set_content_type("application/json")
+            tdocs.put({"message": "Hello World"}, "/path/hello.json")
+
+        assert 200 == docs.get().status_code
+
+        docs.delete()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from unittest import TestCase
+from marklogic.client.clientutils import ClientUtils, split_points
+from fakes import FakeConnection, eval_response
+
+class StampConnection(FakeConnection):
+    """
+    Answers v1/eval requests for a $uris variable with a JSON object
+    that has a last-modified time for every URI that doesn't end in
+    ".bin".
+    """
+    def __init__(self):
+        FakeConnection.__init__(self)
+        self.chunks = []
+
+    def post(self, uri, payload=None, content_type=None, accept=None,
+             stream=False):
+        uris = json.loads(json.loads(payload['vars'])['uris'])
+        with self.lock:
+            self.chunks.append(uris)
+        stamps = {}
+        for name in uris:
+            if not name.endswith(".bin"):
+                stamps[name] = "2016-01-01T00:00:00Z" + name
+        return eval_response(stamps)
+
+def _uris(count):
+    return ["/doc{0:03d}{1}".format(i, ".bin" if i % 5 == 0 else ".xml")
+            for i in range(count)]
+
+class TestLastModified(TestCase):
+    def test_dict(self):
+        connection = StampConnection()
+        uris = _uris(53)
+        stamps = ClientUtils(connection).last_modified(
+            "Documents", uris, chunk_size=10, concurrency=3)
+        assert isinstance(stamps, dict)
+        assert [uri for uri in uris if not uri.endswith(".bin")] \
+            == sorted(stamps)
+        for uri in stamps:
+            assert "2016-01-01T00:00:00Z" + uri == stamps[uri]
+        assert 6 == len(connection.chunks)
+        assert 10 == max([len(chunk) for chunk in connection.chunks])
+
+    def test_ordered(self):
+        connection = StampConnection()
+        uris = _uris(25)
+        stamps = list(ClientUtils(connection).iter_last_modified(
+            "Documents", iter(uris), chunk_size=4, concurrency=4,
+            ordered=True))
+        assert uris == [uri for uri, stamp in stamps]
+        for uri, stamp in stamps:
+            if uri.endswith(".bin"):
+                assert stamp is None
+            else:
+                assert stamp is not None
+
+    def test_empty(self):
+        connection = StampConnection()
+        assert {} == ClientUtils(connection).last_modified("Documents", [])
+        assert [] == connection.chunks
+
+class TestSplitPoints(TestCase):
+    def test_even(self):
+        sample = ["/doc{0:02d}".format(i) for i in range(100)]
+        assert ["/doc25", "/doc50", "/doc75"] == split_points(sample, 4)
+
+    def test_unsorted_duplicates(self):
+        sample = ["/c", "/a", "/b", "/a", "/d"]
+        assert ["/b", "/c"] == split_points(sample, 3)
+
+    def test_small_sample(self):
+        # Fewer points than asked for, never the first URI, no repeats
+        assert ["/b"] == split_points(["/a", "/b"], 8)
+        assert [] == split_points(["/a"], 4)
+        assert [] == split_points([], 4)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+from unittest import TestCase
+from marklogic.utilities.concurrency import imap, chunks
+
+class TestImap(TestCase):
+    def test_ordered(self):
+        # Later items finish first; ordered results follow the items
+        def slow(item):
+            time.sleep((10 - item) * 0.005)
+            return item * 2
+        assert [item * 2 for item in range(10)] \
+            == list(imap(slow, range(10), concurrency=4, ordered=True))
+
+    def test_unordered(self):
+        def slow(item):
+            time.sleep((10 - item) * 0.005)
+            return item
+        results = list(imap(slow, range(10), concurrency=10))
+        assert list(range(10)) == sorted(results)
+        assert list(range(10)) != results
+
+    def test_bounded(self):
+        # No more than concurrency calls are in flight at once
+        lock = threading.Lock()
+        state = {'running': 0, 'most': 0}
+        def call(item):
+            with lock:
+                state['running'] += 1
+                state['most'] = max(state['most'], state['running'])
+            time.sleep(0.002)
+            with lock:
+                state['running'] -= 1
+            return item
+        assert 50 == len(list(imap(call, range(50), concurrency=3)))
+        assert state['most'] <= 3
+
+    def test_lazy(self):
+        # Items are consumed as calls complete, not all up front
+        consumed = []
+        def items():
+            for item in range(100):
+                consumed.append(item)
+                yield item
+        results = imap(lambda item: item, items(), concurrency=2,
+                       ordered=True)
+        assert 0 == next(results)
+        assert len(consumed) < 10
+        results.close()
+
+    def test_exception(self):
+        def fail(item):
+            if item == 3:
+                raise ValueError("item 3")
+            return item
+        results = imap(fail, range(10), concurrency=2, ordered=True)
+        assert [0, 1, 2] == [next(results) for _ in range(3)]
+        with self.assertRaises(ValueError):
+            next(results)
+
+    def test_empty(self):
+        assert [] == list(imap(lambda item: item, [], concurrency=4))
+
+class TestChunks(TestCase):
+    def test_chunks(self):
+        assert [[0, 1, 2], [3, 4, 5], [6]] == list(chunks(range(7), 3))
+        assert [[0, 1, 2], [3, 4, 5]] == list(chunks(range(6), 3))
+        assert [[0], [1]] == list(chunks(iter([0, 1]), 1))
+
+    def test_empty(self):
+        assert [] == list(chunks([], 3))
@@ -23,6 +23,7 @@
 
 from mlconfig import MLConfig
 from marklogic.models import Database, Host, Forest
+from marklogic.models.database.index import ElementRangeIndex
 from marklogic.exceptions import UnexpectedManagementAPIResponse
 
 class TestDbDatabase(MLConfig):
@@ -122,3 +123,60 @@ class TestDbDatabase(MLConfig):
             #self.assertEqual(ds.large_data_directory, forest.large_data_directory())
         finally:
             db.delete(connection=self.connection)
+
+    def test_wait_for_reindex(self):
+        hosts = Host.list(self.connection)
+        db = Database("reindex-wait-test-db", hosts[0],
+                      connection=self.connection)
+
+        db.set_forest_names(["reindex-wait-forest1", "reindex-wait-forest2"])
+
+        db.create()
+
+        db = Database.lookup(self.connection, "reindex-wait-test-db")
+        try:
+            status = db.reindex(connection=self.connection).wait(timeout=300)
+            assert status['done']
+            assert 100.0 == status['percent']
+            assert 2 == len(status['forests'])
+
+            status = db.merge(connection=self.connection).wait(timeout=300)
+            assert status['done']
+        finally:
+            db.delete(connection=self.connection)
+
+    def test_preview_update(self):
+        hosts = Host.list(self.connection)
+        db = Database("reindex-preview-test-db", hosts[0],
+                      connection=self.connection)
+
+        db.set_forest_names(["reindex-preview-forest1"])
+
+        db.create()
+
+        db = Database.lookup(self.connection, "reindex-preview-test-db")
+        try:
+            db.set_word_positions(not db.word_positions())
+            db.set_in_memory_limit(db.in_memory_limit() + 1)
+            db.add_index(ElementRangeIndex("string", "", "title"))
+
+            preview = db.preview_update(connection=self.connection)
+            changes = {}
+            for change in preview.changes():
+                changes[change['property']] = change['reindex']
+            assert changes['word-positions']
+            assert changes['range-element-index']
+            assert not changes['in-memory-limit']
+
+            estimates = preview.estimate()
+            assert ["reindex-preview-forest1"] == list(estimates.keys())
+
+            status = preview.apply(throttle=1).wait(timeout=300)
+            assert status['done']
+            preview.restore_throttle()
+
+            db = Database.lookup(self.connection, "reindex-preview-test-db")
+            assert db.preview_update(self.connection).changes() == []
+            assert 5 == db.reindexer_throttle()
+        finally:
+            db.delete(connection=self.connection)
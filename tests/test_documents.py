@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+from requests.exceptions import ConnectionError
+from marklogic.client.documents import Documents
+from fakes import FakeConnection, FakeResponse, multipart_body
+
+class DocumentsConnection(FakeConnection):
+    """
+    Answers multi-URI GETs on v1/documents with a multipart body that
+    has one text document per URI.
+    """
+    def __init__(self, failures=0):
+        FakeConnection.__init__(self)
+        self.failures = failures
+
+    def get(self, uri, accept=None, stream=False):
+        params = self.record(uri)
+        with self.lock:
+            fail = self.failures > 0
+            self.failures -= 1
+        parts = []
+        for name in params['uri']:
+            parts.append(([("Content-Type", "text/plain"),
+                           ("Content-Disposition", "attachment; filename=\""
+                            + name + "\"; category=content")],
+                          "content of " + name))
+        body = multipart_body(parts)
+        if fail:
+            return FakeResponse(body=body, chunk_size=7,
+                                fail_after=len(body) // 2)
+        return FakeResponse(body=body, chunk_size=7)
+
+def _uris(count):
+    return ["/doc{0:04d}.txt".format(i) for i in range(count)]
+
+class TestReadMany(TestCase):
+    def read(self, connection, uris, **kwargs):
+        docs = Documents(connection)
+        docs.set_database("Documents")
+        docs.set_category("content")
+        return list(docs.read_many(uris, **kwargs))
+
+    def test_ordered(self):
+        connection = DocumentsConnection()
+        uris = _uris(95)
+        results = self.read(connection, uris, batch_size=10, concurrency=4,
+                            ordered=True)
+        assert uris == [result[0] for result in results]
+        assert 10 == len(connection.requests)
+        for uri, meta, content, content_type in results:
+            assert ("content of " + uri).encode('utf-8') == content
+            assert "text/plain" == content_type
+
+    def test_unordered(self):
+        connection = DocumentsConnection()
+        uris = _uris(95)
+        results = self.read(connection, uris, batch_size=7, concurrency=3)
+        assert sorted(uris) == sorted([result[0] for result in results])
+
+    def test_timestamp(self):
+        connection = DocumentsConnection()
+        self.read(connection, _uris(30), batch_size=10, timestamp=12345)
+        for params in connection.requests:
+            assert ["12345"] == params['timestamp']
+            assert ["Documents"] == params['database']
+
+    def test_retry(self):
+        # The first request fails half way through; the retry must not
+        # yield the documents that were already yielded again
+        connection = DocumentsConnection(failures=1)
+        uris = _uris(20)
+        results = self.read(connection, uris, batch_size=20, concurrency=1)
+        assert uris == [result[0] for result in results]
+        assert 2 == len(connection.requests)
+
+    def test_retries_exhausted(self):
+        connection = DocumentsConnection(failures=10)
+        with self.assertRaises(ConnectionError):
+            self.read(connection, _uris(20), batch_size=20, retries=1)
+
+    def test_streamed(self):
+        # The first document is available before the batch has been read
+        connection = DocumentsConnection()
+        docs = Documents(connection)
+        results = docs.read_many(_uris(50), batch_size=50, concurrency=1)
+        first = next(results)
+        assert "/doc0000.txt" == first[0]
+        results.close()
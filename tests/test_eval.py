@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from unittest import TestCase
+from marklogic.client import eval as mleval_module
+from marklogic.client.eval import Eval
+from marklogic.exceptions import UnexpectedManagementAPIResponse
+from fakes import FakeConnection, FakeResponse, eval_response
+
+class ModulesConnection(FakeConnection):
+    """
+    An app server with a modules database. Evaluating or invoking code
+    returns its variables. A missing module is reported with a 404, or
+    with a 500 if status is 500.
+    """
+    def __init__(self, status=404):
+        FakeConnection.__init__(self)
+        self.status = status
+        self.modules = {}
+        self.endpoints = []
+
+    def post(self, uri, payload=None, content_type=None, accept=None,
+             stream=False):
+        endpoint = uri.split("/")[-1]
+        self.endpoints.append(endpoint)
+        if endpoint == "eval" and "modules-database" in payload['xquery']:
+            return eval_response("Modules")
+        if endpoint == "invoke" and payload['module'] not in self.modules:
+            message = ("XDMP-MODNOTFOUND: Module {0} not found"
+                       .format(payload['module']))
+            if self.status != 404:
+                raise UnexpectedManagementAPIResponse(message)
+            return FakeResponse(404, text=message)
+        return eval_response(json.loads(payload['vars']))
+
+    def put(self, uri, payload=None, content_type=None, accept=None):
+        params = self.record(uri)
+        assert ["Modules"] == params['database']
+        self.modules[params['uri'][0]] = payload
+        return FakeResponse(201)
+
+class TestCachedEval(TestCase):
+    def setUp(self):
+        mleval_module._MODULES.clear()
+        mleval_module._MODULES_DATABASES.clear()
+
+    def run_eval(self, connection, value):
+        mleval = Eval(connection)
+        mleval.set_xquery("xquery version '1.0-ml'; "
+                          + "declare variable $value external; $value")
+        mleval.set_var("value", value)
+        mleval.set_cached()
+        return list(mleval.results())
+
+    def check_reinstall(self, connection):
+        assert [{"value": "a"}] == self.run_eval(connection, "a")
+        assert 1 == len(connection.modules)
+
+        # Delete the cached module behind the registry's back
+        connection.modules.clear()
+        connection.endpoints = []
+        assert [{"value": "b"}] == self.run_eval(connection, "b")
+        assert 1 == len(connection.modules)
+        assert ["invoke", "invoke"] == connection.endpoints
+
+    def test_reinstall_404(self):
+        self.check_reinstall(ModulesConnection(status=404))
+
+    def test_reinstall_500(self):
+        self.check_reinstall(ModulesConnection(status=500))
+
+    def test_installed_once(self):
+        connection = ModulesConnection()
+        for value in range(5):
+            assert [{"value": value}] == self.run_eval(connection, value)
+        assert 1 == len(connection.modules)
+        assert 1 == connection.endpoints.count("eval")
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import re
+import shutil
+import tempfile
+from unittest import TestCase
+from marklogic.utilities import files
+from marklogic.utilities.files import compile_patterns, walk_files
+
+def _make_tree(root, paths):
+    for path in paths:
+        filename = root + path
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as data:
+            data.write(path)
+
+TREE = ["/a.xml", "/b.json", "/sub/c.xml", "/sub/deep/d.txt",
+        "/sub/deep/e.xml", "/other/f.xml", "/other/.hidden",
+        "/third/g.bin"]
+
+class TestCompilePatterns(TestCase):
+    def test_compile(self):
+        assert [] == compile_patterns(None)
+        assert [] == compile_patterns([])
+        patterns = compile_patterns(r".*\.xml$")
+        assert 1 == len(patterns)
+        assert patterns[0].match("/a.xml")
+
+    def test_mixed(self):
+        compiled = re.compile("/sub/")
+        patterns = compile_patterns([compiled, ".*json$"])
+        assert compiled is patterns[0]
+        assert patterns[1].match("/b.json")
+        assert compile_patterns(compiled)[0] is compiled
+
+class TestWalkFiles(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def walk(self, **kwargs):
+        return sorted([path for path, entry
+                       in walk_files(self.dir, **kwargs)])
+
+    def test_walk(self):
+        _make_tree(self.dir, TREE)
+        assert sorted(TREE) == self.walk()
+        for path, entry in walk_files(self.dir):
+            assert self.dir + path == entry.path
+            assert entry.is_file()
+
+    def test_include_exclude(self):
+        _make_tree(self.dir, TREE)
+        xml = [path for path in TREE if path.endswith(".xml")]
+        assert sorted(xml) == self.walk(include=r".*\.xml$")
+        # Patterns are matched against the whole relative path
+        assert ["/sub/c.xml", "/sub/deep/e.xml"] \
+            == self.walk(include="/sub/.*xml$")
+        assert [] == self.walk(include="xml")
+        assert sorted([path for path in TREE if not path.startswith("/sub/")]) \
+            == self.walk(exclude=["/sub/"])
+        assert ["/a.xml", "/other/f.xml", "/third/g.bin"] \
+            == self.walk(include=[r".*\.xml$", r".*\.bin$"],
+                         exclude="/sub/")
+
+    def test_threads(self):
+        _make_tree(self.dir, TREE)
+        for threads in [2, 3, 8]:
+            assert sorted(TREE) == self.walk(threads=threads)
+        assert ["/other/.hidden"] == self.walk(include=r".*/\.",
+                                               threads=4)
+
+    def test_parallel_batches(self):
+        paths = ["/dir{0}/file{1:03d}".format(d, f)
+                 for d in range(5) for f in range(30)]
+        _make_tree(self.dir, paths)
+        subdirs = ["/dir{0}".format(d) for d in range(5)]
+        walked = [path for path, entry
+                  in files._walk_parallel(self.dir, subdirs, [], [], 3,
+                                          batch_size=7)]
+        assert sorted(paths) == sorted(walked)
+        assert len(paths) == len(walked)
+
+    def test_parallel_error(self):
+        _make_tree(self.dir, ["/dir/a.xml"])
+        with self.assertRaises(OSError):
+            list(files._walk_parallel(self.dir, ["/dir", "/missing"],
+                                      [], [], 2))
+
+    def test_parallel_early_close(self):
+        paths = ["/dir{0}/file{1:03d}".format(d, f)
+                 for d in range(4) for f in range(100)]
+        _make_tree(self.dir, paths)
+        subdirs = ["/dir{0}".format(d) for d in range(4)]
+        walked = files._walk_parallel(self.dir, subdirs, [], [], 4,
+                                      batch_size=1)
+        next(walked)
+        # Closing the generator stops and joins the workers
+        walked.close()
+
+    def test_empty(self):
+        assert [] == self.walk()
+        assert [] == self.walk(threads=4)
+        os.makedirs(self.dir + "/empty")
+        assert [] == self.walk(threads=4)
+
+    def test_walk_directories(self):
+        _make_tree(self.dir, ["/a.xml", "/sub/b.xml"])
+        found = files.walk_directories(self.dir)
+        assert ["a.xml", "b.xml"] == sorted([item['filename']
+                                             for item in found])
+
+    def test_ordered(self):
+        # "/a-b" sorts between "/a" and "/a/..." by code point; a name
+        # that sorts between a directory and its contents is placed
+        # correctly too
+        paths = ["/a-b.xml", "/a/b.xml", "/a/c/d.xml", "/a.xml", "/a0",
+                 "/B.xml", "/b.xml", "/é.xml", "/a/b/c.xml"]
+        _make_tree(self.dir, paths)
+        walked = [path for path, entry in walk_files(self.dir, ordered=True)]
+        assert sorted(paths) == walked
+
+    def test_ordered_exclude(self):
+        _make_tree(self.dir, ["/a.xml", "/.private", "/sub/.private",
+                              "/sub/b.xml"])
+        walked = [path for path, entry
+                  in walk_files(self.dir, exclude=r".*/\.private$",
+                                ordered=True)]
+        assert ["/a.xml", "/sub/b.xml"] == walked
+
+    def test_ordered_empty(self):
+        os.makedirs(self.dir + "/empty/nested")
+        assert [] == list(walk_files(self.dir, ordered=True))
@@ -22,9 +22,18 @@
 
 from mlconfig import MLConfig
 from marklogic.models import Host
+from marklogic.models.logfollower import LogFollower
 
 class TestHost(MLConfig):
     def test_list_hosts(self):
         hosts = Host.list(self.connection)
         assert len(hosts) > 0
         assert hosts
+
+    def test_log_follower(self):
+        follower = LogFollower(self.connection)
+        events = follower.poll()
+        assert len(events) > 0
+        stamps = [event['timestamp'] for event in events]
+        assert stamps == sorted(stamps)
+        assert len(follower.offsets) == len(Host.list(self.connection))
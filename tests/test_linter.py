@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from mlconfig import MLConfig
+from marklogic.models.database import Database
+from marklogic.models.database.index import ElementRangeIndex
+from marklogic.models.linter import ConfigLinter, snapshot
+
+class TestLinter(MLConfig):
+    def test_lint_database(self):
+        database = Database("lint-test-db")
+        database.set_word_positions(True)
+        database.add_index(ElementRangeIndex("string", "", "title"))
+        database.add_index(ElementRangeIndex("string", "", "title"))
+
+        linter = ConfigLinter(usage=["wildcard"])
+        findings = linter.lint(database)
+        rules = [finding.rule for finding in findings]
+        assert "costly-index" in rules
+        assert "duplicate-range-index" in rules
+
+        for finding in findings:
+            finding.apply(database)
+        assert not database.word_positions()
+        assert len(database.element_range_indexes()) == 1
+        assert linter.lint(database) == []
+
+    def test_lint_snapshot(self):
+        config = json.loads(json.dumps(snapshot(self.connection)))
+        assert len(config['databases']) > 0
+        assert len(config['groups']) > 0
+        for finding in ConfigLinter().lint_snapshot(config):
+            assert finding.kind in ("database", "group", "server")
@@ -20,8 +20,12 @@
 # Norman Walsh      05/01/2015     Initial development
 #
 
+from unittest import TestCase
 from mlconfig import MLConfig
-from marklogic.models.cluster import LocalCluster
+from marklogic.models.cluster import LocalCluster, _copy_groups, _plan_waves
+from marklogic.models.host import Host
+from marklogic.models.forest import Forest
+from marklogic.models.forest.replica import ForestReplica
 
 class TestLocalCluster(MLConfig):
     def test_lookup(self):
@@ -38,3 +42,106 @@ class TestLocalCluster(MLConfig):
         status = cluster.view("status")
         version = status["local-cluster-status"]["version"]
         assert version is not None
+
+    def test_restart_plan(self):
+        cluster = LocalCluster(connection=self.connection)
+        plan = cluster.restart_plan()
+        hosts = [host for wave in plan for host in wave]
+        assert sorted(hosts) == sorted(Host.list(self.connection))
+
+def _forest(name, host, replicas=(), failover=None):
+    """
+    A forest on host with local-disk replicas, a list of (name, host)
+    tuples, and failover hosts if failover is not None.
+    """
+    forest = Forest(name, host=host)
+    for replica_name, replica_host in replicas:
+        forest.add_forest_replica(ForestReplica(replica_name, replica_host))
+    forest.set_failover_enable(failover is not None)
+    if failover is not None:
+        forest.set_failover_host_names(failover)
+    return forest
+
+def _check(waves, groups):
+    """Every forest keeps a copy outside every wave."""
+    for wave in waves:
+        for group in groups:
+            if len(group) > 1:
+                assert not group <= set(wave)
+
+class TestCopyGroups(TestCase):
+    def test_replicas(self):
+        # The replica forests are listed as forests too
+        forests = [_forest("f1", "h1", [("f1-r", "h2")]),
+                   _forest("f1-r", "h2"),
+                   _forest("f2", "h2", [("f2-r1", "h3"), ("f2-r2", "h1")]),
+                   _forest("f2-r1", "h3"),
+                   _forest("f2-r2", "h1")]
+        assert [set(["h1", "h2"]), set(["h1", "h2", "h3"])] \
+            == _copy_groups(forests)
+
+    def test_failover(self):
+        forests = [_forest("f1", "h1", failover=["h2", "h3"]),
+                   _forest("f2", "h2", failover=[])]
+        assert [set(["h1", "h2", "h3"]), set(["h2"])] \
+            == _copy_groups(forests)
+
+    def test_failover_disabled(self):
+        forest = _forest("f1", "h1")
+        forest.set_failover_host_names(["h2"])
+        assert [set(["h1"])] == _copy_groups([forest])
+
+class TestPlanWaves(TestCase):
+    def test_pairs(self):
+        # Each master and its replica are restarted in different waves
+        zones = {"h1": None, "h2": None, "h3": None, "h4": None}
+        groups = [set(["h1", "h2"]), set(["h3", "h4"])]
+        waves = _plan_waves(zones, groups)
+        assert [["h1", "h3"], ["h2", "h4"]] == waves
+        _check(waves, groups)
+
+    def test_ring(self):
+        zones = dict([("h{0}".format(i), None) for i in range(1, 6)])
+        groups = [set(["h{0}".format(i), "h{0}".format(i % 5 + 1)])
+                  for i in range(1, 6)]
+        waves = _plan_waves(zones, groups)
+        assert sorted(zones) == sorted([host for wave in waves
+                                        for host in wave])
+        _check(waves, groups)
+
+    def test_zones(self):
+        # Replicas are spread across zones, so each zone restarts
+        # together, and never with a host in another zone
+        zones = {"a1": "east", "a2": "east", "b1": "west", "b2": "west",
+                 "c1": None}
+        groups = [set(["a1", "b1"]), set(["a2", "b2"]), set(["b1", "c1"])]
+        waves = _plan_waves(zones, groups)
+        assert [["a1", "a2"], ["b1", "b2"], ["c1"]] == waves
+        _check(waves, groups)
+
+    def test_unreplicated(self):
+        # A host with a forest that has no other copy restarts alone
+        zones = {"h1": None, "h2": None, "h3": None}
+        groups = [set(["h1"]), set(["h2", "h3"])]
+        assert [["h1"], ["h2"], ["h3"]] == _plan_waves(zones, groups)
+
+        zones = {"h1": None, "h2": None, "h3": None}
+        assert [["h1"], ["h2", "h3"]] \
+            == _plan_waves(zones, [set(["h1"]), set(["h1", "h2"])])
+
+    def test_max_wave(self):
+        zones = dict([("h{0}".format(i), None) for i in range(1, 8)])
+        waves = _plan_waves(zones, [], max_wave=3)
+        assert [3, 3, 1] == [len(wave) for wave in waves]
+        assert [["h1", "h2", "h3", "h4", "h5", "h6", "h7"]] \
+            == _plan_waves(zones, [])
+
+    def test_failover_disabled(self):
+        # The failover host of f2 doesn't count while failover is
+        # disabled, so h2 holds the only copy of f2 and restarts alone
+        forests = [_forest("f1", "h1", failover=["h2"]),
+                   _forest("f2", "h2")]
+        forests[1].set_failover_host_names(["h1"])
+        zones = {"h1": None, "h2": None}
+        groups = _copy_groups(forests)
+        assert [["h1"], ["h2"]] == _plan_waves(zones, groups)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime
+from unittest import TestCase
+from marklogic.models.logfollower import LogFollower, parse_line
+from fakes import FakeConnection, FakeResponse
+
+LOG = ["2016-05-01 10:00:00.100 Info: Starting",
+       "2016-05-01 10:00:01.200 Debug: Loading",
+       "2016-05-01 10:00:01.300 Warning: Slow",
+       "  in /app.xqy line 3",
+       "2016-05-01 10:00:01.400 Error: Failed",
+       "2016-05-01 10:00:02.500 Info: Done"]
+
+class LogConnection(FakeConnection):
+    """
+    Serves the logs endpoint from a dictionary of host to lines, from
+    the start time (to the second) when one is given.
+    """
+    def __init__(self, logs):
+        FakeConnection.__init__(self)
+        self.logs = logs
+
+    def get(self, uri, accept="application/json"):
+        params = self.record(uri)
+        host = params['host'][0]
+        if host not in self.logs:
+            return FakeResponse(404)
+        lines = self.logs[host]
+        if 'start' in params:
+            start = params['start'][0].replace("T", " ")
+            lines = [line for line in lines
+                     if not line[0].isdigit() or line[:19] >= start]
+        return FakeResponse(200, "\n".join(lines) + "\n")
+
+class TestParseLine(TestCase):
+    def test_error_log(self):
+        assert (datetime(2016, 5, 1, 10, 0, 1, 300000), "Warning", "Slow") \
+            == parse_line("2016-05-01 10:00:01.300 Warning: Slow")
+        assert (datetime(2016, 5, 1, 10, 0, 1), "Info", "Up") \
+            == parse_line("2016-05-01 10:00:01 Info: Up")
+
+    def test_access_log(self):
+        line = ('127.0.0.1 - admin [01/May/2016:10:00:01 +0100] '
+                + '"GET / HTTP/1.1" 200 10 - "curl"')
+        assert (datetime(2016, 5, 1, 10, 0, 1), None, line) \
+            == parse_line(line)
+        assert parse_line('127.0.0.1 - - [yesterday] "GET /"') is None
+
+    def test_continuation(self):
+        assert parse_line("  in /app.xqy line 3") is None
+        assert parse_line("") is None
+
+class TestRead(TestCase):
+    def test_first_read(self):
+        follower = LogFollower(LogConnection({"h1": LOG}), hosts=["h1"])
+        events = follower.poll()
+        assert ["Starting", "Loading", "Slow\n  in /app.xqy line 3",
+                "Failed", "Done"] == [event['message'] for event in events]
+        assert {("h1", "ErrorLog.txt"): ("2016-05-01T10:00:02", 1)} \
+            == follower.offsets
+
+    def test_offset_skip(self):
+        log = list(LOG)
+        connection = LogConnection({"h1": log})
+        follower = LogFollower(connection, hosts=["h1"])
+        follower.poll()
+
+        # Lines logged in the same second as the last one read are
+        # returned again by the server and must be skipped
+        log.append("2016-05-01 10:00:02.600 Info: Same second")
+        log.append("2016-05-01 10:00:03.000 Info: Later")
+        events = follower.poll()
+        assert ["2016-05-01T10:00:02"] == connection.requests[-1]['start']
+        assert ["Same second", "Later"] \
+            == [event['message'] for event in events]
+        assert ("2016-05-01T10:00:03", 1) \
+            == follower.offsets[("h1", "ErrorLog.txt")]
+
+        assert [] == follower.poll()
+
+    def test_offset_count(self):
+        # Two lines were read in the last second; only the third is new
+        connection = LogConnection({"h1": LOG + [
+            "2016-05-01 10:00:02.600 Info: New"]})
+        follower = LogFollower(connection, hosts=["h1"])
+        follower.offsets[("h1", "ErrorLog.txt")] = ("2016-05-01T10:00:01", 2)
+        events = follower.poll()
+        assert ["Failed", "Done", "New"] \
+            == [event['message'] for event in events]
+
+    def test_lines(self):
+        log = list(LOG)
+        follower = LogFollower(LogConnection({"h1": log}), hosts=["h1"],
+                               lines=2)
+        events = follower.poll()
+        assert ["Failed", "Done"] == [event['message'] for event in events]
+
+        # Later reads aren't limited
+        log.extend(["2016-05-01 10:00:03.000 Info: One",
+                    "2016-05-01 10:00:03.100 Info: Two",
+                    "2016-05-01 10:00:03.200 Info: Three"])
+        assert 3 == len(follower.poll())
+
+        follower = LogFollower(LogConnection({"h1": LOG}), hosts=["h1"],
+                               lines=0)
+        assert [] == follower.poll()
+        assert ("2016-05-01T10:00:02", 1) \
+            == follower.offsets[("h1", "ErrorLog.txt")]
+
+    def test_min_level(self):
+        connection = LogConnection({"h1": LOG})
+        follower = LogFollower(connection, hosts=["h1"], regex="o",
+                               min_level="Warning")
+        events = follower.poll()
+        assert ["Warning", "Error"] == [event['level'] for event in events]
+        assert ["o"] == connection.requests[0]['regex']
+
+        connection = LogConnection({"h1": LOG})
+        LogFollower(connection, hosts=["h1"], min_level="Error").poll()
+        assert [" (Error|Critical|Alert|Emergency):"] \
+            == connection.requests[0]['regex']
+
+    def test_merge(self):
+        connection = LogConnection({
+            "h1": ["2016-05-01 10:00:00.000 Info: h1 first",
+                   "2016-05-01 10:00:02.000 Info: h1 second"],
+            "h2": ["2016-05-01 10:00:01.000 Info: h2 first"]})
+        follower = LogFollower(connection, hosts=["h1", "h2", "h3"])
+        events = follower.poll()
+        assert ["h1 first", "h2 first", "h1 second"] \
+            == [event['message'] for event in events]
+        assert ["h1", "h2", "h1"] == [event['host'] for event in events]
+        assert ("h3", "ErrorLog.txt") not in follower.offsets
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+from marklogic.utilities.manifest import SyncManifest
+
+class TestSyncManifest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "manifest.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def entry(self, path, **kwargs):
+        entry = {"path": path, "uri": "/root" + path, "mtime": 1.5,
+                 "size": 10, "server_timestamp": "2016-01-01T00:00:00Z"}
+        entry.update(kwargs)
+        return entry
+
+    def test_update_and_get(self):
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/b.xml"), self.entry("/a.xml")])
+            entry = manifest.get("/a.xml")
+            assert "/root/a.xml" == entry['uri']
+            assert 1.5 == entry['mtime']
+            assert 10 == entry['size']
+            assert 'hash' not in entry
+            assert "synced" == entry['state']
+            assert "/b.xml" == manifest.get_uri("/root/b.xml")['path']
+            assert manifest.get("/c.xml") is None
+            assert manifest.get_uri("/root/c.xml") is None
+            assert 2 == manifest.count()
+
+    def test_replace(self):
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml")])
+            manifest.update([self.entry("/a.xml", size=20, state="pending")])
+            assert 1 == manifest.count()
+            assert 20 == manifest.get("/a.xml")['size']
+            assert "pending" == manifest.get("/a.xml")['state']
+
+    def test_unchanged(self):
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml"),
+                             self.entry("/b.xml", state="pending")])
+            assert manifest.unchanged("/a.xml", 1.5, 10)
+            assert not manifest.unchanged("/a.xml", 2.5, 10)
+            assert not manifest.unchanged("/a.xml", 1.5, 11)
+            assert not manifest.unchanged("/b.xml", 1.5, 10)
+            assert not manifest.unchanged("/c.xml", 1.5, 10)
+
+    def test_keep_server_timestamp(self):
+        # Uploads don't know the server timestamp; the one recorded by
+        # an earlier download is kept
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml")])
+            manifest.update([{"path": "/a.xml", "uri": "/root/a.xml",
+                              "mtime": 2.5, "size": 20},
+                             {"path": "/b.xml", "uri": "/root/b.xml",
+                              "mtime": 2.5, "size": 20}])
+            entry = manifest.get("/a.xml")
+            assert "2016-01-01T00:00:00Z" == entry['server_timestamp']
+            assert 2.5 == entry['mtime']
+            assert manifest.get("/b.xml")['server_timestamp'] is None
+
+            manifest.update([self.entry("/a.xml",
+                                        server_timestamp="2016-02-01")])
+            assert "2016-02-01" == manifest.get("/a.xml")['server_timestamp']
+
+    def test_remove(self):
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml"), self.entry("/b.xml")])
+            manifest.remove(["/a.xml", "/missing.xml"])
+            assert ["/b.xml"] == manifest.paths()
+
+    def test_persistent(self):
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml")])
+        with SyncManifest(self.filename) as manifest:
+            assert ["/a.xml"] == manifest.paths()
+
+    def test_entries(self):
+        with SyncManifest(self.filename) as manifest:
+            paths = ["/doc{0:04d}.xml".format(i) for i in range(500)]
+            manifest.update([self.entry(path) for path in reversed(paths)])
+            assert paths == [entry['path'] for entry in manifest.entries()]
+            assert paths == manifest.paths()
+
+    def test_update_while_reading(self):
+        # Updates made while the entries are read don't block and don't
+        # change the entries already being read
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml"), self.entry("/b.xml")])
+            seen = []
+            for entry in manifest.entries():
+                seen.append(entry['path'])
+                manifest.update([self.entry("/c.xml")])
+                manifest.remove(["/b.xml"])
+            assert ["/a.xml", "/b.xml"] == seen
+            assert ["/a.xml", "/c.xml"] == manifest.paths()
+
+    def test_old_schema(self):
+        # Manifests written with the old version column still open
+        db = sqlite3.connect(self.filename)
+        db.execute("CREATE TABLE manifest (path TEXT PRIMARY KEY, uri TEXT, "
+                   + "mtime REAL, size INTEGER, hash TEXT, "
+                   + "server_timestamp TEXT, version TEXT, state TEXT)")
+        db.commit()
+        db.close()
+        with SyncManifest(self.filename) as manifest:
+            manifest.update([self.entry("/a.xml")])
+            assert manifest.unchanged("/a.xml", 1.5, 10)
+            assert ["/a.xml"] == [entry['path']
+                                  for entry in manifest.entries()]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+from marklogic.utilities.mergejoin import merge_join
+
+def _pairs(keys):
+    return [(key, key.upper()) for key in keys]
+
+class TestMergeJoin(TestCase):
+    def test_join(self):
+        joined = list(merge_join(_pairs(["a", "c", "d"]),
+                                 _pairs(["b", "c", "e"])))
+        assert ["a", "b", "c", "d", "e"] == [key for key, l, r in joined]
+        assert ("a", ("a", "A"), None) == joined[0]
+        assert ("b", None, ("b", "B")) == joined[1]
+        assert ("c", ("c", "C"), ("c", "C")) == joined[2]
+        assert ("d", ("d", "D"), None) == joined[3]
+        assert ("e", None, ("e", "E")) == joined[4]
+
+    def test_code_point_order(self):
+        # Keys are compared by code point, like URIs in the lexicon
+        keys = sorted(["/a/b", "/a-b", "/a.b", "/A"])
+        joined = list(merge_join(_pairs(keys), _pairs(keys[1:])))
+        assert keys == [key for key, l, r in joined]
+        assert joined[0][2] is None
+        for key, litem, ritem in joined[1:]:
+            assert litem == ritem
+
+    def test_empty(self):
+        assert [] == list(merge_join([], []))
+        assert [("a", ("a", "A"), None)] == list(merge_join(_pairs(["a"]), []))
+        assert [("a", None, ("a", "A"))] == list(merge_join([], _pairs(["a"])))
+
+    def test_lazy(self):
+        # Only one item from each stream is read ahead
+        consumed = []
+        def stream(keys):
+            for key in keys:
+                consumed.append(key)
+                yield (key, None)
+        joined = merge_join(stream(["a", "b", "c"]), stream(["x", "y"]))
+        assert "a" == next(joined)[0]
+        assert ["a", "x"] == consumed
+
+    def test_duplicates(self):
+        with self.assertRaises(ValueError):
+            list(merge_join(_pairs(["a", "b", "b"]), _pairs(["a"])))
+        with self.assertRaises(ValueError):
+            list(merge_join(_pairs(["a"]), _pairs(["a", "a"])))
+
+    def test_unsorted(self):
+        with self.assertRaises(ValueError) as context:
+            list(merge_join(_pairs(["a", "c"]), _pairs(["b", "a"])))
+        assert "right" in str(context.exception)
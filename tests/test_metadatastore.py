@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from marklogic.utilities.metadatastore import MetadataStore
+
+class TestMetadataStore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "metadata.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_and_get(self):
+        with MetadataStore(self.filename) as store:
+            store.put("/b.xml", "/content/b.xml", b"<b/>")
+            store.put("/a.xml", "/ucontent/12/34/a.xml", b"<a/>")
+            assert b"<a/>" == store.get("/a.xml")
+            assert ("/a.xml", b"<a/>") \
+                == store.get_path("/ucontent/12/34/a.xml")
+            assert store.get("/c.xml") is None
+            assert store.get_path("/content/c.xml") is None
+            assert 2 == store.count()
+
+    def test_replace(self):
+        with MetadataStore(self.filename) as store:
+            store.put("/a.xml", "/content/a.xml", b"<a/>", 100.0)
+            store.put("/a.xml", "/content/a.xml", b"<a2/>", 200.0)
+            assert 1 == store.count()
+            assert b"<a2/>" == store.get("/a.xml")
+            assert 200.0 == store.modified("/a.xml")
+
+    def test_modified(self):
+        with MetadataStore(self.filename) as store:
+            before = time.time()
+            store.put("/a.xml", "/content/a.xml", b"<a/>")
+            assert before <= store.modified("/a.xml") <= time.time()
+            store.put("/b.xml", "/content/b.xml", b"<b/>", 12.5)
+            assert 12.5 == store.modified("/b.xml")
+            assert store.modified("/c.xml") is None
+
+    def test_order(self):
+        uris = ["/doc{0:04d}.xml".format(i) for i in range(50)]
+        with MetadataStore(self.filename, commit_size=7) as store:
+            for uri in reversed(uris):
+                store.put(uri, "/content" + uri, uri.encode('utf-8'))
+            assert uris == [uri for uri, path in store.paths()]
+            for uri, path, metadata in store.items():
+                assert "/content" + uri == path
+                assert uri.encode('utf-8') == metadata
+
+    def test_items_while_writing(self):
+        with MetadataStore(self.filename, commit_size=2) as store:
+            for index in range(5):
+                store.put("/{0}.xml".format(index), None, b"<x/>")
+            seen = []
+            for uri, path in store.paths():
+                seen.append(uri)
+                store.put("/z" + uri, None, b"<z/>")
+            assert 5 <= len(seen)
+            assert 10 == store.count()
+
+    def test_delete(self):
+        with MetadataStore(self.filename) as store:
+            store.put("/a.xml", "/content/a.xml", b"<a/>")
+            store.delete("/a.xml")
+            assert store.get("/a.xml") is None
+            assert 0 == store.count()
+
+    def test_persistent(self):
+        store = MetadataStore(self.filename, commit_size=1000)
+        store.put("/a.xml", "/content/a.xml", b"<a/>")
+        store.close()
+        with MetadataStore(self.filename) as store:
+            assert b"<a/>" == store.get("/a.xml")
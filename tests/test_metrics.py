@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import io
+import json
+from unittest import TestCase
+from mlconfig import MLConfig
+from marklogic.models import metrics
+from marklogic.models.metrics import MetricsCollector, RingBuffer, flatten
+from fakes import FakeConnection, json_response
+
+class TestMetrics(MLConfig):
+    def test_sample(self):
+        collector = MetricsCollector(self.connection, downsample=2)
+        collector.sample()
+        timestamp, values = collector.sample()
+
+        assert len(values) > 0
+        assert len(collector.buffer) == 2
+        assert len(collector.buffer.samples(downsampled=True)) == 1
+        for name in values:
+            assert name.split(".")[0] in ("hosts", "forests",
+                                          "databases", "servers")
+
+        stream = io.StringIO()
+        collector.to_json(stream, pattern="^forests\\.")
+        series = json.loads(stream.getvalue())["series"]
+        assert len(series) > 0
+
+class TestFlatten(TestCase):
+    def test_flatten(self):
+        view = {"forest-status": {
+            "meta": {"current-time": "2016-01-01T00:00:00Z"},
+            "status-properties": {
+                "state": {"units": "enum", "value": "open"},
+                "enabled": {"units": "bool", "value": True},
+                "merge-count": {"units": "quantity", "value": 3},
+                "disk-size": 12.5,
+                "stands": [{"nameref": "00000001", "disk-size": 1},
+                           {"name": "00000002", "disk-size": 2},
+                           {"disk-size": 3}]}}}
+        values = flatten(view, "forests")
+        assert {"forests.forest-status.status-properties.enabled": 1.0,
+                "forests.forest-status.status-properties.merge-count": 3.0,
+                "forests.forest-status.status-properties.disk-size": 12.5,
+                "forests.forest-status.status-properties.stands.00000001.disk-size": 1.0,
+                "forests.forest-status.status-properties.stands.00000002.disk-size": 2.0,
+                "forests.forest-status.status-properties.stands.2.disk-size": 3.0} \
+            == values
+
+    def test_skipped(self):
+        view = {"units": "MB", "relations": {"count": 1},
+                "related-views": [{"count": 2}], "total": 4}
+        assert {"total": 4.0} == flatten(view)
+
+    def test_scalars(self):
+        assert {"x": 1.0} == flatten(True, "x")
+        assert {"x": 2.0} == flatten(2, "x")
+        assert {} == flatten("text", "x")
+        values = {"y": 1.0}
+        assert values is flatten({"a": 1}, "", values)
+        assert {"y": 1.0, "a": 1.0} == values
+
+class TestRingBuffer(TestCase):
+    def test_capacity(self):
+        buf = RingBuffer(capacity=3, downsample=100)
+        for index in range(5):
+            buf.append(index, {"v": float(index)})
+        assert 3 == len(buf)
+        assert [2, 3, 4] == [timestamp for timestamp, values
+                             in buf.samples()]
+
+    def test_downsample(self):
+        buf = RingBuffer(capacity=100, downsample=2, history=2)
+        buf.append(1, {"a": 1.0, "b": 10.0})
+        assert [] == buf.samples(downsampled=True)
+        buf.append(2, {"a": 3.0})
+        assert [(2, {"a": 2.0, "b": 10.0})] == buf.samples(downsampled=True)
+        for index in range(3, 7):
+            buf.append(index, {"a": float(index)})
+        # The history keeps the latest averages
+        assert [(4, {"a": 3.5}), (6, {"a": 5.5})] \
+            == buf.samples(downsampled=True)
+        assert 6 == len(buf)
+
+MANAGE = "http://localhost:8002/manage/v2/"
+
+class CountConnection(FakeConnection):
+    """Answers every view with a count of the length of its URI."""
+    def get(self, uri):
+        return json_response({"uri": {"count": len(uri)}})
+
+class FakeServer:
+    @classmethod
+    def list(cls, connection):
+        return ["Default|App-Services", "Other|App-Services"]
+
+class TestRequests(TestCase):
+    def test_list_views(self):
+        collector = MetricsCollector(CountConnection(),
+                                     resources=("hosts", "forests"))
+        assert [("hosts", MANAGE + "hosts?view=status"),
+                ("forests", MANAGE + "forests?view=status")] \
+            == collector._list_requests()
+        timestamp, values = collector.sample()
+        assert ["forests.uri.count", "hosts.uri.count"] == sorted(values)
+        assert 1 == len(collector.buffer)
+
+    def test_metrics_view(self):
+        collector = MetricsCollector(CountConnection(), resources=("hosts",),
+                                     view="metrics")
+        assert [("hosts", MANAGE + "hosts?view=metrics")] \
+            == collector._list_requests()
+
+    def test_server_groups(self):
+        # Servers with the same name in different groups are separate
+        # series
+        saved = metrics.Server
+        metrics.Server = FakeServer
+        try:
+            collector = MetricsCollector(CountConnection(),
+                                         resources=("servers",),
+                                         detail=True)
+            requests = collector._list_requests()
+        finally:
+            metrics.Server = saved
+        assert [("servers.Default.App-Services",
+                 MANAGE + "servers/App-Services?view=status&group-id=Default"),
+                ("servers.Other.App-Services",
+                 MANAGE + "servers/App-Services?view=status&group-id=Other")] \
+            == requests
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+def _load_mldbmirror():
+    """Load examples/mldbmirror.py, which isn't a package module."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "examples", "mldbmirror.py")
+    spec = importlib.util.spec_from_file_location("mldbmirror", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+mldbmirror = _load_mldbmirror()
+
+class FakeTransactions:
+    """Partitions commit without a server."""
+    def __init__(self, connection):
+        pass
+
+    def set_database(self, database):
+        pass
+
+    def set_timeLimit(self, limit):
+        pass
+
+    def max_timeLimit(self):
+        return 3600
+
+    def bulkloader(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class FakeUtils:
+    """
+    A database of documents, each a (content, last-modified) tuple
+    keyed by URI. Like the server, it only hashes binary and text
+    documents.
+    """
+    def __init__(self, uris, documents=None):
+        self.all_uris = uris
+        self.documents = documents or {}
+        self.hashed = []
+        self.stamped = []
+
+    def iter_uris(self, database, **kwargs):
+        return iter(self.all_uris)
+
+    def uris(self, database, root=None, **kwargs):
+        return list(self.all_uris)
+
+    def content_hashes(self, database, uris, **kwargs):
+        self.hashed.extend(uris)
+        hashes = {}
+        for uri in uris:
+            if uri in self.documents and not uri.endswith((".xml", ".json")):
+                content = self.documents[uri][0]
+                hashes[uri] = hashlib.md5(content).hexdigest()
+        return hashes
+
+    def iter_last_modified(self, database, uris, **kwargs):
+        for uri in uris:
+            yield (uri, self.documents[uri][1])
+
+    def last_modified(self, database, uris, **kwargs):
+        self.stamped.extend(uris)
+        return dict([(uri, self.documents[uri][1]) for uri in uris
+                     if uri in self.documents])
+
+class PartitionMirror(mldbmirror.MarkLogicDatabaseMirror):
+    """Records the partitions uploaded; fails the ones in self.fail."""
+    def __init__(self, path):
+        mldbmirror.MarkLogicDatabaseMirror.__init__(self)
+        self.path = path
+        self.root = ""
+        self.database = "Documents"
+        self.uploads = []
+        self.fail = set()
+
+    def _upload_files(self, bulk, upload_map, files):
+        if files[0] in self.fail:
+            raise RuntimeError("partition failed")
+        self.uploads.append(files)
+        return [(doc, self.root + doc) for doc in files]
+
+class TestPartitions(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.saved = mldbmirror.Transactions
+        mldbmirror.Transactions = FakeTransactions
+
+    def tearDown(self):
+        mldbmirror.Transactions = self.saved
+        shutil.rmtree(self.path)
+
+    def upload(self, mirror, files):
+        upload_map = {}
+        for doc in files:
+            upload_map[doc] = {"content": self.path + doc}
+            if not os.path.exists(self.path + doc):
+                with open(self.path + doc, "w") as data:
+                    data.write("<doc/>")
+        urihash = dict([(doc, None) for doc in files])
+        urihash["/stale.xml"] = None
+        failed = mirror._upload_partitions(upload_map, list(files), urihash)
+        return failed, urihash
+
+    def progress(self):
+        with open(os.path.join(self.path, mldbmirror.PROGRESSFILE)) as data:
+            return json.load(data)
+
+    def test_partition_size(self):
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 4
+        files = ["/doc{0:02d}.xml".format(i) for i in range(10, 0, -1)]
+        failed, urihash = self.upload(mirror, files)
+        assert not failed
+        assert [4, 4, 2] == sorted([len(part) for part in mirror.uploads],
+                                   reverse=True)
+        uploaded = sorted([doc for part in mirror.uploads for doc in part])
+        assert sorted(files) == uploaded
+        for part in mirror.uploads:
+            assert part == sorted(part)
+        # Only the URI that wasn't uploaded is left to delete
+        assert ["/stale.xml"] == list(urihash)
+
+    def test_progress(self):
+        files = ["/doc{0:02d}.xml".format(i) for i in range(6)]
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        mirror.fail = {"/doc02.xml"}
+        failed, urihash = self.upload(mirror, files)
+        assert failed
+
+        progress = self.progress()
+        assert 3 == len(progress)
+        status = dict([(entry['first'], entry['status'])
+                       for entry in progress.values()])
+        assert {"/doc00.xml": "done", "/doc02.xml": "failed",
+                "/doc04.xml": "done"} == status
+        for entry in progress.values():
+            assert 2 == entry['count']
+            if entry['status'] == 'failed':
+                assert "partition failed" == entry['error']
+
+        # A rerun retries only the failed partition, and the URIs of the
+        # committed partitions are still kept from being deleted
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        failed, urihash = self.upload(mirror, files)
+        assert not failed
+        assert [["/doc02.xml", "/doc03.xml"]] == mirror.uploads
+        assert ["/stale.xml"] == list(urihash)
+        # Every partition has committed, so the progress file is gone
+        assert not os.path.exists(os.path.join(self.path,
+                                               mldbmirror.PROGRESSFILE))
+
+    def test_rerun_completed(self):
+        files = ["/doc{0:02d}.xml".format(i) for i in range(4)]
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        self.upload(mirror, files)
+
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        failed, urihash = self.upload(mirror, files)
+        assert not failed
+        assert 2 == len(mirror.uploads)
+
+    def test_edited(self):
+        files = ["/doc{0:02d}.xml".format(i) for i in range(4)]
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        mirror.fail = {"/doc02.xml"}
+        self.upload(mirror, files)
+
+        # A file in a committed partition is edited before the rerun;
+        # its partition is uploaded again
+        with open(self.path + "/doc01.xml", "w") as data:
+            data.write("<doc>edited</doc>")
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        failed, urihash = self.upload(mirror, files)
+        assert not failed
+        assert [["/doc00.xml", "/doc01.xml"], ["/doc02.xml", "/doc03.xml"]] \
+            == sorted(mirror.uploads)
+
+    def test_dryrun(self):
+        mirror = PartitionMirror(self.path)
+        mirror.partition_size = 2
+        mirror.dryrun = True
+        failed, urihash = self.upload(mirror, ["/a.xml", "/b.xml", "/c.xml"])
+        assert not failed
+        assert 2 == len(mirror.uploads)
+        assert not os.path.exists(os.path.join(self.path,
+                                               mldbmirror.PROGRESSFILE))
+
+class TestValidate(TestCase):
+    def mirror(self, uris):
+        mirror = mldbmirror.MarkLogicDatabaseMirror()
+        mirror.root = "/root"
+        mirror.database = "Documents"
+        mirror.utils = FakeUtils(uris)
+        return mirror
+
+    def test_complete(self):
+        upload_map = {"/a.xml": {"content": "/tmp/a.xml"},
+                      "/b.xml": {"content": "/tmp/b.xml"}}
+        mirror = self.mirror(["/root/a.xml", "/root/b.xml", "/root/c.xml"])
+        mirror._validate_upload(upload_map)
+
+    def test_missing(self):
+        upload_map = {"/a.xml": {"content": "/tmp/a.xml"},
+                      "/b.xml": {"content": "/tmp/b.xml"}}
+        mirror = self.mirror(["/root/a.xml"])
+        with self.assertRaises(RuntimeError) as context:
+            mirror._validate_upload(upload_map)
+        assert "1 documents" in str(context.exception)
+
+STAMP = "2016-01-01T00:00:00Z"
+STAMP_SECONDS = 1451606400
+
+class HashMirror(mldbmirror.MarkLogicDatabaseMirror):
+    """Records the documents a download would fetch."""
+    def __init__(self, path, documents):
+        mldbmirror.MarkLogicDatabaseMirror.__init__(self)
+        self.path = path
+        self.root = ""
+        self.database = "Documents"
+        self.use_hash = True
+        self.utils = FakeUtils(sorted(documents), documents)
+        self.down_map = None
+
+    def _download_map(self, trans, down_map, skip_list=[]):
+        self.down_map = down_map
+
+class TestHash(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.documents = {"/same.bin": (b"\x00\x01", STAMP),
+                          "/changed.bin": (b"\x00\x02", STAMP),
+                          "/same.txt": ("caf\u00e9\n".encode('utf-8'), STAMP),
+                          "/downloaded.xml": (b"<doc/>", STAMP),
+                          "/stale.xml": (b"<doc/>", STAMP),
+                          "/new.json": (b"{}", STAMP)}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, content, stamp=None):
+        filename = self.path + name
+        with open(filename, "wb") as data:
+            data.write(content)
+        if stamp is not None:
+            os.utime(filename, (stamp, stamp))
+        return filename
+
+    def test_download(self):
+        self.write("/same.bin", b"\x00\x01")
+        self.write("/changed.bin", b"\x00\x03")
+        self.write("/same.txt", "caf\u00e9\n".encode('utf-8'))
+        # A document downloaded earlier gets the server's timestamp; an
+        # XML document that round-trips that way is up-to-date even
+        # though its bytes aren't what the server would hash
+        self.write("/downloaded.xml", b"<?xml version='1.0'?>\n<doc/>",
+                   STAMP_SECONDS)
+        self.write("/stale.xml", b"<doc/>", STAMP_SECONDS - 60)
+
+        mirror = HashMirror(self.path, self.documents)
+        mirror._download_directory(None)
+        assert ["/changed.bin", "/new.json", "/stale.xml"] \
+            == sorted(mirror.down_map)
+
+        # Timestamps are only read for the documents that aren't hashed
+        assert ["/downloaded.xml", "/new.json", "/stale.xml"] \
+            == sorted(mirror.utils.stamped)
+
+    def test_upload(self):
+        upload_map = {}
+        for name, content, stamp in [
+                ("/same.bin", b"\x00\x01", None),
+                ("/changed.bin", b"\x00\x03", None),
+                ("/same.txt", "caf\u00e9\n".encode('utf-8'), None),
+                ("/downloaded.xml", b"<doc/>", STAMP_SECONDS - 60),
+                ("/stale.xml", b"<doc/>", STAMP_SECONDS + 60),
+                ("/new.json", b"{}", None),
+                ("/local.xml", b"<doc/>", None)]:
+            upload_map[name] = {"content": self.write(name, content, stamp)}
+
+        mirror = HashMirror(self.path, self.documents)
+        mirror._server_changes(upload_map)
+        assert ["/changed.bin", "/local.xml", "/new.json", "/stale.xml"] \
+            == sorted(upload_map)
+
+class FakeDocuments:
+    """Reads the documents of a FakeUtils database."""
+    documents = {}
+
+    def __init__(self, connection):
+        pass
+
+    def set_database(self, database):
+        pass
+
+    def set_txid(self, txid):
+        pass
+
+    def set_format(self, name):
+        pass
+
+    def set_category(self, category):
+        pass
+
+    def read_many(self, uris, batch_size, concurrency, **kwargs):
+        for uri in uris:
+            yield (uri, None, self.documents[uri][0], "text/plain")
+
+class FakeTransaction:
+    def txid(self):
+        return None
+
+class StreamingMirror(mldbmirror.MarkLogicDatabaseMirror):
+    def __init__(self, path, documents, fail=False):
+        mldbmirror.MarkLogicDatabaseMirror.__init__(self)
+        self.path = path
+        self.root = ""
+        self.database = "Documents"
+        self.utils = FakeUtils(sorted(documents), documents)
+        self.fail = fail
+
+    def _download_pipeline(self, results, down_map, download_count=None):
+        self.down_map = down_map
+        if self.fail:
+            for result in results:
+                pass
+            raise RuntimeError("write failed")
+        return mldbmirror.MarkLogicDatabaseMirror._download_pipeline(
+            self, results, down_map, download_count)
+
+class TestDownloadStreaming(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.documents = {"/a.txt": (b"a", STAMP), "/sub/b.txt": (b"b", STAMP)}
+        FakeDocuments.documents = self.documents
+        self.saved = mldbmirror.Documents
+        mldbmirror.Documents = FakeDocuments
+        os.makedirs(self.path + "/old")
+        for name in ["/old/stale.txt", "/" + mldbmirror.CONFIGFILE]:
+            with open(self.path + name, "w") as data:
+                data.write("{}")
+
+    def tearDown(self):
+        mldbmirror.Documents = self.saved
+        shutil.rmtree(self.path)
+
+    def test_deletes_after_download(self):
+        mirror = StreamingMirror(self.path, self.documents)
+        mirror._download_streaming(FakeTransaction())
+        assert not os.path.exists(self.path + "/old")
+        assert os.path.exists(self.path + "/" + mldbmirror.CONFIGFILE)
+        with open(self.path + "/sub/b.txt", "rb") as data:
+            assert b"b" == data.read()
+        assert STAMP_SECONDS == os.stat(self.path + "/a.txt").st_mtime
+        # Nothing is left pending once the documents are written
+        assert {} == mirror.down_map
+
+    def test_keeps_files_on_failure(self):
+        mirror = StreamingMirror(self.path, self.documents, fail=True)
+        with self.assertRaises(RuntimeError):
+            mirror._download_streaming(FakeTransaction())
+        assert os.path.exists(self.path + "/old/stale.txt")
+
+    def test_dryrun(self):
+        mirror = StreamingMirror(self.path, self.documents)
+        mirror.dryrun = True
+        mirror._download_streaming(FakeTransaction())
+        assert os.path.exists(self.path + "/old/stale.txt")
+        assert not os.path.exists(self.path + "/a.txt")
+
+METADATA = ('<rapi:metadata xmlns:rapi="http://marklogic.com/rest-api">'
+            + '<mldb:content-type xmlns:mldb="http://marklogic.com/ns/mldbmirror/">'
+            + 'application/xml</mldb:content-type>{0}</rapi:metadata>')
+
+class MapMirror(mldbmirror.MarkLogicDatabaseMirror):
+    """Records the upload map of a mirror instead of uploading it."""
+    def __init__(self, path):
+        mldbmirror.MarkLogicDatabaseMirror.__init__(self)
+        self.path = path
+        self.root = ""
+        self.upload_map = None
+
+    def _upload_map(self, trans, upload_map):
+        self.upload_map = upload_map
+
+class TestConvert(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        uri = ('<mldb:uri xmlns:mldb="http://marklogic.com/ns/mldbmirror/">'
+               + 'http://example.com/x?y</mldb:uri>')
+        self.files = {"/content/a.xml": "<a/>",
+                      "/content/dir/b.xml": "<b/>",
+                      "/metadata/a.xml": METADATA.format(""),
+                      "/metadata/dir/b.xml": METADATA.format(""),
+                      "/ucontent/12/34/5678.bin": "x",
+                      "/umetadata/12/34/5678.bin": METADATA.format(uri)}
+        for name, text in self.files.items():
+            filename = self.path + name
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as data:
+                data.write(text)
+            os.utime(filename, (STAMP_SECONDS, STAMP_SECONDS))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def describe(self, mirror):
+        """Summarize what an upload of the mirror would send."""
+        found = {}
+        for key, stanza in mirror.upload_map.items():
+            root = mirror._read_metadata(stanza)
+            found[key] = (mirror._target(mirror.upload_map, key),
+                          mldbmirror.ET.tostring(root),
+                          mirror._local_stat(stanza))
+        return found
+
+    def test_round_trip(self):
+        mirror = MapMirror(self.path)
+        mirror._upload_mirror(None)
+        before = self.describe(mirror)
+        assert ["/12/34/5678.bin", "/a.xml", "/dir/b.xml"] == sorted(before)
+        assert "http://example.com/x?y" == before["/12/34/5678.bin"][0]
+
+        mirror = MapMirror(self.path)
+        mirror.convert_mirror()
+        assert not os.path.exists(self.path + "/metadata")
+        assert not os.path.exists(self.path + "/umetadata")
+
+        mirror = MapMirror(self.path)
+        mirror._upload_mirror(None)
+        after = self.describe(mirror)
+        mirror._close_metadata_store()
+
+        # The same documents, with the same metadata, and (so that a
+        # manifest doesn't see a change) the same modification times
+        assert before == after
+
+    def test_dryrun(self):
+        mirror = MapMirror(self.path)
+        mirror.dryrun = True
+        mirror.convert_mirror()
+        assert os.path.exists(self.path + "/metadata/a.xml")
+        assert not os.path.exists(self.path + "/" + mldbmirror.METADATASTORE)
+
+    def test_stored_metadata_changes_stat(self):
+        mirror = MapMirror(self.path)
+        mirror.convert_mirror()
+        mirror = MapMirror(self.path)
+        mirror._upload_mirror(None)
+        stanza = mirror.upload_map["/a.xml"]
+        before = mirror._local_stat(stanza)
+        mirror.metadata_store.put(stanza['uri'], stanza['stored'],
+                                  METADATA.format("<x/>").encode('utf-8'))
+        after = mirror._local_stat(stanza)
+        mirror._close_metadata_store()
+        assert before[1] == after[1]
+        assert after[0] > before[0]
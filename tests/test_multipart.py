@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+from marklogic.client.multipart import boundary, iter_events, iter_stream
+from marklogic.client.exceptions import UnexpectedAPIResponse
+
+BOUNDARY = b"ML_BOUNDARY_7372759131301359002"
+
+BODY = (b"preamble\r\n"
+        + b"--" + BOUNDARY + b"\r\n"
+        + b"Content-Type: application/xml\r\n"
+        + b"Content-Disposition: attachment; filename=\"/a.xml\"; "
+        + b"category=content\r\n"
+        + b"\r\n"
+        + b"<doc>--" + BOUNDARY[:10] + b"</doc>"
+        + b"\r\n--" + BOUNDARY + b"\r\n"
+        + b"Content-Type: text/plain\r\n"
+        + b"Content-Disposition: attachment; filename=\"/b.txt\"\r\n"
+        + b"\r\n"
+        + b""
+        + b"\r\n--" + BOUNDARY + b"\r\n"
+        + b"Content-Type: application/json\r\n"
+        + b"\r\n"
+        + b"{\"a\": 1}"
+        + b"\r\n--" + BOUNDARY + b"--\r\n")
+
+def _split(data, *points):
+    """Split data into chunks at the given offsets."""
+    chunks = []
+    start = 0
+    for point in points:
+        chunks.append(data[start:point])
+        start = point
+    chunks.append(data[start:])
+    return chunks
+
+class TestMultipart(TestCase):
+    def check(self, parts):
+        assert 3 == len(parts)
+        assert "/a.xml" == parts[0].filename()
+        assert "content" == parts[0].category()
+        assert "application/xml" == parts[0].content_type()
+        assert b"<doc>--" + BOUNDARY[:10] + b"</doc>" == parts[0].content()
+        assert "/b.txt" == parts[1].filename()
+        assert b"" == parts[1].content()
+        assert b"{\"a\": 1}" == parts[2].content()
+        for part in parts:
+            assert isinstance(part.content(), bytes)
+
+    def test_boundary(self):
+        assert BOUNDARY == boundary("multipart/mixed; boundary="
+                                    + BOUNDARY.decode('ascii'))
+        assert BOUNDARY == boundary("multipart/mixed; boundary=\""
+                                    + BOUNDARY.decode('ascii') + "\"")
+        assert boundary("text/plain") is None
+
+    def test_one_chunk(self):
+        self.check(list(iter_stream([BODY], BOUNDARY)))
+
+    def test_every_split(self):
+        # Split in two at every offset: inside each boundary marker,
+        # inside the headers and inside the bodies
+        for point in range(1, len(BODY)):
+            self.check(list(iter_stream(_split(BODY, point), BOUNDARY)))
+
+    def test_boundary_and_header_splits(self):
+        marker = BODY.index(b"\r\n--" + BOUNDARY + b"\r\n")
+        header = BODY.index(b"Content-Type: text/plain")
+        for offset in range(1, len(BOUNDARY) + 6):
+            for inside in range(1, 20):
+                chunks = _split(BODY, marker + offset, header + inside)
+                self.check(list(iter_stream(chunks, BOUNDARY)))
+
+    def test_byte_chunks(self):
+        chunks = [BODY[i:i + 1] for i in range(len(BODY))]
+        self.check(list(iter_stream(chunks, BOUNDARY)))
+        self.check(list(iter_stream(chunks, BOUNDARY, spool_threshold=4)))
+
+    def test_events(self):
+        events = list(iter_events(_split(BODY, 100, 200), BOUNDARY))
+        starts = [event for event in events if event[0] is not None]
+        ends = [event for event in events if event == (None, None)]
+        assert 3 == len(starts)
+        assert 3 == len(ends)
+
+    def test_truncated(self):
+        with self.assertRaises(UnexpectedAPIResponse):
+            list(iter_stream([BODY[:BODY.index(b"<doc>") + 3]], BOUNDARY))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+from unittest import TestCase
+from urllib.parse import urlparse
+from marklogic.models.database import operation
+from marklogic.models.database.operation import DatabaseOperation
+from marklogic.models.database.operation import clear_progress
+from marklogic.models.database.operation import merge_progress
+from marklogic.models.database.operation import reindex_progress
+from fakes import FakeConnection, json_response
+
+def _status(**props):
+    return {"forest-status": {"status-properties": props}}
+
+def _counts(**props):
+    return {"forest-counts": {"count-properties": props}}
+
+def _merge(current, final):
+    return {"current-size": {"units": "MB", "value": current},
+            "final-size": {"units": "MB", "value": final}}
+
+class TestProgress(TestCase):
+    def test_merge(self):
+        status = _status(**{"merge-count": {"value": 2},
+                            "merges": {"merge": [_merge(10, 40),
+                                                 _merge(20, 40)]}})
+        assert (True, 30.0 / 80.0) == merge_progress(status, {})
+
+    def test_merge_idle(self):
+        assert (False, None) == merge_progress(
+            _status(**{"merge-count": {"value": 0}}), {})
+        assert (False, None) == merge_progress({}, {})
+
+    def test_merge_without_sizes(self):
+        # A merge is reported but its sizes aren't known yet
+        assert (True, None) == merge_progress(
+            _status(**{"merge-count": "1"}), {})
+        assert (True, None) == merge_progress(
+            _status(merges={"merge": [_merge(0, 0)]}), {})
+
+    def test_merge_overshoot(self):
+        status = _status(merges={"merge": _merge(50, 40)})
+        assert (True, 1.0) == merge_progress(status, {})
+
+    def test_reindex(self):
+        status = _status(reindexing={"value": True},
+                         **{"reindex-count": {"value": 250}})
+        counts = _counts(**{"active-fragments": {"value": 1000}})
+        assert (True, 0.25) == reindex_progress(status, counts)
+
+    def test_reindex_unknown(self):
+        status = _status(reindexing=True)
+        assert (True, None) == reindex_progress(status, {})
+        assert (True, None) == reindex_progress(
+            status, _counts(**{"active-fragments": 0}))
+        assert (False, None) == reindex_progress(_status(reindexing=False),
+                                                 {})
+
+    def test_clear(self):
+        assert (True, 10.0) == clear_progress(
+            {}, _counts(documents={"value": 10}))
+        assert (False, 0.0) == clear_progress({}, _counts(documents=0))
+        assert (False, None) == clear_progress({}, {})
+
+class TestPercent(TestCase):
+    def test_inactive(self):
+        op = DatabaseOperation("db", "merge-database")
+        assert 100.0 == op._percent("f1", False, None)
+        assert 100.0 == op._percent("f1", False, 0.2)
+
+    def test_unknown(self):
+        op = DatabaseOperation("db", "reindex-database")
+        assert 0.0 == op._percent("f1", True, None)
+
+    def test_fraction(self):
+        op = DatabaseOperation("db", "reindex-database")
+        assert 25.0 == op._percent("f1", True, 0.25)
+
+    def test_clear(self):
+        # Measured against the first count seen for each forest
+        op = DatabaseOperation("db", "clear-database")
+        assert 0.0 == op._percent("f1", True, 200.0)
+        assert 50.0 == op._percent("f1", True, 100.0)
+        assert 0.0 == op._percent("f2", True, 10.0)
+        assert 75.0 == op._percent("f1", True, 50.0)
+        op = DatabaseOperation("db", "clear-database")
+        assert 100.0 == op._percent("f1", True, 0.0)
+
+class ViewConnection(FakeConnection):
+    """Serves canned forest views, keyed by (forest, view)."""
+    def __init__(self, views):
+        FakeConnection.__init__(self)
+        self.views = views
+
+    def get(self, uri):
+        params = self.record(uri)
+        name = urlparse(uri).path.split("/")[-1]
+        return json_response(self.views[(name, params['view'][0])])
+
+def _reindexing(done, total=100):
+    return {"status": _status(reindexing={"value": done < total},
+                              **{"reindex-count": {"value": done}}),
+            "counts": _counts(**{"active-fragments": {"value": total}})}
+
+class TestStatus(TestCase):
+    def operation(self, forests, name="reindex-database", elapsed=10.0):
+        views = {}
+        for forest in forests:
+            for view in forests[forest]:
+                views[(forest, view)] = forests[forest][view]
+        op = DatabaseOperation("db", name, sorted(forests),
+                               ViewConnection(views))
+        op.started = time.time() - elapsed
+        return op
+
+    def test_eta(self):
+        op = self.operation({"f1": _reindexing(20), "f2": _reindexing(30)})
+        status = op.status()
+        assert not status['done']
+        assert {"f1": 20.0, "f2": 30.0} == status['forests']
+        assert 25.0 == status['percent']
+        # A quarter done after 10 seconds leaves about 30 to go
+        assert abs(status['eta'] - 30.0) < 1.0
+
+    def test_no_progress(self):
+        op = self.operation({"f1": {"status": _status(reindexing=True),
+                                    "counts": {}}})
+        status = op.status()
+        assert not status['done']
+        assert 0.0 == status['percent']
+        assert status['eta'] is None
+
+    def test_never_above_99_until_done(self):
+        op = self.operation({"f1": _reindexing(100, 100)}, elapsed=0)
+        status = op.status()
+        # Not seen running yet and still within the settle time
+        assert not status['done']
+        assert 99.0 == status['percent']
+
+    def test_settle_time(self):
+        idle = {"f1": _reindexing(100, 100)}
+        op = self.operation(idle, elapsed=operation.SETTLE_TIME - 1)
+        assert not op.status()['done']
+        op.started = time.time() - operation.SETTLE_TIME
+        status = op.status()
+        assert status['done']
+        assert 100.0 == status['percent']
+        assert 0 == status['eta']
+
+    def test_done_once_seen_running(self):
+        forests = {"f1": _reindexing(50)}
+        op = self.operation(forests, elapsed=0)
+        assert not op.status()['done']
+        op.connection.views[("f1", "status")] = \
+            _reindexing(100)["status"]
+        assert op.status()['done']
+
+    def test_clear_done_at_once(self):
+        op = self.operation({"f1": {"status": {},
+                                    "counts": _counts(documents=0)}},
+                            name="clear-database", elapsed=0)
+        assert op.status()['done']
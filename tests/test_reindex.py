@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+from marklogic.models.database import Database
+from marklogic.models.database.reindex import ReindexPreview, diff_config
+from fakes import FakeConnection, FakeResponse, json_response
+
+class DatabaseConnection(FakeConnection):
+    """
+    Serves one database configuration and records the PUTs to it.
+    """
+    def __init__(self, config):
+        FakeConnection.__init__(self)
+        self.config = config
+        self.puts = []
+
+    def get(self, uri, accept="application/json"):
+        return json_response(self.config)
+
+    def put(self, uri, payload=None, etag=None):
+        self.puts.append(payload)
+        self.config.update(payload)
+        return FakeResponse(204)
+
+class TestDiffConfig(TestCase):
+    def test_changes(self):
+        changes = diff_config(
+            {'word-positions': False, 'in-memory-limit': 1,
+             'range-element-index': []},
+            {'word-positions': True, 'in-memory-limit': 2,
+             'range-element-index': [{'localname': "title",
+                                      'namespace-uri': ""}],
+             'language': "en"})
+        reindex = dict([(change['property'], change['reindex'])
+                        for change in changes])
+        assert {'word-positions': True, 'in-memory-limit': False,
+                'range-element-index': True, 'language': True} == reindex
+        names = [change['names'] for change in changes
+                 if change['property'] == 'range-element-index']
+        assert [[{'ns': "", 'name': "title"}]] == names
+
+class TestApply(TestCase):
+    def test_staged(self):
+        current = Database("reindex-db").marshal()
+        current['word-positions'] = False
+        current['in-memory-limit'] = 1
+        connection = DatabaseConnection(current)
+
+        pending = Database.unmarshal(dict(current))
+        pending.set_word_positions(True)
+        pending.set_in_memory_limit(2)
+
+        operation = ReindexPreview(pending, connection).apply(throttle=2)
+        assert operation is not None
+        # The throttle is lowered on its own before anything reindexes
+        assert [{'in-memory-limit': 2},
+                {'reindexer-throttle': 2},
+                {'word-positions': True}] == connection.puts
+
+    def test_nothing_to_reindex(self):
+        current = Database("reindex-db").marshal()
+        current['in-memory-limit'] = 1
+        connection = DatabaseConnection(current)
+
+        pending = Database.unmarshal(dict(current))
+        pending.set_in_memory_limit(2)
+
+        assert ReindexPreview(pending, connection).apply() is None
+        assert [{'in-memory-limit': 2}] == connection.puts
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from unittest import TestCase
+from marklogic.models import requestmonitor
+from marklogic.models.requestmonitor import CancelRule, RequestMonitor
+from fakes import FakeConnection, eval_response
+
+class CancelConnection(FakeConnection):
+    """
+    Cancels requests through v1/eval; the requests in finished have
+    already finished, so cancelling them fails.
+    """
+    def __init__(self, finished=()):
+        FakeConnection.__init__(self)
+        self.finished = set(finished)
+        self.cancelled = []
+
+    def post(self, uri, payload=None, content_type=None, accept=None,
+             stream=False):
+        request = json.loads(payload['vars'])['request']
+        cancelled = request not in self.finished
+        if cancelled:
+            with self.lock:
+                self.cancelled.append(request)
+        return eval_response(cancelled)
+
+def _request(request_id, elapsed=100.0, update=False):
+    return {"host": "localhost", "server": "App-Services",
+            "request-id": request_id, "elapsed": elapsed,
+            "start-time": "2016-01-01T00:00:00Z", "user": "admin",
+            "database": "Documents", "update": update, "kind": "eval",
+            "state": "running", "text": "xdmp:sleep(100000)"}
+
+class FixedMonitor(RequestMonitor):
+    """A monitor whose active requests are fixed."""
+    def __init__(self, connection, active):
+        RequestMonitor.__init__(self, connection)
+        self.active = active
+
+    def requests(self, server=None, hosts=None):
+        return list(self.active)
+
+_CLAUSES = ("for ", "let ", "where ", "order by ", "return")
+
+def _after_where(query):
+    """List the clause that follows each where clause in query."""
+    lines = [line.strip() for line in query.splitlines()]
+    following = []
+    for index, line in enumerate(lines):
+        if line.startswith("where "):
+            for later in lines[index + 1:]:
+                clause = [clause for clause in _CLAUSES
+                          if later.startswith(clause)]
+                if clause:
+                    following.append(clause[0].strip())
+                    break
+    return following
+
+class TestQueries(TestCase):
+    def test_flwor(self):
+        # XQuery 1.0 only allows order by and return after where
+        for query in (requestmonitor._ACTIVE_REQUESTS,
+                      requestmonitor._CANCEL_REQUEST):
+            assert query.startswith('xquery version "1.0-ml";')
+            for clause in _after_where(query):
+                assert clause in ("order by", "return")
+        assert ["return"] == _after_where(requestmonitor._ACTIVE_REQUESTS)
+
+class TestCancel(TestCase):
+    def test_cancel(self):
+        connection = CancelConnection()
+        monitor = RequestMonitor(connection)
+        assert monitor.cancel(_request("1"), CancelRule(name="slow"))
+        assert ["1"] == connection.cancelled
+        assert 1 == len(monitor.history)
+        assert "slow" == monitor.history[0]['rule']
+        assert "1" == monitor.history[0]['request']['request-id']
+
+    def test_already_finished(self):
+        connection = CancelConnection(finished=["1"])
+        monitor = RequestMonitor(connection)
+        assert not monitor.cancel(_request("1"))
+        assert 0 == len(monitor.history)
+
+    def test_cancel_matching(self):
+        connection = CancelConnection(finished=["2"])
+        active = [_request("1", 100.0), _request("2", 90.0),
+                  _request("3", 80.0, update=True), _request("4", 1.0)]
+        monitor = FixedMonitor(connection, active)
+        rule = CancelRule(older_than=10)
+
+        matched = monitor.cancel_matching(rule, dry_run=True)
+        assert ["1", "2", "3"] == [request['request-id']
+                                   for request, match in matched]
+        assert [] == connection.cancelled
+
+        cancelled = monitor.cancel_matching([CancelRule(update=True), rule])
+        assert ["1", "3"] == [request['request-id']
+                              for request, match in cancelled]
+        assert "updates" == cancelled[1][1].name
+        assert ["1", "3"] == sorted([entry['request']['request-id']
+                                     for entry in monitor.history])
@@ -24,6 +24,9 @@ from mlconfig import MLConfig
 from marklogic.models.server import Server, HttpServer, XdbcServer
 from marklogic.models.server import OdbcServer, WebDAVServer
 from marklogic.models.cluster import LocalCluster
+from marklogic.models import requestmonitor
+from marklogic.models.requestmonitor import RequestMonitor, CancelRule
+from marklogic.client.eval import Eval
 
 class TestServer(MLConfig):
 
@@ -152,3 +155,26 @@ Z70Br83gcfxaz2TE4JaY0KNA4gGK7ycH8WUBikQtBmV1UsCGECAhX2xrD2yuCRyv\n\
         server.delete(self.connection)
         server = Server.lookup(self.connection, "foo-http")
         assert server is None
+
+    def test_request_monitor(self):
+        monitor = RequestMonitor(self.connection)
+        requests = monitor.requests()
+        for request in requests:
+            assert request['elapsed'] >= 0
+            assert request['update'] in (True, False)
+
+        rule = CancelRule(update=False, older_than=86400*365)
+        assert [] == monitor.cancel_matching(rule, dry_run=True)
+        assert 0 == len(monitor.history)
+
+    def test_request_monitor_queries(self):
+        # Statically check the queries without running them
+        for query in (requestmonitor._ACTIVE_REQUESTS,
+                      requestmonitor._CANCEL_REQUEST):
+            mleval = Eval(self.connection)
+            mleval.set_xquery('declare variable $query external;'
+                              + 'xdmp:eval($query, (), <options '
+                              + 'xmlns="xdmp:eval"><static-check>true'
+                              + '</static-check></options>)')
+            mleval.set_vars({"query": query})
+            assert [] == list(mleval.results())
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016 MarkLogic Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+def _load_tools():
+    """Load examples/tools.py, which isn't a package module."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "examples", "tools.py")
+    spec = importlib.util.spec_from_file_location("tools", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+tools = _load_tools()
+
+class FlakyWatcher(tools.Watcher):
+    """Records the changes synced; the first few syncs fail."""
+    def __init__(self, failures, stop):
+        tools.Watcher.__init__(self, debounce=0.05, min_interval=0.01,
+                               max_interval=0.05)
+        self.failures = failures
+        self.stop = stop
+        self.attempts = []
+        self.synced = {}
+        self.started = threading.Event()
+
+    def snapshot(self, directory):
+        snapshot = tools.Watcher.snapshot(self, directory)
+        self.started.set()
+        return snapshot
+
+    def _observe(self, directory, wake):
+        return None
+
+    def sync(self, conn, directory, changes):
+        self.attempts.append(sorted(changes))
+        if len(self.attempts) <= self.failures:
+            raise IOError("connection refused")
+        self.synced.update(changes)
+        if "/b.txt" in self.synced:
+            self.stop.set()
+
+class TestWatcher(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        with open(self.dir + name, "w") as data:
+            data.write(text)
+
+    def watch(self, failures):
+        stop = threading.Event()
+        watcher = FlakyWatcher(failures, stop)
+        thread = threading.Thread(target=watcher.watch,
+                                  args=(None, self.dir, stop))
+        thread.start()
+        watcher.started.wait(10)
+        self.write("/a.txt", "a")
+        self.write("/b.txt", "b")
+        thread.join(10)
+        stop.set()
+        thread.join()
+        return watcher
+
+    def test_sync(self):
+        watcher = self.watch(0)
+        assert ["/a.txt", "/b.txt"] == sorted(watcher.synced)
+
+    def test_retry(self):
+        # A failed sync doesn't stop the watcher or lose the changes
+        watcher = self.watch(2)
+        assert len(watcher.attempts) >= 3
+        assert ["/a.txt", "/b.txt"] == sorted(watcher.synced)
+        for path in watcher.synced:
+            assert watcher.synced[path] is not None